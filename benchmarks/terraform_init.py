@@ -0,0 +1,73 @@
+""" Compares initializing terraform init dirs with a cold and with a warm dcos-launch cache.
+
+A cold run starts from an empty cache, so the module is copied and every provider plugin
+is downloaded. Warm runs share one cache that was filled beforehand. Requires terraform
+on the PATH.
+
+Usage:
+  terraform_init.py [--module=PATH] [--runs=N]
+
+Options:
+  --module=PATH  Local terraform module source to initialize from (e.g. a checkout of
+                 terraform-dcos/aws). Defaults to a small generated module that uses the
+                 null provider and a nested module.
+  --runs=N       Number of init dirs to initialize for each cache state [default: 3].
+"""
+import os
+import shutil
+import tempfile
+import time
+
+from docopt import docopt
+
+from dcos_launch import terraform
+
+GENERATED_MODULE = {
+    'main.tf': 'resource "null_resource" "benchmark" {}\n\nmodule "nested" {\n  source = "./nested"\n}\n',
+    'nested/main.tf': 'output "nested" {\n  value = "nested"\n}\n'}
+
+
+def write_generated_module(path: str):
+    for name, content in GENERATED_MODULE.items():
+        os.makedirs(os.path.dirname(os.path.join(path, name)), exist_ok=True)
+        with open(os.path.join(path, name), 'w') as f:
+            f.write(content)
+
+
+def time_init(module: str, work_dir: str) -> float:
+    init_dir = tempfile.mkdtemp(prefix='terraform-init-', dir=work_dir)
+    start = time.time()
+    terraform.init_from_module('terraform', module, init_dir)
+    return time.time() - start
+
+
+def main():
+    args = docopt(__doc__)
+    runs = int(args['--runs'])
+    work_dir = tempfile.mkdtemp(prefix='dcos-launch-benchmark-')
+    try:
+        module = args['--module']
+        if module is None:
+            module = os.path.join(work_dir, 'module')
+            write_generated_module(module)
+        module = os.path.abspath(module)
+
+        cold = list()
+        for i in range(runs):
+            os.environ['DCOS_LAUNCH_CACHE_DIR'] = os.path.join(work_dir, 'cold-cache-{}'.format(i))
+            cold.append(time_init(module, work_dir))
+
+        os.environ['DCOS_LAUNCH_CACHE_DIR'] = os.path.join(work_dir, 'warm-cache')
+        time_init(module, work_dir)
+        warm = [time_init(module, work_dir) for _ in range(runs)]
+
+        print('cold cache: mean {:.2f}s over {} runs ({})'.format(
+            sum(cold) / runs, runs, ', '.join('{:.2f}s'.format(t) for t in cold)))
+        print('warm cache: mean {:.2f}s over {} runs ({})'.format(
+            sum(warm) / runs, runs, ', '.join('{:.2f}s'.format(t) for t in warm)))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+""" Times validating every config in dcos_launch/sample_configs.
+
+Validation runs offline so that no GitHub lookups are timed, and placeholder cloud
+credentials are set where they are missing so the region and zone defaults resolve.
+Configs that fail to validate in this environment (e.g. a referenced file is missing)
+are reported and skipped.
+
+Usage:
+  validate_sample_configs.py [--runs=N] [<config_path>...]
+
+Options:
+  --runs=N  Number of times each config is validated [default: 100].
+"""
+import copy
+import glob
+import os
+import time
+
+from docopt import docopt
+
+from dcos_launch import config
+
+SAMPLE_CONFIGS_DIR = os.path.join(os.path.dirname(config.__file__), 'sample_configs')
+PLACEHOLDER_ENV = {
+    'DCOS_LAUNCH_OFFLINE': '1',
+    'AWS_REGION': 'us-west-2',
+    'GCE_ZONE': 'us-west1-a',
+    'AZURE_LOCATION': 'westus'}
+
+
+def main():
+    args = docopt(__doc__)
+    runs = int(args['--runs'])
+    for key, value in PLACEHOLDER_ENV.items():
+        os.environ.setdefault(key, value)
+    config_paths = args['<config_path>'] or sorted(glob.glob(os.path.join(SAMPLE_CONFIGS_DIR, '*.yaml')))
+
+    total = 0
+    for config_path in config_paths:
+        user_config = config.load_config(config_path)
+        config_dir = os.path.dirname(os.path.abspath(config_path))
+        try:
+            config.get_validated_config(copy.deepcopy(user_config), config_dir)
+        except Exception as ex:
+            print('{}: skipped ({})'.format(os.path.basename(config_path), ex))
+            continue
+        start = time.time()
+        for _ in range(runs):
+            config.get_validated_config(copy.deepcopy(user_config), config_dir)
+        elapsed = time.time() - start
+        total += elapsed
+        print('{}: {:.2f}ms per validation'.format(os.path.basename(config_path), elapsed / runs * 1000))
+    print('total: {:.2f}s for {} runs of {} configs'.format(total, runs, len(config_paths)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+""" Compares loading and dumping large launcher documents with the pure Python YAML
+loader and dumper and with the util helpers, which use libyaml when PyYAML was built
+against it.
+
+The documents are a dcos_config for a cluster with many agents and a GCP deployment
+manifest with many resources, as generated by BareClusterDeployment.create.
+
+Usage:
+  yaml_load_dump.py [--nodes=N] [--runs=N]
+
+Options:
+  --nodes=N  Number of agents in the dcos_config and instance templates in the
+             deployment manifest [default: 200].
+  --runs=N   Number of times each document is loaded and dumped [default: 10].
+"""
+import time
+
+import yaml
+from docopt import docopt
+
+from dcos_launch import util
+from dcos_launch.platforms import gcp
+
+
+def make_dcos_config(nodes: int) -> dict:
+    return {
+        'cluster_name': 'benchmark',
+        'platform': 'aws',
+        'master_discovery': 'static',
+        'master_list': ['10.0.0.{}'.format(i) for i in range(1, 4)],
+        'agent_list': ['10.{}.{}.{}'.format(i // 65536, i // 256 % 256, i % 256) for i in range(nodes)],
+        'resolvers': ['8.8.8.8', '8.8.4.4'],
+        'check_time': False,
+        'exhibitor_storage_backend': 'static',
+        'fault_domain_enabled': True,
+        'license_key_contents': 'x' * 4096,
+        'ip_detect_contents': '#!/bin/sh\ncurl -fsSL http://169.254.169.254/latest/meta-data/local-ipv4\n' * 10}
+
+
+def make_deployment_manifest(nodes: int) -> dict:
+    resources = [gcp.network_resource('benchmark-network')]
+    for i in range(nodes):
+        resources.append(gcp.instance_template_resource(
+            'benchmark-template-{}'.format(i), 'project', 'benchmark-network', 'n1-standard-4', 42, 'pd-ssd',
+            'centos-cloud', 'family/centos-7', 'centos', 'ssh-rsa ' + 'A' * 372, False, 'benchmark'))
+        resources.append(gcp.managed_instance_group_resource(
+            'benchmark-group-{}'.format(i), 'benchmark-template-{}'.format(i), 'us-central1-a', 3))
+    resources.append(gcp.external_firewall_resource('benchmark-firewall', 'benchmark-network'))
+    resources.append(gcp.internal_firewall_resource('benchmark-firewall', 'benchmark-network', 'benchmark'))
+    return {'resources': resources}
+
+
+def time_runs(f, runs: int) -> float:
+    start = time.time()
+    for _ in range(runs):
+        f()
+    return (time.time() - start) / runs
+
+
+def main():
+    args = docopt(__doc__)
+    nodes = int(args['--nodes'])
+    runs = int(args['--runs'])
+    print('util helpers use {} and {}'.format(util.YamlLoader.__name__, util.YamlDumper.__name__))
+    for name, document in (('dcos_config', make_dcos_config(nodes)),
+                           ('deployment manifest', make_deployment_manifest(nodes))):
+        text = util.dump_yaml(document, default_flow_style=False)
+        assert util.load_yaml(text) == yaml.safe_load(text) == document
+        print('{} ({} KiB):'.format(name, len(text) // 1024))
+        print('  load: pure {:.3f}s, helper {:.3f}s'.format(
+            time_runs(lambda: yaml.load(text, Loader=yaml.SafeLoader), runs),
+            time_runs(lambda: util.load_yaml(text), runs)))
+        print('  dump: pure {:.3f}s, helper {:.3f}s'.format(
+            time_runs(lambda: yaml.dump(document, Dumper=yaml.SafeDumper, default_flow_style=False), runs),
+            time_runs(lambda: util.dump_yaml(document, default_flow_style=False), runs)))
+
+
+if __name__ == '__main__':
+    main()
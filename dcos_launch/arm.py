@@ -20,6 +20,7 @@ class AzureResourceGroupLauncher(dcos_launch.util.AbstractLauncher):
             dcos_launch.util.set_from_env('AZURE_CLIENT_SECRET'),
             dcos_launch.util.set_from_env('AZURE_TENANT_ID'))
         self.config = config
+        self._resource_group = None
         log.debug('Using Azure Resource Group Launcher')
 
     def create(self):
@@ -28,7 +29,8 @@ class AzureResourceGroupLauncher(dcos_launch.util.AbstractLauncher):
             self.config['template_url'],
             self.config['deployment_name'],
             self.config['template_parameters'],
-            self.config.get('tags'))
+            self.config.get('tags'),
+            skip_validation=self.config['skip_template_validation'])
         return self.config
 
     def wait(self):
@@ -45,6 +47,14 @@ class AzureResourceGroupLauncher(dcos_launch.util.AbstractLauncher):
     def delete(self):
         self.resource_group.delete()
 
+    def start_delete(self) -> dict:
+        # deleting a resource group never waits for it
+        self.delete()
+        return dict()
+
+    def get_delete_status(self, pending_delete: dict) -> str:
+        return self.resource_group.get_delete_status()
+
     def key_helper(self):
         """ Adds private key to the config and injects the public key into
         the template parameters
@@ -60,7 +70,12 @@ class AzureResourceGroupLauncher(dcos_launch.util.AbstractLauncher):
 
     @property
     def resource_group(self):
-        try:
-            return dcos_launch.platforms.arm.DcosAzureResourceGroup(self.config['deployment_name'], self.azure_wrapper)
-        except Exception as ex:
-            raise dcos_launch.util.LauncherError('GroupNotFound', None) from ex
+        # describe looks up several host lists and FQDNs, which share the NICs and
+        # public IPs the group lists once
+        if self._resource_group is None:
+            try:
+                self._resource_group = dcos_launch.platforms.arm.DcosAzureResourceGroup(
+                    self.config['deployment_name'], self.azure_wrapper)
+            except Exception as ex:
+                raise dcos_launch.util.LauncherError('GroupNotFound', None) from ex
+        return self._resource_group
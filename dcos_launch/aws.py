@@ -86,7 +86,7 @@ class DcosCloudformationLauncher(util.AbstractLauncher):
             'private_agents': util.convert_host_list(self.stack.get_private_agent_ips()),
             'public_agents': util.convert_host_list(self.stack.get_public_agent_ips())}
 
-    def delete(self):
+    def _wait_for_other_operation(self):
         # If the stack is in the middle of another operation (probably because its tags were being updated), wait for
         # the operation to complete before trying to delete it
         if 'IN_PROGRESS' in self.stack.get_status():
@@ -97,6 +97,9 @@ class DcosCloudformationLauncher(util.AbstractLauncher):
                                          end_states=['CREATE_COMPLETE', 'ROLLBACK_FAILED', 'ROLLBACK_COMPLETE',
                                                      'UPDATE_COMPLETE', 'UPDATE_ROLLBACK_FAILED',
                                                      'UPDATE_ROLLBACK_COMPLETE'])
+
+    def delete(self):
+        self._wait_for_other_operation()
         self.stack.delete()
         # we must wait for the stack to be deleted for 2 reasons:
         # 1. required to remove network resources on which it depends
@@ -115,6 +118,27 @@ class DcosCloudformationLauncher(util.AbstractLauncher):
         elif len(self.config['temp_resources']) > 0:
             self.delete_temp_resources(self.config['temp_resources'])
 
+    def start_delete(self) -> dict:
+        self._wait_for_other_operation()
+        self.stack.delete()
+        return dict()
+
+    def get_delete_status(self, pending_delete: dict) -> str:
+        # a deleted stack can only be looked up by its ID
+        status = self.boto_wrapper.resource('cloudformation').Stack(self.config['stack_id']).stack_status
+        if status == 'DELETE_COMPLETE':
+            return util.DELETE_COMPLETE
+        if status == 'DELETE_FAILED':
+            return util.DELETE_FAILED
+        if status not in ('DELETE_IN_PROGRESS', 'CREATE_COMPLETE') and 'IN_PROGRESS' not in status:
+            log.info('Deletion was interrupted by another operation (most likely tagging). Retrying to delete...')
+            self.stack.delete()
+        return util.DELETE_PENDING
+
+    def finish_delete(self, pending_delete: dict):
+        if len(self.config['temp_resources']) > 0:
+            self.delete_temp_resources(self.config['temp_resources'])
+
     def delete_temp_resources(self, temp_resources):
         if 'key_name' in temp_resources:
             self.boto_wrapper.delete_key_pair(temp_resources['key_name'])
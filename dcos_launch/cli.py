@@ -2,21 +2,46 @@
 
 Usage:
   dcos-launch create [-L LEVEL -c PATH -i PATH]
-  dcos-launch wait [-L LEVEL -i PATH]
+  dcos-launch wait [-L LEVEL -i PATH -r LIST]
   dcos-launch describe [-L LEVEL -i PATH]
   dcos-launch pytest [-L LEVEL -i PATH -e LIST] [--] [<pytest_extras>]...
-  dcos-launch delete [-L LEVEL -i PATH]
+  dcos-launch delete [-L LEVEL -i PATH] [--no-wait | --status]
+  dcos-launch upgrade [-L LEVEL -i PATH] <installer_url>
+  dcos-launch fleet [-L LEVEL -j NUM -d DIR] <config_path>...
+  dcos-launch validate [-L LEVEL -j NUM -o PATH] <config_path>...
+  dcos-launch reap [-L LEVEL -j NUM -o PATH] <info_path>...
 
 Commands:
   create    Reads the file given by --config-path, creates the cluster
               described therein and finally dumps a JSON file to the path
               given in --info-path which can then be used with the wait,
               describe, pytest, and delete calls.
-  wait      Block until the cluster is up and running.
+  wait      Block until the cluster is up and running. For onprem, the
+              progress of every install phase is recorded in a journal next
+              to the info JSON, so re-running wait resumes unfinished work.
   describe  Return additional information about the composition of the cluster.
   pytest    Runs integration test suite on cluster. Can optionally supply
               options and arguments to pytest
-  delete    Destroying the provided cluster deployment.
+  delete    Destroying the provided cluster deployment. With --no-wait, the
+              deletion is only started and recorded as pending in the info
+              JSON. --status checks on it like reap.
+  upgrade   Upgrades an onprem cluster to the DC/OS version of <installer_url>.
+              Masters are upgraded one at a time and agents in waves whose
+              timings are recorded in the info JSON.
+  fleet     Creates the terraform clusters of every <config_path>, at most
+              --max-concurrent at a time. An info JSON per cluster, named
+              after its config, and a fleet_summary.json with the outcome and
+              timing of every create are written to --info-dir.
+  validate  Validates every <config_path>, which may also be a glob, in
+              --max-concurrent processes without creating anything. Release
+              versions are not looked up online. A JSON report with the errors
+              and timing of every config is printed and optionally written to
+              --report-path.
+  reap      Checks the deletions started with delete --no-wait of every
+              <info_path>, which may also be a glob, --max-concurrent at a
+              time. Deletions that are done are cleaned up after and recorded
+              in their info JSON. A JSON report with the state of every
+              deletion is printed and optionally written to --report-path.
 
 Options:
   -c PATH --config-path=PATH
@@ -24,6 +49,21 @@ Options:
   -i PATH --info-path=PATH
             JSON file output by create and consumed by wait, describe,
             and delete [default: cluster_info.json].
+  -r LIST --restart-phase=LIST
+            Comma-delimited list of onprem install phases to redo on wait,
+            along with every phase following them. Phases are: installer,
+            genconf, prereqs_bundle, ssh, selinux, prereqs, preflight, deploy,
+            postflight.
+  -j NUM --max-concurrent=NUM
+            Number of clusters a fleet creates, configs validate checks, or
+            deletions reap checks at the same time [default: 4].
+  -d DIR --info-dir=DIR
+            Directory for the info JSONs of a fleet [default: .].
+  -o PATH --report-path=PATH
+            File to also write the validate or reap report to.
+  --no-wait
+            Only start the deletion and return.
+  --status  Check on a deletion started with --no-wait.
   -e LIST --env=LIST
             Specifies a comma-delimited list of environment variables to be
             passed from the local environment into the test environment.
@@ -31,11 +71,16 @@ Options:
             One of: critical, error, warning, info, debug, and trace
             [default: debug].
 """
+import concurrent.futures
+import glob
 import os
 import sys
+import time
 
 import dcos_launch
 import dcos_launch.config
+import dcos_launch.platforms.onprem
+import dcos_launch.terraform
 from dcos_launch import util
 from dcos_test_utils import logger
 from docopt import docopt
@@ -51,6 +96,10 @@ def do_main(args):
             raise dcos_launch.util.LauncherError(
                 'InputConflict',  '{} already exists! Delete this or specify a '
                 'different cluster info path with the -i option'.format(info_path))
+        journal_path = util.get_journal_path(info_path)
+        if os.path.exists(journal_path):
+            # left over from a previous cluster with the same info path
+            os.remove(journal_path)
         launcher = dcos_launch.get_launcher(config)
         cluster_info = launcher.create()
         util.write_json(info_path, cluster_info)
@@ -59,6 +108,18 @@ def do_main(args):
             raise create_exception
         return 0
 
+    if args['fleet']:
+        return do_fleet(args['<config_path>'], args['--info-dir'], args['--max-concurrent'])
+
+    if args['validate']:
+        return do_validate(args['<config_path>'], args['--max-concurrent'], args['--report-path'])
+
+    if args['reap']:
+        return do_reap(args['<info_path>'], args['--max-concurrent'], args['--report-path'])
+
+    if args['delete'] and args['--status']:
+        return do_reap([args['--info-path']], '1', None)
+
     try:
         info = util.load_json(args['--info-path'])
     except FileNotFoundError as ex:
@@ -67,8 +128,13 @@ def do_main(args):
     launcher = dcos_launch.get_launcher(info)
 
     if args['wait']:
+        journal = util.PhaseJournal(
+            dcos_launch.platforms.onprem.INSTALL_PHASES, util.get_journal_path(args['--info-path']))
+        if args['--restart-phase'] is not None:
+            for phase in args['--restart-phase'].split(','):
+                journal.restart(phase)
         launcher.wait()
-        launcher.install_dcos()
+        launcher.install_dcos(journal=journal)
         print('Cluster is ready!')
         return 0
 
@@ -93,10 +159,146 @@ def do_main(args):
         env_dict = {e: os.environ[e] for e in var_list}
         return launcher.test(args['<pytest_extras>'], env_dict)
 
+    if args['delete'] and args['--no-wait']:
+        info['pending_delete'] = launcher.start_delete()
+        info['pending_delete'].update({'status': util.DELETE_PENDING, 'start_time': time.time()})
+        util.write_json(args['--info-path'], info)
+        print('Deletion started. Check on it with: dcos-launch delete --status -i {}'.format(args['--info-path']))
+        return 0
+
     if args['delete']:
         launcher.delete()
+        journal_path = util.get_journal_path(args['--info-path'])
+        if os.path.exists(journal_path):
+            os.remove(journal_path)
         return 0
 
+    if args['upgrade']:
+        info['upgrade_waves'] = launcher.upgrade(args['<installer_url>'])
+        util.write_json(args['--info-path'], info)
+        print(util.json_prettyprint(info['upgrade_waves']))
+        return 0
+
+
+def check_max_concurrent(max_concurrent: str):
+    if not max_concurrent.isdigit() or int(max_concurrent) < 1:
+        raise dcos_launch.util.LauncherError(
+            'OptionError', '--max-concurrent must be a positive integer, not {}'.format(max_concurrent))
+
+
+def do_fleet(config_paths: list, info_dir: str, max_concurrent: str) -> int:
+    check_max_concurrent(max_concurrent)
+    info_paths = [os.path.join(info_dir, os.path.splitext(os.path.basename(p))[0] + '.info.json')
+                  for p in config_paths]
+    if len(set(info_paths)) != len(info_paths):
+        raise dcos_launch.util.LauncherError(
+            'InputConflict', 'Configs of a fleet must have distinct file names, as their info JSONs are named '
+            'after them')
+    for info_path in info_paths:
+        if os.path.exists(info_path):
+            raise dcos_launch.util.LauncherError(
+                'InputConflict', '{} already exists! Delete this or specify a different directory with the -d '
+                'option'.format(info_path))
+    # validate everything before launching anything
+    configs = [dcos_launch.config.get_validated_config_from_path(p) for p in config_paths]
+    os.makedirs(info_dir, exist_ok=True)
+
+    start = time.time()
+    results = dcos_launch.terraform.create_fleet(configs, int(max_concurrent))
+    summary = {'max_concurrent': int(max_concurrent), 'clusters': list()}
+    for config_path, info_path, (info, create_exception, seconds) in zip(config_paths, info_paths, results):
+        util.write_json(info_path, info)
+        summary['clusters'].append({
+            'config_path': config_path,
+            'info_path': info_path,
+            'init_dir': info['init_dir'],
+            'terraform_parallelism': info['terraform_parallelism'],
+            'create_seconds': round(seconds, 1),
+            'error': repr(create_exception) if create_exception else None})
+    summary['total_seconds'] = round(time.time() - start, 1)
+    util.write_json(os.path.join(info_dir, 'fleet_summary.json'), summary)
+    print(util.json_prettyprint(summary))
+    return 1 if any(c['error'] for c in summary['clusters']) else 0
+
+
+def expand_paths(patterns: list) -> list:
+    """ Expands globs, keeping the order they were given in. Patterns without matches are
+    kept as they are so that they are reported as missing
+    """
+    config_paths = list()
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern, recursive=True)) or [pattern]:
+            if path not in config_paths:
+                config_paths.append(path)
+    return config_paths
+
+
+def do_validate(patterns: list, max_concurrent: str, report_path: str) -> int:
+    check_max_concurrent(max_concurrent)
+    config_paths = expand_paths(patterns)
+    start = time.time()
+    results = dcos_launch.config.validate_config_files(config_paths, int(max_concurrent))
+    report = {
+        'configs': results,
+        'valid': sum(1 for r in results if r['valid']),
+        'invalid': sum(1 for r in results if not r['valid']),
+        'total_seconds': round(time.time() - start, 3)}
+    if report_path is not None:
+        util.write_json(report_path, report)
+    print(util.json_prettyprint(report))
+    return 1 if report['invalid'] else 0
+
+
+def reap_deletion(info_path: str) -> dict:
+    """ Checks on the deletion that delete --no-wait started for the cluster of info_path. Once it is complete,
+    whatever delete would have cleaned up afterwards is removed. Finished deletions are recorded in the info JSON
+    so that they are not checked again
+    """
+    start = time.time()
+    result = {'info_path': info_path, 'status': None, 'error': None}
+    try:
+        info = util.load_json(info_path)
+        pending_delete = info.get('pending_delete')
+        if pending_delete is None:
+            raise dcos_launch.util.LauncherError(
+                'InputConflict', 'No deletion was started with delete --no-wait for {}'.format(info_path))
+        status = pending_delete['status']
+        if status == util.DELETE_PENDING:
+            launcher = dcos_launch.get_launcher(info)
+            status = launcher.get_delete_status(pending_delete)
+            if status == util.DELETE_COMPLETE:
+                launcher.finish_delete(pending_delete)
+                journal_path = util.get_journal_path(info_path)
+                if os.path.exists(journal_path):
+                    os.remove(journal_path)
+            if status != util.DELETE_PENDING:
+                pending_delete.update({
+                    'status': status,
+                    'delete_seconds': round(time.time() - pending_delete['start_time'], 1)})
+                util.write_json(info_path, info)
+        result['status'] = status
+    except Exception as ex:
+        result['error'] = repr(ex)
+    result['seconds'] = round(time.time() - start, 3)
+    return result
+
+
+def do_reap(patterns: list, max_concurrent: str, report_path: str) -> int:
+    check_max_concurrent(max_concurrent)
+    info_paths = expand_paths(patterns)
+    start = time.time()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=int(max_concurrent)) as executor:
+        results = list(executor.map(reap_deletion, info_paths))
+    report = {'clusters': results}
+    for status in (util.DELETE_PENDING, util.DELETE_COMPLETE, util.DELETE_FAILED):
+        report[status] = sum(1 for r in results if r['status'] == status)
+    report['errors'] = sum(1 for r in results if r['error'])
+    report['total_seconds'] = round(time.time() - start, 3)
+    if report_path is not None:
+        util.write_json(report_path, report)
+    print(util.json_prettyprint(report))
+    return 1 if report[util.DELETE_FAILED] or report['errors'] else 0
+
 
 def main(argv=None):
     args = docopt(__doc__, argv=argv, version='dcos-launch {}'.format(dcos_launch.VERSION))
@@ -1,8 +1,12 @@
 """ Module for defining and validating user-provided configuration
 """
+import concurrent.futures
+import copy
+import functools
 import logging
 import os
 import sys
+import time
 import uuid
 
 import requests
@@ -14,6 +18,18 @@ from dcos_launch.platforms import aws, gcp
 
 log = logging.getLogger(__name__)
 
+# release lookups are reused for this long before GitHub is asked again
+GITHUB_RELEASE_CACHE_TTL = 6 * 60 * 60
+GITHUB_RELEASE_TIMEOUT = 10
+
+# config fields defaulting to the latest GitHub release of a repo
+RELEASE_VERSION_FIELDS = {
+    'terraform_version': 'hashicorp/terraform',
+    'dcos_engine_version': 'Azure/dcos-engine'}
+
+# org/repo -> where its latest release was resolved from in this process
+_release_sources = dict()
+
 
 def expand_path(path: str, relative_dir: str) -> str:
     """ Returns an absolute path by performing '~' and '..' substitution target path
@@ -31,7 +47,7 @@ def expand_path(path: str, relative_dir: str) -> str:
 def load_config(config_path: str) -> dict:
     try:
         with open(config_path) as f:
-            return yaml.safe_load(f)
+            return util.load_yaml(f)
     except yaml.YAMLError as ex:
         raise util.LauncherError('InvalidYaml', None) from ex
     except FileNotFoundError as ex:
@@ -66,6 +82,13 @@ class LaunchValidator(cerberus.Validator):
             return value
         return expand_path(value, self.config_dir)
 
+    def _validator_gce_group_names(self, field, value):
+        deployment_name = self.document.get('deployment_name', '')
+        for group_name in gcp.get_instance_group_names(deployment_name, list(set(value))).values():
+            if len(group_name) > gcp.NAME_MAX_LENGTH:
+                self._error(field, 'Instance group name {} is longer than {} characters, use a shorter '
+                                   'deployment_name'.format(group_name, gcp.NAME_MAX_LENGTH))
+
 
 def _expand_error_dict(errors: dict) -> str:
     message = ''
@@ -110,11 +133,59 @@ def check_selinux_compatible(version: str):
     return False
 
 
+def _get_provider_and_platform(user_config: dict, config_dir: str) -> tuple:
+    """ Validates just the fields that decide which schema the rest of the config is validated with
+    """
+    validator = LaunchValidator(
+        {'provider': COMMON_SCHEMA['provider']}, config_dir=config_dir, allow_unknown=True)
+    if not validator.validate(user_config):
+        _raise_errors(validator)
+    provider = user_config['provider']
+    validator = LaunchValidator(
+        {'provider': COMMON_SCHEMA['provider'], 'platform': PROVIDER_SCHEMAS[provider]['platform']},
+        config_dir=config_dir, allow_unknown=True)
+    if not validator.validate(user_config):
+        _raise_errors(validator)
+    return provider, validator.document['platform']
+
+
+def get_schema(provider: str, platform: str) -> dict:
+    """ Returns the complete schema for a provider and platform. Schemas are only merged
+    once per process, callers get their own copy that they are free to modify
+    """
+    return copy.deepcopy(_get_schema(provider, platform))
+
+
+@functools.lru_cache()
+def _get_schema(provider: str, platform: str) -> dict:
+    schema = dict(COMMON_SCHEMA)
+    schema.update(PROVIDER_SCHEMAS[provider])
+    if platform == 'aws':
+        if provider != 'terraform':
+            schema.update(AWS_TEMPLATE_OPTIONS_SCHEMA)
+        schema.update(AWS_REGION_SCHEMA)
+        if provider == 'onprem':
+            schema.update(AWS_ONPREM_SCHEMA)
+    elif platform == 'gcp':
+        if provider != 'terraform':
+            schema.update(GCE_ZONE_SCHEMA)
+        if provider == 'onprem':
+            schema.update(GCP_ONPREM_SCHEMA)
+    elif platform == 'azure':
+        if provider != 'terraform':
+            schema.update(AZURE_TEMPLATE_OPTIONS_SCHEMA)
+            schema.update(AZURE_LOCATION_SCHEMA)
+    else:
+        raise NotImplementedError()
+    return schema
+
+
 def get_validated_config(user_config: dict, config_dir: str) -> dict:
     """ Returns validated a finalized argument dictionary for dcos-launch
     Given the huge range of configuration space provided by this configuration
-    file, it must be processed in three steps (common, provider-specifc,
-    platform-specific)
+    file, the provider and platform are validated first, as they determine the
+    schema that the whole config is then validated and normalized with in a
+    single pass
     Args:
         use_config: options (perhaps incomplete) provided by the user
         config_dir: path for the config file for resolving relative
@@ -123,110 +194,82 @@ def get_validated_config(user_config: dict, config_dir: str) -> dict:
     owner = os.environ.get('USER')
     if owner:
         user_config.setdefault('tags', {'owner': owner})
-
-    # validate against the fields common to all configs
     user_config['config_dir'] = config_dir
-    validator = LaunchValidator(COMMON_SCHEMA, config_dir=config_dir, allow_unknown=True)
-    if 'dcos_version' in user_config:
-        user_config['dcos_version'] = validator.normalized(user_config)['dcos_version']
-    if not validator.validate(user_config):
-        _raise_errors(validator)
 
-    # add provider specific information to the basic validator
-    provider = validator.normalized(user_config)['provider']
+    provider, platform = _get_provider_and_platform(user_config, config_dir)
     if provider == 'onprem':
-        validator.schema.update(ONPREM_DEPLOY_COMMON_SCHEMA)
         user_config.setdefault('dcos_config', {})
         user_config['dcos_config'].setdefault('platform', user_config['platform'])
         user_config['dcos_config'].setdefault('rexray_config_preset', user_config['platform'])
-    elif provider == 'terraform':
-        validator.schema.update(TERRAFORM_COMMON_SCHEMA)
-    elif provider in ('aws', 'azure'):
-        validator.schema.update(TEMPLATE_DEPLOY_COMMON_SCHEMA)
-    elif provider == 'dcos-engine':
-        validator.schema.update(DCOS_ENGINE_SCHEMA)
-    else:
-        raise Exception('Unknown provider!: {}'.format(provider))
-
-    # validate again before attempting to add platform information
-    if not validator.validate(user_config):
-        _raise_errors(validator)
-
-    # use the intermediate provider-validated config to add the platform schema
-    platform = validator.normalized(user_config)['platform']
-    if provider == 'terraform' and 'ssh_user' in user_config['terraform_config']:
+    if provider == 'terraform' and 'ssh_user' in user_config.get('terraform_config', {}):
         if platform in ('gcp', 'gce'):
             user_config['terraform_config']['gcp_ssh_user'] = user_config['ssh_user']
         else:
             raise Exception('Cannot currently set ssh_user parameter for ' + platform)
+    if platform == 'gce':
+        # only use gcp here on out
+        platform = user_config['platform'] = 'gcp'
+
+    validator = LaunchValidator(get_schema(provider, platform), config_dir=config_dir)
+    if not validator.validate(user_config):
+        _raise_errors(validator)
+    if 'genconf_dir' in user_config:
+        if 'dcos_config' in user_config:
+            _validate_genconf_scripts(user_config['genconf_dir'], user_config['dcos_config'])
+    config = validator.document
 
-    if validator.normalized(user_config).get('auto_set_selinux'):
+    if config.get('auto_set_selinux'):
         if 'enable_selinux' in user_config:
             raise Exception('Parameter conflict: enable_selinux cannot be in config if auto_set_selinux is true')
 
         selinux_compatible = False
         try:
-            selinux_compatible = check_selinux_compatible(user_config.get('dcos_version', ''))
+            selinux_compatible = check_selinux_compatible(config.get('dcos_version', ''))
         except Exception:
             pass
 
-        user_config['enable_selinux'] = selinux_compatible and \
-            'dcos-enterprise' in user_config['installer_url'] and \
-            user_config['os_name'] == 'cent-os-7-dcos-prereqs'
+        config['enable_selinux'] = selinux_compatible and \
+            'dcos-enterprise' in config['installer_url'] and \
+            config.get('os_name') == 'cent-os-7-dcos-prereqs'
 
-    if platform == 'aws':
-        region = None
-        if provider == 'terraform':
-            region = user_config['terraform_config'].get('aws_region')
-        else:
-            validator.schema.update({
-                'disable_rollback': {
-                    'type': 'boolean',
-                    'required': False,
-                    'default': False},
-                'zen_helper': {
-                    'type': 'boolean',
-                    'default': False}})
-        validator.schema.update({
-            'aws_region': {
-                'type': 'string',
-                'required': True,
-                'default_setter':
-                    lambda doc:
-                    region if region else
-                    os.environ['AWS_REGION'] if 'AWS_REGION' in os.environ else
-                    util.set_from_env('AWS_DEFAULT_REGION')}})
-        if provider == 'onprem':
-            validator.schema.update(AWS_ONPREM_SCHEMA)
-    elif platform in ('gcp', 'gce'):
-        if provider != 'terraform':
-            validator.schema.update({
-                'gce_zone': {
-                    'type': 'string',
-                    'required': True,
-                    'default_setter': lambda doc: util.set_from_env('GCE_ZONE')}})
-        # only use gcp here on out
-        user_config['platform'] = 'gcp'
-        if provider == 'onprem':
-            validator.schema.update(GCP_ONPREM_SCHEMA)
-    elif platform == 'azure':
-        if provider != 'terraform':
-            validator.schema.update({
-                'azure_location': {
-                    'type': 'string',
-                    'required': True,
-                    'default_setter': lambda doc: util.set_from_env('AZURE_LOCATION')}})
-    else:
-        raise NotImplementedError()
+    # record which versions were looked up rather than given, and where from
+    for field, repo in RELEASE_VERSION_FIELDS.items():
+        if field in config and field not in user_config:
+            config.setdefault('resolved_versions', dict())[field] = {
+                'version': config[field],
+                'source': _release_sources.get(repo, 'default')}
+    return config
 
-    # do final validation
-    validator.allow_unknown = False
-    if not validator.validate(user_config):
-        _raise_errors(validator)
-    if 'genconf_dir' in user_config:
-        if 'dcos_config' in user_config:
-            _validate_genconf_scripts(user_config['genconf_dir'], user_config['dcos_config'])
-    return validator.normalized(user_config)
+
+def _validate_config_file(config_path: str) -> dict:
+    """ Validates a single config for validate_config_files. Runs in a worker process,
+    which is put in offline mode so that only cached or default release versions are used
+    """
+    os.environ['DCOS_LAUNCH_OFFLINE'] = 'true'
+    start = time.time()
+    error = None
+    try:
+        get_validated_config_from_path(config_path)
+    except util.LauncherError as ex:
+        error = {'type': ex.error, 'message': ex.msg if ex.msg else str(ex.__cause__)}
+    except Exception as ex:
+        error = {'type': ex.__class__.__name__, 'message': str(ex)}
+    return {
+        'config_path': config_path,
+        'valid': error is None,
+        'error': error,
+        'seconds': round(time.time() - start, 3)}
+
+
+def validate_config_files(config_paths: list, max_workers: int) -> list:
+    """ Validates many configs in a pool of max_workers processes without creating anything.
+    Each worker builds a schema at most once per provider and platform and shares the
+    on-disk release lookup cache with the other workers. Returns a result per config in
+    the order of config_paths
+    """
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(
+            _validate_config_file, config_paths, chunksize=max(1, len(config_paths) // (max_workers * 4))))
 
 
 COMMON_SCHEMA = {
@@ -310,6 +353,11 @@ def _validate_genconf_dir(field, value, error):
         error(field, 'genconf_dir must be named genconf')
 
 
+def _validate_path_exists(field, value, error):
+    if not os.path.exists(value):
+        error(field, '{} does not exist'.format(value))
+
+
 def _validate_genconf_scripts(genconf_dir, dcos_config):
     for script in ('ip_detect', 'ip_detect_public', 'fault_domain_detect'):
         filename_key = script + '_filename'
@@ -368,7 +416,7 @@ ONPREM_DEPLOY_COMMON_SCHEMA = {
         'type': 'dict',
         'required': True,
         'allow_unknown': True,
-        'default_setter': lambda doc: yaml.load(util.read_file(os.path.join(doc['genconf_dir'], 'config.yaml'))),
+        'default_setter': lambda doc: util.load_yaml(util.read_file(os.path.join(doc['genconf_dir'], 'config.yaml'))),
         'schema': {
             'ip_detect_filename': {
                 'excludes': 'ip_detect_contents'},
@@ -417,6 +465,16 @@ ONPREM_DEPLOY_COMMON_SCHEMA = {
             },
         'validator': _validate_fault_domain_helper
     },
+    'bootstrap_docker_image_tarball': {
+        'type': 'string',
+        'coerce': 'expand_local_path',
+        'required': False,
+        'excludes': 'bootstrap_docker_registry_mirror',
+        'validator': _validate_path_exists},
+    'bootstrap_docker_registry_mirror': {
+        'type': 'string',
+        'required': False,
+        'excludes': 'bootstrap_docker_image_tarball'},
     'prereqs_script_filename': {
         'type': 'string',
         'default': 'install_prereqs.sh'
@@ -426,11 +484,44 @@ ONPREM_DEPLOY_COMMON_SCHEMA = {
         'required': False,
         'default': False
     },
+    'prereqs_bundle': {
+        'type': 'boolean',
+        'required': False,
+        'default': False
+    },
     'onprem_install_parallelism': {
         'type': 'integer',
         'required': False,
         'default': 10
     },
+    'onprem_install_retry_policy': {
+        'type': 'dict',
+        'required': False,
+        'default': dict(),
+        'keyschema': {
+            'type': 'string',
+            'allowed': ['default', 'selinux', 'prereqs', 'preflight', 'deploy', 'postflight']},
+        'valueschema': {
+            'type': 'dict',
+            'schema': {
+                'retries': {
+                    'type': 'integer',
+                    'min': 0},
+                'backoff': {
+                    'type': 'number',
+                    'min': 0},
+                'retryable_exit_codes': {
+                    'type': 'list',
+                    'schema': {'type': 'integer'}}
+                }
+            }
+    },
+    'onprem_upgrade_wave_size': {
+        'type': 'integer',
+        'required': False,
+        'min': 1,
+        'default': 5
+    },
 }
 
 
@@ -540,6 +631,9 @@ DCOS_ENGINE_SCHEMA = {
             'https://github.com/Azure/dcos-engine/releases/download/v{0}/dcos-engine-v{0}-{1}-amd64.tar.gz'.
                 format(doc['dcos_engine_version'], '{}'),
             'No DCOS-Engine distribution for {}'.format(sys.platform))},
+    'dcos_engine_tarball_sha256': {
+        'type': 'string',
+        'required': False},
     'acs_template_filename': {
         'type': 'string',
         'required': False},
@@ -686,6 +780,14 @@ GCP_ONPREM_SCHEMA = {
         'type': 'boolean',
         'required': False,
         'default': False},
+    'gce_zones': {
+        'type': 'list',
+        'required': False,
+        'minlength': 1,
+        'schema': {'type': 'string'},
+        'validator': 'gce_group_names',
+        # the fault domain helper makes up a placement, whereas the zones are real
+        'excludes': 'fault_domain_helper'},
 }
 
 
@@ -700,12 +802,43 @@ def set_key_helper(platform: str, terraform_config: dict):
 
 
 def get_latest_github_release(org: str, repo: str, default: str):
+    """ Looks up the latest release of a GitHub repo. Lookups are cached on disk for
+    GITHUB_RELEASE_CACHE_TTL. In offline mode, or if GitHub cannot be reached, the cached
+    version is used regardless of its age, and default if there is none
+    """
+    cache_path = os.path.join(util.get_cache_dir('github-releases'), '{}-{}.json'.format(org, repo))
+    cached = None
+    if os.path.exists(cache_path):
+        try:
+            cached = util.load_json(cache_path)
+        except ValueError:
+            log.warning('Ignoring corrupted release cache {}'.format(cache_path))
+
+    def resolved(version, source):
+        _release_sources['{}/{}'.format(org, repo)] = source
+        return version
+
+    if cached is not None and time.time() - cached['time'] < GITHUB_RELEASE_CACHE_TTL:
+        return resolved(cached['version'], 'cache')
+    if util.is_offline():
+        if cached is not None:
+            return resolved(cached['version'], 'cache')
+        log.info('Offline mode: using {} {}'.format(repo, default))
+        return resolved(default, 'default')
     try:
-        response = requests.get('https://api.github.com/repos/{}/{}/releases/latest'.format(org, repo))
-        return response.json()['tag_name'][1:]
+        response = requests.get('https://api.github.com/repos/{}/{}/releases/latest'.format(org, repo),
+                                timeout=GITHUB_RELEASE_TIMEOUT)
+        response.raise_for_status()
+        version = response.json()['tag_name'][1:]
     except Exception as e:
+        if cached is not None:
+            log.warning('Failed to get latest {} version. Using previously found {}. Error details: {}'.format(
+                repo, cached['version'], repr(e)))
+            return resolved(cached['version'], 'cache')
         log.error('Failed to get latest {} version. Defaulting to {}. Error details: {}'.format(repo, default, repr(e)))
-        return default
+        return resolved(default, 'default')
+    util.write_json(cache_path, {'version': version, 'time': time.time()})
+    return resolved(version, 'github')
 
 
 TERRAFORM_COMMON_SCHEMA = {
@@ -718,11 +851,13 @@ TERRAFORM_COMMON_SCHEMA = {
     },
     'terraform_tarball_url': {
         'type': 'string',
-        'readonly': True,
         'default_setter': lambda doc: get_platform_dependent_url(
             'https://releases.hashicorp.com/terraform/{0}/terraform_{0}_{1}_amd64.zip'.format(doc['terraform_version'],
                                                                                               sys.platform),
             'No Terraform distribution for {}'.format(sys.platform))},
+    'terraform_tarball_sha256': {
+        'type': 'string',
+        'required': False},
     'platform': {
         'type': 'string',
         'required': True,
@@ -740,7 +875,73 @@ TERRAFORM_COMMON_SCHEMA = {
     'terraform_dcos_enterprise_version': {
         'type': 'string',
         'default': 'master'},
+    'terraform_module_source': {
+        'type': 'string',
+        'required': False},
+    'terraform_module_cache': {
+        'type': 'boolean',
+        'default': True},
+    'terraform_parallelism': {
+        'type': 'integer',
+        'required': False,
+        'min': 1},
     'key_helper': {
         'type': 'boolean',
         'default_setter': lambda doc: set_key_helper(doc['platform'], doc['terraform_config'])},
 }
+
+
+def _get_aws_region(doc: dict) -> str:
+    region = doc.get('terraform_config', dict()).get('aws_region')
+    if region:
+        return region
+    if 'AWS_REGION' in os.environ:
+        return os.environ['AWS_REGION']
+    return util.set_from_env('AWS_DEFAULT_REGION')
+
+
+AWS_TEMPLATE_OPTIONS_SCHEMA = {
+    'disable_rollback': {
+        'type': 'boolean',
+        'required': False,
+        'default': False},
+    'zen_helper': {
+        'type': 'boolean',
+        'default': False}}
+
+
+AWS_REGION_SCHEMA = {
+    'aws_region': {
+        'type': 'string',
+        'required': True,
+        # terraform configs may set the region in terraform_config
+        'default_setter': _get_aws_region}}
+
+
+GCE_ZONE_SCHEMA = {
+    'gce_zone': {
+        'type': 'string',
+        'required': True,
+        'default_setter': lambda doc: doc['gce_zones'][0] if 'gce_zones' in doc else util.set_from_env('GCE_ZONE')}}
+
+
+AZURE_TEMPLATE_OPTIONS_SCHEMA = {
+    'skip_template_validation': {
+        'type': 'boolean',
+        'required': False,
+        'default': False}}
+
+
+AZURE_LOCATION_SCHEMA = {
+    'azure_location': {
+        'type': 'string',
+        'required': True,
+        'default_setter': lambda doc: util.set_from_env('AZURE_LOCATION')}}
+
+
+PROVIDER_SCHEMAS = {
+    'aws': TEMPLATE_DEPLOY_COMMON_SCHEMA,
+    'azure': TEMPLATE_DEPLOY_COMMON_SCHEMA,
+    'dcos-engine': DCOS_ENGINE_SCHEMA,
+    'onprem': ONPREM_DEPLOY_COMMON_SCHEMA,
+    'terraform': TERRAFORM_COMMON_SCHEMA}
@@ -1,5 +1,6 @@
 """ Launcher functionality for the Azure Resource Manager (ARM)
 """
+import hashlib
 import json
 import logging
 import os
@@ -8,7 +9,7 @@ import tarfile
 import tempfile
 import uuid
 
-import requests
+import filelock
 
 import dcos_launch.platforms.arm
 import dcos_launch.util
@@ -33,7 +34,8 @@ def generate_dcos_engine_template(
         linux_admin_user: str,
         dcos_engine_orchestrator_release: str,
         ):
-    """ Generates the template provided to dcos-engine
+    """ Generates the template provided to dcos-engine. The DNS prefixes become global Azure
+    FQDNs, so they are made unique with a random id
     """
     unique_id = str(uuid.uuid4())[:8] + 'dcos'
     template = {
@@ -97,37 +99,90 @@ def generate_dcos_engine_template(
     return template
 
 
-def run_dcos_engine(dcos_engine_url: str, dcos_engine_template):
-    """ Runs the dcos-engine
+def _sha256_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_dcos_engine_binary(dcos_engine_url: str, sha256: str=None) -> str:
+    """ Returns the path of the dcos-engine binary from dcos_engine_url, downloading and
+    extracting it only if it is not cached yet. The cached binary is checked against the
+    checksum recorded when it was extracted, and downloaded again if it does not match
+
+    Args:
+        dcos_engine_url: URL of a dcos-engine release tarball
+        sha256: optional checksum the tarball must match
+    """
+    tarball_name = dcos_engine_url.split('/')[-1]
+    cache_dir = dcos_launch.util.get_cache_dir(
+        'dcos-engine', '{}-{}'.format(tarball_name, hashlib.sha256(dcos_engine_url.encode()).hexdigest()[:12]))
+    bin_path = os.path.join(cache_dir, 'dcos-engine')
+    manifest_path = os.path.join(cache_dir, 'manifest.json')
+    with filelock.FileLock(os.path.join(cache_dir, '.lock')):
+        if os.path.exists(manifest_path) and os.path.exists(bin_path):
+            manifest = dcos_launch.util.load_json(manifest_path)
+            if (sha256 is None or manifest['tarball_sha256'] == sha256) and \
+                    _sha256_file(bin_path) == manifest['binary_sha256']:
+                return bin_path
+            log.warning('Cached dcos-engine in {} is invalid, downloading it again'.format(cache_dir))
+        with tempfile.TemporaryDirectory(dir=cache_dir) as tmpdir:
+            download_path = os.path.join(tmpdir, 'download.tar.gz')
+            dcos_launch.util.download_file(dcos_engine_url, download_path, sha256=sha256)
+            extract_path = os.path.join(tmpdir, 'extract')
+            with tarfile.open(download_path) as tar:
+                tar.extractall(path=extract_path)
+            extracted_name = tarball_name[:-len('.tar.gz')] if tarball_name.endswith('.tar.gz') else tarball_name
+            os.replace(os.path.join(extract_path, extracted_name, 'dcos-engine'), bin_path)
+            dcos_launch.util.write_json(manifest_path, {
+                'url': dcos_engine_url,
+                'tarball_sha256': _sha256_file(download_path),
+                'binary_sha256': _sha256_file(bin_path)})
+    return bin_path
+
+
+def run_dcos_engine(dcos_engine_url: str, dcos_engine_template, sha256: str=None):
+    """ Runs the dcos-engine. The generated ARM template and parameters are cached by the
+    hash of dcos_engine_url and dcos_engine_template, so generate only runs for new inputs.
+    The random id of the DNS prefixes is left out of the hash and recorded with the output,
+    which gets the id of the new template on a cache hit. As the cached parameters can
+    contain the windows admin password, they are only readable by the user
     """
-    tmpdir = tempfile.mkdtemp()
-    # pull down dcos engine in temp dir
-    download_path = os.path.join(tmpdir, 'download.tar.gz')
-    with open(download_path, 'wb') as f:
-        r = requests.get(dcos_engine_url)
-        for chunk in r.iter_content(1024):
-            f.write(chunk)
-    extract_path = os.path.join(tmpdir, 'extract')
-    with tarfile.open(download_path) as tar:
-        tar.extractall(path=extract_path)
-    extracted_name = dcos_engine_url.split('/')[-1].rstrip('.tar.gz')
-    dcos_engine_bin_path = os.path.join(extract_path, extracted_name, 'dcos-engine')
-    # inject parameters into the JSON (keyhelper, agent definitions)
-    acs_template_path = os.path.join(tmpdir, 'acs_template.json')
-    with open(acs_template_path, 'w') as f:
-        json.dump(dcos_engine_template, f)
-    # run acs vs template
-    cmd = [dcos_engine_bin_path, 'generate', acs_template_path]
-    subprocess.check_call(cmd, cwd=tmpdir)
-
-    cluster_name = dcos_engine_template['properties']['masterProfile']['dnsPrefix']
-    with open(os.path.join(tmpdir, '_output/{}/azuredeploy.json'.format(cluster_name)), 'r') as f:
-        arm_template = json.load(f)
-    with open(os.path.join(tmpdir, '_output/{}/azuredeploy.parameters.json'.format(cluster_name)), 'r') as f:
-        arm_template_parameters_raw = json.load(f)
+    unique_id = dcos_engine_template['properties']['masterProfile']['dnsPrefix'][len('master'):]
+    template_key = hashlib.sha256(json.dumps(
+        [dcos_engine_url, dcos_engine_template], sort_keys=True).replace(unique_id, '<unique_id>').encode()).hexdigest()
+    generated_path = os.path.join(dcos_launch.util.get_cache_dir('dcos-engine', 'generated'), template_key + '.json')
+    if os.path.exists(generated_path):
+        log.info('Using the cached output of dcos-engine generate')
+        generated = dcos_launch.util.load_json(generated_path)
+        generated = json.loads(json.dumps(generated).replace(generated['unique_id'], unique_id))
+        return generated['template'], generated['parameters']
+
+    dcos_engine_bin_path = get_dcos_engine_binary(dcos_engine_url, sha256=sha256)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # inject parameters into the JSON (keyhelper, agent definitions)
+        acs_template_path = os.path.join(tmpdir, 'acs_template.json')
+        with open(acs_template_path, 'w') as f:
+            json.dump(dcos_engine_template, f)
+        # run acs vs template
+        cmd = [dcos_engine_bin_path, 'generate', acs_template_path]
+        subprocess.check_call(cmd, cwd=tmpdir)
+
+        cluster_name = dcos_engine_template['properties']['masterProfile']['dnsPrefix']
+        with open(os.path.join(tmpdir, '_output/{}/azuredeploy.json'.format(cluster_name)), 'r') as f:
+            arm_template = json.load(f)
+        with open(os.path.join(tmpdir, '_output/{}/azuredeploy.parameters.json'.format(cluster_name)), 'r') as f:
+            arm_template_parameters_raw = json.load(f)
     arm_template_parameters = dict()
     for k, v in arm_template_parameters_raw['parameters'].items():
         arm_template_parameters[k] = v['value']
+
+    tmp_path = generated_path + '.' + str(uuid.uuid4())
+    with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT, 0o600), 'w') as f:
+        json.dump({'unique_id': unique_id, 'template': arm_template, 'parameters': arm_template_parameters}, f)
+    os.replace(tmp_path, generated_path)
     return arm_template, arm_template_parameters
 
 
@@ -150,6 +205,7 @@ class DcosEngineLauncher(dcos_launch.util.AbstractLauncher):
             azure_client_secret,
             azure_tenant_id)
         self.config = config
+        self._resource_group = None
         log.debug('Using Azure Resource Group Launcher')
 
     def create(self):
@@ -187,7 +243,9 @@ class DcosEngineLauncher(dcos_launch.util.AbstractLauncher):
             dcos_engine_template["properties"]["windowsProfile"]["WindowsOffer"] = windows_offer
             dcos_engine_template["properties"]["windowsProfile"]["WindowsSku"] = windows_sku
         linux_bs_url = self.config.get('dcos_linux_bootstrap_url')
-        arm_template, self.config['template_parameters'] = run_dcos_engine(self.config['dcos_engine_tarball_url'], dcos_engine_template)  # noqa
+        arm_template, self.config['template_parameters'] = run_dcos_engine(
+            self.config['dcos_engine_tarball_url'], dcos_engine_template,
+            sha256=self.config.get('dcos_engine_tarball_sha256'))
         if linux_bs_url:
             self.config['template_parameters']['dcosBootstrapURL'] = linux_bs_url
         windows_bs_url = self.config.get('dcos_windows_bootstrap_url')
@@ -198,7 +256,8 @@ class DcosEngineLauncher(dcos_launch.util.AbstractLauncher):
             self.config['deployment_name'],
             self.config['template_parameters'],
             self.config.get('tags'),
-            template=arm_template)
+            template=arm_template,
+            skip_validation=self.config['skip_template_validation'])
         return self.config
 
     def wait(self):
@@ -221,6 +280,13 @@ class DcosEngineLauncher(dcos_launch.util.AbstractLauncher):
     def delete(self):
         self.resource_group.delete()
 
+    def start_delete(self) -> dict:
+        self.delete()
+        return dict()
+
+    def get_delete_status(self, pending_delete: dict) -> str:
+        return self.resource_group.get_delete_status()
+
     def test(self, args: list, env_dict: dict, test_host=None, test_port=2200, details: dict=None) -> int:
         details = self.describe()
         env_dict.update({
@@ -230,8 +296,10 @@ class DcosEngineLauncher(dcos_launch.util.AbstractLauncher):
 
     @property
     def resource_group(self):
-        try:
-            return dcos_launch.platforms.arm.HybridDcosAzureResourceGroup(
-                self.config['deployment_name'], self.azure_wrapper)
-        except Exception as ex:
-            raise dcos_launch.util.LauncherError('GroupNotFound', None) from ex
+        if self._resource_group is None:
+            try:
+                self._resource_group = dcos_launch.platforms.arm.HybridDcosAzureResourceGroup(
+                    self.config['deployment_name'], self.azure_wrapper)
+            except Exception as ex:
+                raise dcos_launch.util.LauncherError('GroupNotFound', None) from ex
+        return self._resource_group
@@ -3,6 +3,7 @@
 import json
 import logging
 import os
+import time
 
 from dcos_launch import onprem, util
 from dcos_launch.platforms import gcp
@@ -11,6 +12,9 @@ from googleapiclient.errors import HttpError
 
 log = logging.getLogger(__name__)
 
+# how long the info of a deployment is trusted before it is checked for errors again
+DEPLOYMENT_INFO_TTL = 5 * 60
+
 
 def get_credentials(env=None) -> tuple:
     path = None
@@ -34,20 +38,40 @@ class OnPremLauncher(onprem.AbstractOnpremLauncher):
         creds_string, _ = get_credentials(env)
         self.gcp_wrapper = gcp.GcpWrapper(json.loads(creds_string))
         self.config = config
+        self._deployment = None
+        self._deployment_check_time = None
+        self._hosts = None
 
     @property
     def deployment(self):
         """ Builds a BareClusterDeployment instance with self.config, but only returns it successfully if the
-        corresponding real deployment (active machines) exists and doesn't contain any errors.
+        corresponding real deployment (active machines) exists and doesn't contain any errors. The deployment is
+        only checked again once its last check is older than DEPLOYMENT_INFO_TTL or invalidate_deployment was called
+        """
+        if self._deployment is None or time.time() - self._deployment_check_time > DEPLOYMENT_INFO_TTL:
+            self._deployment = None
+            deployment = gcp.BareClusterDeployment(self.gcp_wrapper, self.config['deployment_name'], self.zones)
+            self._check_deployment(deployment)
+            self._deployment_check_time = time.time()
+            self._deployment = deployment
+        return self._deployment
+
+    @property
+    def zones(self) -> list:
+        return self.config.get('gce_zones', [self.config['gce_zone']])
+
+    def invalidate_deployment(self):
+        """ Makes the next access of the deployment or its hosts look them up again
         """
+        self._deployment = None
+        self._hosts = None
+
+    def _check_deployment(self, deployment: gcp.BareClusterDeployment):
         try:
-            deployment = gcp.BareClusterDeployment(self.gcp_wrapper, self.config['deployment_name'],
-                                                   self.config['gce_zone'])
             info = deployment.get_info()
             errors = info['operation'].get('error')
             if errors:
                 raise util.LauncherError('DeploymentContainsErrors', str(errors))
-            return deployment
         except HttpError as e:
             if e.resp.status == 404:
                 raise util.LauncherError('DeploymentNotFound',
@@ -61,7 +85,7 @@ class OnPremLauncher(onprem.AbstractOnpremLauncher):
         gcp.BareClusterDeployment.create(
             self.gcp_wrapper,
             self.config['deployment_name'],
-            self.config['gce_zone'],
+            self.zones,
             node_count,
             self.config['disk_size'],
             self.config['disk_type'],
@@ -84,11 +108,19 @@ class OnPremLauncher(onprem.AbstractOnpremLauncher):
             self.config['ssh_private_key'] = private_key.decode()
             self.config['ssh_public_key'] = public_key.decode()
 
+    @property
+    def hosts(self) -> [Host]:
+        """ The sorted hosts of the deployment, which are only looked up once per launcher
+        """
+        if self._hosts is None:
+            self._hosts = self.deployment.hosts
+        return self._hosts
+
     def get_cluster_hosts(self) -> [Host]:
-        return list(self.deployment.hosts)[1:]
+        return self.hosts[1:]
 
     def get_bootstrap_host(self) -> Host:
-        return list(self.deployment.hosts)[0]
+        return self.hosts[0]
 
     def wait(self):
         """ Waits for the deployment to complete: first, the network that will contain the cluster is deployed. Once
@@ -96,9 +128,20 @@ class OnPremLauncher(onprem.AbstractOnpremLauncher):
         once the instance template is deployed, an instance group manager and all its instances are deployed.
         """
         self.deployment.wait_for_completion()
+        # the deployment was still changing when it was last checked
+        self.invalidate_deployment()
 
     def delete(self):
         """ Deletes all the resources associated with the deployment (instance template, network, firewall, instance
         group manager and all its instances.
         """
         self.deployment.delete()
+        self.invalidate_deployment()
+
+    def start_delete(self) -> dict:
+        # deleting a deployment never waits for it
+        self.delete()
+        return dict()
+
+    def get_delete_status(self, pending_delete: dict) -> str:
+        return gcp.Deployment(self.gcp_wrapper, self.config['deployment_name']).get_delete_status()
@@ -1,11 +1,11 @@
 import abc
+import concurrent.futures
 import json
 import logging
 import os
 import shutil
 
 import pkg_resources
-import yaml
 
 import dcos_launch
 from dcos_launch import config
@@ -37,9 +37,10 @@ class AbstractOnpremLauncher(util.AbstractLauncher, metaclass=abc.ABCMeta):
     def get_bootstrap_ssh_client(self):
         return self.get_ssh_client(user='bootstrap_ssh_user')
 
-    def get_completed_onprem_config(self) -> dict:
+    def get_completed_onprem_config(self, start_zookeeper: bool=True) -> dict:
         """ Will fill in the necessary and/or recommended sections of the config file, including:
-        * starting a ZK backend if left undefined
+        * starting a ZK backend if left undefined (unless start_zookeeper is False, in
+            which case the caller must run start_bootstrap_zookeeper)
         * filling in the master_list for a static exhibitor backend
         * adding ip-detect script
         * adding ip-detect-public script
@@ -58,14 +59,9 @@ class AbstractOnpremLauncher(util.AbstractLauncher, metaclass=abc.ABCMeta):
         # First, try and retrieve the agent list from the cluster
         # if the user wanted to use exhibitor as the backend, then start it
         exhibitor_backend = onprem_config.get('exhibitor_storage_backend')
-        if exhibitor_backend == 'zookeeper' and 'exhibitor_zk_hosts' not in onprem_config:
-            zk_service_name = 'dcos-bootstrap-zk'
-            with self.get_bootstrap_ssh_client().tunnel(cluster.bootstrap_host.public_ip) as t:
-                if not platforms_onprem.get_docker_service_status(t, zk_service_name):
-                    platforms_onprem.start_docker_service(
-                        t,
-                        zk_service_name,
-                        ['--publish=2181:2181', '--publish=2888:2888', '--publish=3888:3888', 'jplock/zookeeper'])
+        if self.uses_bootstrap_zookeeper():
+            if start_zookeeper:
+                self.start_bootstrap_zookeeper(cluster.bootstrap_host.public_ip)
             onprem_config['exhibitor_zk_hosts'] = cluster.bootstrap_host.private_ip + ':2181'
         elif exhibitor_backend == 'static' and 'master_list' not in onprem_config:
             onprem_config['master_list'] = [h.private_ip for h in cluster.masters]
@@ -117,7 +113,7 @@ class AbstractOnpremLauncher(util.AbstractLauncher, metaclass=abc.ABCMeta):
             if 'ip_detect_contents' not in onprem_config:
                 # this is a special case where DC/OS does not expect this field by default
                 onprem_config['ip_detect_public_filename'] = os.path.join(os.pardir, 'genconf', 'ip-detect-public')
-            f.write(yaml.safe_dump(onprem_config))
+            util.dump_yaml(onprem_config, f)
         log.debug('Generated cluster configuration: {}'.format(onprem_config))
         return onprem_config
 
@@ -180,18 +176,83 @@ echo "{{\\"fault_domain\\":{{\\"region\\":{{\\"name\\": \\"$REGION\\"}},\\"zone\
 """
         return bash_script.format(cases=case_str)
 
-    def install_dcos(self):
+    def uses_bootstrap_zookeeper(self) -> bool:
+        onprem_config = self.config['dcos_config']
+        return onprem_config.get('exhibitor_storage_backend') == 'zookeeper' and \
+            'exhibitor_zk_hosts' not in onprem_config
+
+    def start_bootstrap_zookeeper(self, bootstrap_host: str):
+        """ Starts a ZK on the bootstrap host to be used as exhibitor backend. Uses its own
+        tunnel so that it can run alongside other work on the bootstrap host
+        """
+        zk_service_name = 'dcos-bootstrap-zk'
+        with self.get_bootstrap_ssh_client().tunnel(bootstrap_host) as t:
+            if not platforms_onprem.get_docker_service_status(t, zk_service_name):
+                platforms_onprem.pull_docker_image(
+                    t, platforms_onprem.ZOOKEEPER_DOCKER_IMAGE, self.config.get('bootstrap_docker_registry_mirror'))
+                platforms_onprem.start_docker_service(
+                    t,
+                    zk_service_name,
+                    ['--publish=2181:2181', '--publish=2888:2888', '--publish=3888:3888',
+                     platforms_onprem.ZOOKEEPER_DOCKER_IMAGE])
+
+    def get_bootstrap_docker_images(self) -> list:
+        """ Returns the docker images that the install will run on the bootstrap host
+        """
+        images = [platforms_onprem.NGINX_DOCKER_IMAGE_VERSION]
+        if self.uses_bootstrap_zookeeper():
+            images.append(platforms_onprem.ZOOKEEPER_DOCKER_IMAGE)
+        if self.config['install_prereqs'] and self.config.get('prereqs_bundle'):
+            images.append(platforms_onprem.PREREQS_BUNDLE_DOCKER_IMAGE)
+        return images
+
+    def install_dcos(self, journal: util.PhaseJournal=None):
+        if journal is None:
+            journal = util.PhaseJournal(platforms_onprem.INSTALL_PHASES)
         cluster = self.get_onprem_cluster()
         bootstrap_host = cluster.bootstrap_host.public_ip
         bootstrap_ssh_client = self.get_bootstrap_ssh_client()
         bootstrap_ssh_client.wait_for_ssh_connection(bootstrap_host)
         with bootstrap_ssh_client.tunnel(bootstrap_host) as t:
-            installer_path = platforms_onprem.prepare_bootstrap(t, self.config['installer_url'])
-            complete_config = self.get_completed_onprem_config()
-            platforms_onprem.do_genconf(t, self.config['genconf_dir'], installer_path)
+            if journal.is_complete('installer', bootstrap_host):
+                log.info('Installer was already downloaded to the bootstrap host')
+                installer_path = platforms_onprem.get_installer_path(t)
+            else:
+                installer_path = platforms_onprem.prepare_bootstrap(t, self.config['installer_url'])
+                journal.mark_complete('installer', [bootstrap_host])
+            registry_mirror = self.config.get('bootstrap_docker_registry_mirror')
+            if 'bootstrap_docker_image_tarball' in self.config:
+                platforms_onprem.load_docker_images(
+                    t, self.get_bootstrap_docker_images(), self.config['bootstrap_docker_image_tarball'])
+            start_zookeeper = self.uses_bootstrap_zookeeper()
+            complete_config = self.get_completed_onprem_config(start_zookeeper=False)
+            # ZK and the nginx image are brought up in the background while genconf runs
+            with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+                zk_started = None
+                if start_zookeeper:
+                    zk_started = executor.submit(self.start_bootstrap_zookeeper, bootstrap_host)
+                if journal.is_complete('genconf', bootstrap_host):
+                    log.info('Genconf was already run on the bootstrap host')
+                else:
+                    nginx_pulled = executor.submit(
+                        self._pull_bootstrap_docker_image, bootstrap_host, platforms_onprem.NGINX_DOCKER_IMAGE_VERSION)
+                    platforms_onprem.do_genconf(t, self.config['genconf_dir'], installer_path)
+                    nginx_pulled.result()
+                    platforms_onprem.start_bootstrap_nginx(t, installer_path)
+                    journal.mark_complete('genconf', [bootstrap_host])
+                if zk_started is not None:
+                    zk_started.result()
+            use_prereqs_bundle = self.config['install_prereqs'] and self.config.get('prereqs_bundle')
+            if use_prereqs_bundle and not journal.is_complete('prereqs_bundle', bootstrap_host):
+                platforms_onprem.pull_docker_image(t, platforms_onprem.PREREQS_BUNDLE_DOCKER_IMAGE, registry_mirror)
+                platforms_onprem.do_build_prereqs_bundle(t, installer_path)
+                journal.mark_complete('prereqs_bundle', [bootstrap_host])
 
         prereqs_script_path = config.expand_path(pkg_resources.resource_filename(
             dcos_launch.__name__, 'scripts/' + self.config['prereqs_script_filename']), self.config['config_dir'])
+        if use_prereqs_bundle:
+            prereqs_script_path = self._write_bundled_prereqs_script(
+                prereqs_script_path, complete_config['bootstrap_url'] + '/prereqs')
 
         platforms_onprem.install_dcos(
             cluster,
@@ -200,7 +261,51 @@ echo "{{\\"fault_domain\\":{{\\"region\\":{{\\"name\\": \\"$REGION\\"}},\\"zone\
             self.config['install_prereqs'],
             complete_config['bootstrap_url'] + '/dcos_install.sh',
             self.config['onprem_install_parallelism'],
-            self.config.get('enable_selinux'))
+            self.config.get('enable_selinux'),
+            journal=journal,
+            retry_policies=self.config.get('onprem_install_retry_policy'))
+
+    def _pull_bootstrap_docker_image(self, bootstrap_host: str, image: str):
+        with self.get_bootstrap_ssh_client().tunnel(bootstrap_host) as t:
+            platforms_onprem.pull_docker_image(t, image, self.config.get('bootstrap_docker_registry_mirror'))
+
+    def _write_bundled_prereqs_script(self, prereqs_script_path: str, bundle_url: str) -> str:
+        """ Writes a copy of the prereqs script that installs from the bundle at bundle_url
+        into the genconf dir and returns its path
+        """
+        bundled_script_path = os.path.join(self.config['genconf_dir'], 'install_prereqs_bundled.sh')
+        with open(bundled_script_path, 'w') as f:
+            f.write(platforms_onprem.get_bundled_prereqs_script(util.read_file(prereqs_script_path), bundle_url))
+        return bundled_script_path
+
+    def upgrade(self, installer_url: str) -> list:
+        """ Upgrades the installed cluster to the DC/OS version of installer_url. Masters
+        are upgraded one at a time and agents in waves of onprem_upgrade_wave_size
+
+        Returns:
+            list of per-wave timings
+        """
+        cluster = self.get_onprem_cluster()
+        bootstrap_host = cluster.bootstrap_host.public_ip
+        installed_version = platforms_onprem.get_installed_version(
+            self.get_ssh_client(), cluster.masters[0].public_ip)
+        bootstrap_ssh_client = self.get_bootstrap_ssh_client()
+        bootstrap_ssh_client.wait_for_ssh_connection(bootstrap_host)
+        with bootstrap_ssh_client.tunnel(bootstrap_host) as t:
+            installer_path = platforms_onprem.prepare_bootstrap(t, installer_url)
+            # regenerates genconf/config.yaml, which the installer reads when generating the upgrade script. ZooKeeper
+            # is still running from the install
+            self.get_completed_onprem_config(start_zookeeper=False)
+            upgrade_script_url = platforms_onprem.do_generate_node_upgrade_script(
+                t, self.config['genconf_dir'], installer_path, installed_version)
+
+        timings = platforms_onprem.upgrade_dcos(
+            cluster,
+            self.get_ssh_client(),
+            upgrade_script_url,
+            self.config['onprem_upgrade_wave_size'])
+        self.config['installer_url'] = installer_url
+        return timings
 
     def describe(self):
         """ returns host information stored in the config as
@@ -6,11 +6,16 @@ https://docs.microsoft.com/en-us/azure/azure-resource-manager/resource-group-aut
 """
 import contextlib
 import copy
+import hashlib
+import json
 import logging
+import os
 import re
+import tempfile
+import time
 
+import filelock
 import requests
-import retrying
 
 from azure.common.credentials import ServicePrincipalCredentials
 from azure.common.exceptions import CloudError
@@ -20,7 +25,8 @@ from azure.mgmt.resource.resources.v2016_02_01.models import (DeploymentMode,
                                                               DeploymentProperties,
                                                               ResourceGroup)
 from azure.monitor import MonitorClient
-from dcos_launch.util import DeploymentError
+from dcos_launch.util import (DELETE_COMPLETE, DELETE_FAILED, DELETE_PENDING, DeploymentError, get_cache_dir,
+                              is_offline)
 from dcos_test_utils.helpers import Host
 
 log = logging.getLogger(__name__)
@@ -29,6 +35,11 @@ log = logging.getLogger(__name__)
 # Being as the azure interface is based around resource groups, deriving
 # deployment name from group names makes it easier to attach to creating deploys
 DEPLOYMENT_NAME = '{}-Deployment'
+DEPLOYMENT_WAIT_MIN_INTERVAL = 5
+DEPLOYMENT_WAIT_MAX_INTERVAL = 60
+DEPLOYMENT_TIMEOUT = 60 * 60
+FINISHED_OPERATION_STATES = ('Succeeded', 'Failed', 'Canceled')
+TEMPLATE_REQUEST_TIMEOUT = 60
 
 
 def validate_hostname_prefix(prefix):
@@ -66,6 +77,94 @@ def nic_to_host(nic, public_ip=None):
     return Host(ip_config.private_ip_address, public_ip)
 
 
+TYPE_CAST_MAP = {
+    'string': str,
+    'securestring': str,
+    'int': int,
+    'bool': bool,
+    'object': check_json_object,
+    'secureObject': check_json_object,
+    'array': check_array}
+
+# template hash -> {parameter name: cast}
+_parameter_casts = dict()
+
+
+def _write_json_atomically(path: str, obj):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(obj, f)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def get_template(template_url: str) -> dict:
+    """ Returns the template at template_url. Templates are cached on disk by URL together with the ETag
+    and Last-Modified headers they were served with, and every request revalidates the cached copy with
+    them, so an unchanged template is not downloaded again. In offline mode, or if the request fails,
+    a cached template is used as is
+    """
+    path = os.path.join(get_cache_dir('arm-templates'), hashlib.sha256(template_url.encode()).hexdigest() + '.json')
+    with filelock.FileLock(path + '.lock'):
+        cached = None
+        if os.path.exists(path):
+            with open(path) as f:
+                cached = json.load(f)
+            if is_offline():
+                return cached['template']
+        headers = dict()
+        if cached is not None and cached['etag']:
+            headers['If-None-Match'] = cached['etag']
+        if cached is not None and cached['last_modified']:
+            headers['If-Modified-Since'] = cached['last_modified']
+        try:
+            r = requests.get(template_url, headers=headers, timeout=TEMPLATE_REQUEST_TIMEOUT)
+            r.raise_for_status()
+            if r.status_code == 304:
+                log.debug('Cached template is up to date: {}'.format(template_url))
+                return cached['template']
+            template = r.json()
+        except Exception as e:
+            if cached is None:
+                raise
+            log.warning('Failed to revalidate the template at {}. Using the cached one. Error details: {}'.format(
+                template_url, repr(e)))
+            return cached['template']
+        _write_json_atomically(path, {
+            'etag': r.headers.get('ETag'),
+            'last_modified': r.headers.get('Last-Modified'),
+            'template': template})
+        return template
+
+
+def get_template_hash(template: dict) -> str:
+    return hashlib.sha256(json.dumps(template, sort_keys=True).encode()).hexdigest()
+
+
+def get_parameter_casts(template: dict, template_hash: str) -> dict:
+    """ Maps the parameters of template to the function that casts user values to their type.
+    Memoized by template hash, as the same few templates are deployed over and over
+    """
+    if template_hash not in _parameter_casts:
+        # All templates parameters are required to have a type field.
+        _parameter_casts[template_hash] = {
+            k: TYPE_CAST_MAP[v['type']] for k, v in template.get('parameters', {}).items()}
+    return _parameter_casts[template_hash]
+
+
+def get_validation_path(template: dict, template_hash: str, template_parameters: dict) -> str:
+    """ Returns the path of the file that records a successful server-side validation of the template
+    with parameters of these names and types. Parameter values do not matter, so a record applies to
+    every deployment of the same template that sets the same parameters
+    """
+    parameter_schema = sorted((k, template['parameters'][k]['type']) for k in template_parameters)
+    key = hashlib.sha256(json.dumps([template_hash, parameter_schema]).encode()).hexdigest()
+    return os.path.join(get_cache_dir('arm-validated'), key)
+
+
 class AzureWrapper:
     def __init__(self, location: str, subscription_id: str, client_id: str, client_secret: str, tenant_id: str):
         self.credentials = ServicePrincipalCredentials(
@@ -79,12 +178,23 @@ class AzureWrapper:
         self.location = location
 
     def deploy_template_to_new_resource_group(
-            self, template_url, group_name, parameters, tags=None, template=None):
+            self, template_url, group_name, parameters, tags=None, template=None, skip_validation=False):
+        """ Creates group_name and deploys the template to it. With skip_validation, Azure's server-side
+        template validation is skipped if the template has validated with the same parameter names and
+        types before. Otherwise it runs as usual and is recorded once it succeeds
+        """
         if tags is None:
             tags = dict()
         log.info('Checking deployment parameters vs template before starting...')
+        if template is None:
+            template = get_template(template_url)
+        template_hash = get_template_hash(template)
         deployment_properties = self.create_deployment_properties(
-            template_url, parameters, template=template)
+            template_url, parameters, template=template, template_hash=template_hash)
+        validation_path = get_validation_path(template, template_hash, deployment_properties.parameters)
+        if skip_validation and not os.path.exists(validation_path):
+            log.info('Template has not been validated with these parameters before. Validation cannot be skipped')
+            skip_validation = False
         deployment_name = DEPLOYMENT_NAME.format(group_name)
         # Resource group must be created before validation can occur
         if self.rmc.resource_groups.check_existence(group_name):
@@ -106,48 +216,42 @@ class AzureWrapper:
             # Ensure the resource group will be deleted if the following steps fail
             stack.callback(self.rmc.resource_groups.delete, group_name)
             log.info('Resource group created: {}'.format(group_name))
-            log.info('Checking with Azure to validate template deployment')
-            result = self.rmc.deployments.validate(
-                group_name, deployment_name, properties=deployment_properties)
-            if result.error:
-                raise Exception("Template verification failed!\n{}".format(get_all_details(result.error)))
-            log.info('Template successfully validated')
+            if skip_validation:
+                log.info('Skipping template validation, which succeeded before for these parameters')
+            else:
+                log.info('Checking with Azure to validate template deployment')
+                result = self.rmc.deployments.validate(
+                    group_name, deployment_name, properties=deployment_properties)
+                if result.error:
+                    raise Exception("Template verification failed!\n{}".format(get_all_details(result.error)))
+                log.info('Template successfully validated')
+                open(validation_path, 'w').close()
             log.info('Starting template deployment')
             self.rmc.deployments.create_or_update(
                 group_name, deployment_name, deployment_properties, raw=True)
             stack.pop_all()
         log.info('Successfully started template deployment')
 
-    def create_deployment_properties(self, template_url, parameters, template: dict=None):
+    def create_deployment_properties(self, template_url, parameters, template: dict=None, template_hash: str=None):
         """ Pulls the targeted template, checks parameter specs and casts
         user provided parameters to the appropriate type. Assertion is raised
         if there are unused parameters or invalid casting
         """
         user_parameters = copy.deepcopy(parameters)
-        type_cast_map = {
-            'string': str,
-            'securestring': str,
-            'int': int,
-            'bool': bool,
-            'object': check_json_object,
-            'secureObject': check_json_object,
-            'array': check_array}
         log.debug('Pulling Azure template for parameter validation...')
         if template is None:
-            r = requests.get(template_url)
-            r.raise_for_status()
-            template = r.json()
+            template = get_template(template_url)
+        if template_hash is None:
+            template_hash = get_template_hash(template)
         if 'parameters' not in template:
             assert user_parameters is None, 'This template does not support parameters, ' \
                 'yet parameters were supplied: {}'.format(user_parameters)
         log.debug('Constructing DeploymentProperties from user parameters: {}'.format(parameters))
         template_parameters = {}
-        for k, v in template['parameters'].items():
+        for k, cast in get_parameter_casts(template, template_hash).items():
             if k in user_parameters:
-                # All templates parameters are required to have a type field.
                 # Azure requires that parameters be provided as {key: {'value': value}}.
-                template_parameters[k] = {
-                    'value': type_cast_map[v['type']](user_parameters.pop(k))}
+                template_parameters[k] = {'value': cast(user_parameters.pop(k))}
         log.debug('Final template parameters: {}'.format(template_parameters))
         if len(user_parameters) > 0:
             raise Exception('Unrecognized template parameters were supplied: {}'.format(user_parameters))
@@ -164,6 +268,7 @@ class DcosAzureResourceGroup:
     def __init__(self, group_name, azure_wrapper):
         self.group_name = group_name
         self.azure_wrapper = azure_wrapper
+        self._network_resources = None
 
     @classmethod
     def deploy_acs_template(
@@ -213,69 +318,122 @@ class DcosAzureResourceGroup:
         return self.azure_wrapper.rmc.deployments.get(
             self.group_name, DEPLOYMENT_NAME.format(self.group_name)).properties.provisioning_state
 
-    def wait_for_deployment(self, timeout=60 * 60):
-        """
-        Azure will not register a template instantly after deployment, so
-        CloudError must be expected as retried. Once the ops are retrieved, this
-        loops through all operations in the group's only deployment
-        if any operations are still in progress, then this function will sleep
-        once all operations are complete, if there any failures, those will be
-        printed to the log stream
-        """
-        log.info('Waiting for deployment to finish')
+    def get_deployment_operations(self) -> list:
+        return list(self.azure_wrapper.rmc.deployment_operations.list(
+            self.group_name, DEPLOYMENT_NAME.format(self.group_name)))
 
-        def azure_failure_report():
-            deploy_ops = self.azure_wrapper.rmc.deployment_operations.list(
-                    self.group_name, DEPLOYMENT_NAME.format(self.group_name))
-            failures = [(op.properties.status_code, op.properties.status_message) for op
-                        in deploy_ops if op.properties.provisioning_state == 'Failed']
-            for failure in failures:
-                log.error('Deployment operation failed! {}: {}'.format(*failure))
-
-        @retrying.retry(
-            wait_fixed=60 * 1000, stop_max_delay=timeout * 1000,
-            retry_on_result=lambda res: res is False,
-            retry_on_exception=lambda ex: isinstance(ex, CloudError))
-        def check_deployment_operations():
-            deploy_state = self.get_deployment_state()
+    def watch_deployment(self, timeout: int=DEPLOYMENT_TIMEOUT):
+        """ Polls the deployment in growing intervals from DEPLOYMENT_WAIT_MIN_INTERVAL to
+        DEPLOYMENT_WAIT_MAX_INTERVAL seconds and yields every deployment operation once, as soon as
+        it has finished. Returns when the deployment has succeeded and raises DeploymentError when
+        it has failed or is still running after timeout seconds.
 
+        Azure will not register a template instantly after deployment, so CloudError is expected
+        and retried until the deployment shows up.
+        """
+        deadline = time.time() + timeout
+        interval = DEPLOYMENT_WAIT_MIN_INTERVAL
+        finished_operations = set()
+        while True:
+            try:
+                deploy_state = self.get_deployment_state()
+                operations = self.get_deployment_operations()
+            except CloudError as ex:
+                log.info('Deployment is not available yet: {}'.format(ex))
+                deploy_state, operations = None, []
+            for op in operations:
+                if op.operation_id in finished_operations:
+                    continue
+                if op.properties.provisioning_state in FINISHED_OPERATION_STATES:
+                    finished_operations.add(op.operation_id)
+                    yield op
             if deploy_state == 'Succeeded':
-                return True
-
-            elif deploy_state == 'Failed':
-                log.info('Deployment failed. Checking deployment operations.')
-                azure_failure_report()
-                raise DeploymentError('Azure Deployment Failed!')
-
-            else:
-                log.info('Waiting for deployment. Current state: {}. It should either be Succeeded/Failed.'.format(
-                        deploy_state))
-
-                return False
-
+                return
+            if deploy_state in ('Failed', 'Canceled'):
+                raise DeploymentError('Azure Deployment {}!'.format(deploy_state))
+            now = time.time()
+            if now >= deadline:
+                raise DeploymentError('Azure Deployment was not done after {} seconds. Current state: {}'.format(
+                    timeout, deploy_state))
+            log.info('Waiting for deployment. Current state: {}. {} operations finished'.format(
+                deploy_state, len(finished_operations)))
+            # the last poll happens right at the deadline
+            time.sleep(min(interval, deadline - now))
+            interval = min(interval * 2, DEPLOYMENT_WAIT_MAX_INTERVAL)
+
+    def wait_for_deployment(self, timeout: int=DEPLOYMENT_TIMEOUT, fail_fast: bool=True):
+        """ Waits for the deployment to finish and logs each deployment operation as it finishes.
+        With fail_fast, the first failed operation raises DeploymentError right away instead of
+        waiting for Azure to roll the failure up to the whole deployment, which can take long
+        while the remaining operations run or time out.
+        """
+        log.info('Waiting for deployment to finish')
+        failures = []
         try:
-            check_deployment_operations()
-        except retrying.RetryError:
-            log.info('Deployment failed. Checking deployment operations.')
-            azure_failure_report()
-            raise DeploymentError("Azure Deployment Failed!")
+            for op in self.watch_deployment(timeout):
+                target = op.properties.target_resource
+                resource = '{} {}'.format(target.resource_type, target.resource_name) if target else op.operation_id
+                if op.properties.provisioning_state == 'Failed':
+                    failures.append('{}: {}: {}'.format(
+                        resource, op.properties.status_code, op.properties.status_message))
+                    log.error('Deployment operation failed! {}'.format(failures[-1]))
+                    if fail_fast:
+                        break
+                else:
+                    log.info('Deployment operation {}: {}'.format(op.properties.provisioning_state.lower(), resource))
+        except DeploymentError as ex:
+            if not failures:
+                raise
+            raise DeploymentError('{}\n{}'.format(ex, '\n'.join(failures))) from ex
+        if failures:
+            raise DeploymentError('Azure Deployment Failed!\n' + '\n'.join(failures))
+        # anything listed while the deployment was running is incomplete
+        self.invalidate_network_resources()
 
     def list_resources(self, filter_string):
         yield from self.azure_wrapper.rmc.resource_groups.list_resources(
             self.group_name, filter=(filter_string))
 
+    @property
+    def network_resources(self) -> dict:
+        """ All NICs and public IPs of the group, listed once and then classified
+        locally. Standalone NICs and public IPs take one list call each for the whole
+        group, and the NICs of each scale set take one more list call per scale set,
+        so describing a cluster costs the same number of ARM calls regardless of its size.
+
+        Returns:
+            dict with 'nics' (standalone NICs, e.g. for masters), 'scale_set_nics'
+            (scale set name -> NICs) and 'public_ips'
+        """
+        if self._network_resources is None:
+            nmc = self.azure_wrapper.nmc
+            scale_set_nics = dict()
+            for resource in self.list_resources("resourceType eq 'Microsoft.Compute/virtualMachineScaleSets'"):
+                scale_set_nics[resource.name] = list(
+                    nmc.network_interfaces.list_virtual_machine_scale_set_network_interfaces(
+                        self.group_name, resource.name))
+            self._network_resources = {
+                'nics': list(nmc.network_interfaces.list(self.group_name)),
+                'scale_set_nics': scale_set_nics,
+                'public_ips': list(nmc.public_ip_addresses.list(self.group_name))}
+        return self._network_resources
+
+    def invalidate_network_resources(self):
+        """ Drops the listed NICs and public IPs so that the next lookup lists them again
+        """
+        self._network_resources = None
+
     def get_scale_set_nics(self, name_substring=None):
-        for resource in self.list_resources("resourceType eq 'Microsoft.Compute/virtualMachineScaleSets'"):
-            if name_substring and name_substring not in resource.name:
+        for name, nics in sorted(self.network_resources['scale_set_nics'].items()):
+            if name_substring and name_substring not in name:
                 continue
-            yield from self.azure_wrapper.nmc.network_interfaces.list_virtual_machine_scale_set_network_interfaces(
-                self.group_name, resource.name)
+            yield from nics
 
     def get_public_ip_address(self, name_substring=None):
-        for resource in self.list_resources("resourceType eq 'Microsoft.Network/publicIPAddresses'"):
-            if name_substring and name_substring not in resource.name:
+        for public_ip in self.network_resources['public_ips']:
+            if name_substring and name_substring not in public_ip.name:
                 continue
-            return self.azure_wrapper.nmc.public_ip_addresses.get(self.group_name, resource.name)
+            return public_ip
 
     @property
     def public_agent_lb_fqdn(self):
@@ -289,9 +447,9 @@ class DcosAzureResourceGroup:
     def master_nics(self):
         """ The only instances of networkInterface Resources are for masters
         """
-        for resource in self.list_resources("resourceType eq 'Microsoft.Network/networkInterfaces'"):
-            assert 'master' in resource.name, 'Expected to only find master NICs, not: {}'.format(resource.name)
-            yield self.azure_wrapper.nmc.network_interfaces.get(self.group_name, resource.name)
+        for nic in self.network_resources['nics']:
+            assert 'master' in nic.name, 'Expected to only find master NICs, not: {}'.format(nic.name)
+            yield nic
 
     def get_master_ips(self):
         """ Traffic from abroad is routed to a master wth the public master
@@ -323,6 +481,16 @@ class DcosAzureResourceGroup:
         log.info('Triggering delete')
         self.azure_wrapper.rmc.resource_groups.delete(self.group_name, raw=True)
 
+    def get_delete_status(self) -> str:
+        """ Azure keeps a group in the Deleting state until all of its resources are gone. A group that is back
+        in another state failed to delete
+        """
+        if not self.azure_wrapper.rmc.resource_groups.check_existence(self.group_name):
+            return DELETE_COMPLETE
+        if self.azure_wrapper.rmc.resource_groups.get(self.group_name).properties.provisioning_state == 'Deleting':
+            return DELETE_PENDING
+        return DELETE_FAILED
+
     def __enter__(self):
         return self
 
@@ -333,13 +501,9 @@ class DcosAzureResourceGroup:
 class HybridDcosAzureResourceGroup(DcosAzureResourceGroup):
     @property
     def master_nics(self):
-        master_nics = []
-        for resource in self.list_resources("resourceType eq 'Microsoft.Network/networkInterfaces'"):
-            if 'master' in resource.name:
-                master_nics.append(resource.name)
+        master_nics = [nic for nic in self.network_resources['nics'] if 'master' in nic.name]
         assert len(master_nics) > 0, 'Cannot find any master NICs into resource group {}'.format(self.group_name)
-        for name in master_nics:
-            yield self.azure_wrapper.nmc.network_interfaces.get(self.group_name, name)
+        yield from master_nics
 
     def get_master_ips(self):
         public_lb_ip = self.public_master_lb_fqdn
@@ -3,17 +3,20 @@
 Cloud Deployment Manager results in simpler code and far fewer API calls.
 """
 
-import copy
+import collections
 import logging
+import os
+import re
+import time
 import typing
 from functools import wraps
 
-import yaml
+import filelock
 from googleapiclient import discovery
 from googleapiclient.errors import HttpError
 from oauth2client.service_account import ServiceAccountCredentials
-from retrying import retry
 
+from dcos_launch import util
 from dcos_test_utils.helpers import Host
 
 log = logging.getLogger(__name__)
@@ -26,102 +29,24 @@ OS_IMAGE_FAMILIES = {
     'coreos': 'coreos-stable',
 }
 
-# template for an "instance template" resource to be used in a managed instance group
-INSTANCE_TEMPLATE = """
-type: compute.v1.instanceTemplate
-name: {name}
-metadata:
-  dependsOn:
-  - {network}
-properties:
-  project: {project}
-  properties:
-    machineType: {machineType}
-    disks:
-    - deviceName: boot
-      type: PERSISTENT
-      boot: true
-      autoDelete: true
-      initializeParams:
-        diskSizeGb: {diskSizeGb}
-        diskType: {diskType}
-        sourceImage: projects/{imageProject}/global/images/{sourceImage}
-    networkInterfaces:
-    - network: global/networks/{network}
-      # Access Config required to give the instance a public IP address
-      accessConfigs:
-      - name: External NAT
-        type: ONE_TO_ONE_NAT
-    metadata:
-      items:
-      - key: ssh-keys
-        value: {ssh_user}:{ssh_public_key}
-    scheduling:
-      preemptible: {usePreemptibleVMs}
-    tags:
-      items:
-        - {deploymentName}
-"""
+# how long to wait for new instances to be assigned their IPs
+INSTANCE_NETWORK_TIMEOUT = 30
 
-# template for a network resource in a gce deployment
-NETWORK_TEMPLATE = """
-type: compute.v1.network
-name: {name}
-properties:
-  autoCreateSubnetworks: True
-"""
+# deployment operations are polled at growing intervals between these bounds, until the timeout
+DEPLOYMENT_WAIT_MIN_INTERVAL = 2
+DEPLOYMENT_WAIT_MAX_INTERVAL = 60
+DEPLOYMENT_TIMEOUT = 60 * 60
 
-# template for an instance group manager resource in a gce deployment
-MANAGED_INSTANCE_GROUP_TEMPLATE = """
-type: compute.v1.instanceGroupManager
-name: {name}
-metadata:
-  dependsOn:
-  - {instance_template_name}
-properties:
-  baseInstanceName: vm
-  instanceTemplate: global/instanceTemplates/{instance_template_name}
-  zone: {zone}
-  targetSize: {size}
-"""
+# GCE resource names are at most this long
+NAME_MAX_LENGTH = 63
 
-# template for a firewall that controls external access
-EXTERNAL_FIREWALL_TEMPLATE = """
-type: compute.v1.firewall
-name: {name}-external
-metadata:
-  dependsOn:
-  - {network}
-properties:
-  description: external
-  network: global/networks/{network}
-  sourceRanges:
-  - 0.0.0.0/0
-  allowed:
-  - IPProtocol: tcp
-    ports:
-    - 22
-    - 80
-    - 443
-    - 61001
-  - IPProtocol: icmp
-"""
+# API discovery documents are downloaded again after this long
+DISCOVERY_DOCUMENT_TTL = 7 * 24 * 60 * 60
 
-# template for a firewall that controls internal access
-INTERNAL_FIREWALL_TEMPLATE = """
-type: compute.v1.firewall
-name: {name}-internal
-metadata:
-  dependsOn:
-  - {network}
-properties:
-  description: internal
-  network: global/networks/{network}
-  sourceTags:
-  - {deploymentName}
-  allowed:
-  - IPProtocol: all
-"""
+# number of deployments whose resources get_deployments looks up in one batch request
+GET_DEPLOYMENTS_BATCH_SIZE = 50
+# the only resource fields needed to tell bare cluster deployments apart
+INSTANCE_GROUP_ZONE_FIELDS = 'resources(type,properties),nextPageToken'
 
 # Used to disable automatic updates on CoreOS
 IGNITION_CONFIG = """
@@ -149,6 +74,111 @@ IGNITION_CONFIG = """
 """
 
 
+def instance_template_resource(name: str, project: str, network: str, machine_type: str, disk_size: int,
+                               disk_type: str, image_project: str, source_image: str, ssh_user: str,
+                               ssh_public_key: str, use_preemptible_vms: bool, deployment_name: str) -> dict:
+    """ Returns an "instance template" resource to be used in a managed instance group
+    """
+    return {
+        'type': 'compute.v1.instanceTemplate',
+        'name': name,
+        'metadata': {'dependsOn': [network]},
+        'properties': {
+            'project': project,
+            'properties': {
+                'machineType': machine_type,
+                'disks': [{
+                    'deviceName': 'boot',
+                    'type': 'PERSISTENT',
+                    'boot': True,
+                    'autoDelete': True,
+                    'initializeParams': {
+                        'diskSizeGb': disk_size,
+                        'diskType': disk_type,
+                        'sourceImage': 'projects/{}/global/images/{}'.format(image_project, source_image)}}],
+                'networkInterfaces': [{
+                    'network': 'global/networks/' + network,
+                    # Access Config required to give the instance a public IP address
+                    'accessConfigs': [{'name': 'External NAT', 'type': 'ONE_TO_ONE_NAT'}]}],
+                'metadata': {
+                    'items': [{'key': 'ssh-keys', 'value': '{}:{}'.format(ssh_user, ssh_public_key.strip())}]},
+                'scheduling': {'preemptible': use_preemptible_vms},
+                'tags': {'items': [deployment_name]}}}}
+
+
+def network_resource(name: str) -> dict:
+    """ Returns a network resource in a gce deployment
+    """
+    return {
+        'type': 'compute.v1.network',
+        'name': name,
+        'properties': {'autoCreateSubnetworks': True}}
+
+
+def managed_instance_group_resource(name: str, instance_template_name: str, zone: str, size: int) -> dict:
+    """ Returns an instance group manager resource in a gce deployment
+    """
+    return {
+        'type': 'compute.v1.instanceGroupManager',
+        'name': name,
+        'metadata': {'dependsOn': [instance_template_name]},
+        'properties': {
+            'baseInstanceName': 'vm',
+            'instanceTemplate': 'global/instanceTemplates/' + instance_template_name,
+            'zone': zone,
+            'targetSize': size}}
+
+
+def external_firewall_resource(name: str, network: str) -> dict:
+    """ Returns a firewall that controls external access
+    """
+    return {
+        'type': 'compute.v1.firewall',
+        'name': name + '-external',
+        'metadata': {'dependsOn': [network]},
+        'properties': {
+            'description': 'external',
+            'network': 'global/networks/' + network,
+            'sourceRanges': ['0.0.0.0/0'],
+            'allowed': [
+                {'IPProtocol': 'tcp', 'ports': [22, 80, 443, 61001]},
+                {'IPProtocol': 'icmp'}]}}
+
+
+def internal_firewall_resource(name: str, network: str, deployment_name: str) -> dict:
+    """ Returns a firewall that controls internal access
+    """
+    return {
+        'type': 'compute.v1.firewall',
+        'name': name + '-internal',
+        'metadata': {'dependsOn': [network]},
+        'properties': {
+            'description': 'internal',
+            'network': 'global/networks/' + network,
+            'sourceTags': [deployment_name],
+            'allowed': [{'IPProtocol': 'all'}]}}
+
+
+def get_discovery_document(api: str, version: str) -> str:
+    """ Returns the discovery document that googleapiclient builds the client of an API from. Documents are cached
+    on disk by API and version and are only downloaded again once they are older than DISCOVERY_DOCUMENT_TTL. In
+    offline mode, or if the download fails, a cached document is used regardless of its age
+    """
+    path = os.path.join(util.get_cache_dir('gcp-discovery'), '{}-{}.json'.format(api, version))
+    with filelock.FileLock(path + '.lock'):
+        if not os.path.exists(path) or (
+                not util.is_offline() and time.time() - os.path.getmtime(path) > DISCOVERY_DOCUMENT_TTL):
+            try:
+                util.download_file(discovery.DISCOVERY_URI.format(api=api, apiVersion=version), path)
+            except Exception as e:
+                if not os.path.exists(path):
+                    raise
+                log.warning('Failed to refresh the {} {} discovery document. Using the cached one. Error details: '
+                            '{}'.format(api, version, repr(e)))
+    with open(path) as f:
+        return f.read()
+
+
 def tag_dict_to_gce_format(tags: dict):
     return [{'key': k, 'value': v} for k, v in tags.items()]
 
@@ -183,8 +213,10 @@ class GcpWrapper:
         credentials = ServiceAccountCredentials.from_json_keyfile_dict(
             credentials_dict, scopes='https://www.googleapis.com/auth/cloud-platform')
 
-        self.compute = discovery.build('compute', 'v1', credentials=credentials)
-        self.deployment_manager = discovery.build('deploymentmanager', 'v2', credentials=credentials)
+        self.compute = discovery.build_from_document(
+            get_discovery_document('compute', 'v1'), credentials=credentials)
+        self.deployment_manager = discovery.build_from_document(
+            get_discovery_document('deploymentmanager', 'v2'), credentials=credentials)
         self.project_id = credentials_dict['project_id']
 
     @catch_http_exceptions
@@ -205,14 +237,41 @@ class GcpWrapper:
         for instance in response.get('managedInstances', []):
             yield instance
 
-    @retry(wait_fixed=2000, retry_on_result=lambda res: res is None, stop_max_delay=30 * 1000)
-    def get_instance_network_properties(self, instance_name: str, zone: str) -> dict:
-        network_info = self.get_instance_info(instance_name, zone)['networkInterfaces'][0]
-        if 'networkIP' not in network_info or 'accessConfigs' not in network_info:
-            return None
-        if 'natIP' not in network_info['accessConfigs'][0]:
-            return None
-        return network_info
+    @catch_http_exceptions
+    def list_instances(self, names: list, zone: str) -> typing.Iterator[dict]:
+        """ Lists the instances with the given names in a single (paginated) API call. Only the fields needed to
+        resolve the addresses of the instances are requested
+        """
+        request = self.compute.instances().list(
+            project=self.project_id, zone=zone,
+            filter='name eq ({})'.format('|'.join(re.escape(name) for name in names)),
+            fields='items(name,networkInterfaces(networkIP,accessConfigs(natIP))),nextPageToken')
+        while request is not None:
+            response = request.execute()
+            log.debug('list_instances response: ' + str(response))
+            yield from response.get('items', [])
+            request = self.compute.instances().list_next(previous_request=request, previous_response=response)
+
+    def get_instances_network_properties(self, names: list, zone: str) -> dict:
+        """ Returns the network interface of every named instance by name. Instances are listed together and only
+        the ones that have not been assigned both of their IPs yet are listed again, for up to
+        INSTANCE_NETWORK_TIMEOUT seconds
+        """
+        network_properties = dict()
+        missing = list(names)
+        deadline = time.time() + INSTANCE_NETWORK_TIMEOUT
+        while missing:
+            for instance in self.list_instances(missing, zone):
+                network_info = instance['networkInterfaces'][0]
+                if 'networkIP' in network_info and 'natIP' in network_info.get('accessConfigs', [{}])[0]:
+                    network_properties[instance['name']] = network_info
+            missing = [name for name in names if name not in network_properties]
+            if missing:
+                if time.time() > deadline:
+                    raise util.DeploymentError('Instances have not been assigned IPs: {}'.format(', '.join(missing)))
+                log.debug('Waiting for the IPs of instances: {}'.format(', '.join(missing)))
+                time.sleep(2)
+        return network_properties
 
     @catch_http_exceptions
     def create_deployment(self, name: str, deployment_config: dict, tags: dict=None):
@@ -223,7 +282,7 @@ class GcpWrapper:
             'description': """{"cluster_type": "DC/OS Onprem on GCE"}""",
             'target': {
                 'config': {
-                    'content': yaml.dump(deployment_config, default_flow_style=False)}
+                    'content': util.dump_yaml(deployment_config, default_flow_style=False)}
             },
             'labels': tag_dict_to_gce_format(tags)
         }
@@ -233,32 +292,67 @@ class GcpWrapper:
             project=self.project_id, body=body).execute()
         log.debug('create_deployment response: ' + str(response))
 
-    @catch_http_exceptions
-    def get_deployments(self):
+    def get_deployments(self) -> typing.Iterator['Deployment']:
         """ iterates over all current deployments, returning a generic Deployment class
         when there is no instanceGroupManager to establish that we are dealing with
         a BareClusterDeployment. Any deployments that are in the process of being deleted
-        are skipped to avoid query errors on deleted deployments
+        are skipped to avoid query errors on deleted deployments. The resources of
+        GET_DEPLOYMENTS_BATCH_SIZE deployments at a time are looked up in a single batch
+        request and their deployments are yielded as soon as the batch is done
         """
-        request = self.deployment_manager.deployments().list(project=self.project_id)
+        request = self.deployment_manager.deployments().list(
+            project=self.project_id, fields='deployments(name,operation(operationType)),nextPageToken')
         while request is not None:
             response = request.execute()
-            for deployment_info in response.get('deployments', []):
-                # we don't want to retrieve deployments that are in the process of being deleted
-                if deployment_info['operation']['operationType'] == 'deleted':
-                    continue
-                deployment = Deployment(self, deployment_info['name'])
-                zone = None
-                for r in deployment.get_resources()['resources']:
-                    if r['type'] == 'compute.v1.instanceGroupManager':
-                        zone = r.get('properties', {}).get('zone')
-                if zone is None:
-                    yield deployment
-                else:
-                    yield BareClusterDeployment(self, deployment_info['name'], zone)
+            # we don't want to retrieve deployments that are in the process of being deleted
+            names = [d['name'] for d in response.get('deployments', [])
+                     if d['operation']['operationType'] != 'deleted']
+            for i in range(0, len(names), GET_DEPLOYMENTS_BATCH_SIZE):
+                yield from self._get_typed_deployments(names[i:i + GET_DEPLOYMENTS_BATCH_SIZE])
             request = self.deployment_manager.deployments().list_next(previous_request=request,
                                                                       previous_response=response)
 
+    @catch_http_exceptions
+    def _get_typed_deployments(self, names: list) -> list:
+        zones = dict()
+        incomplete = list()
+
+        def add_zone(name, response, exception):
+            if exception is not None:
+                if isinstance(exception, HttpError) and exception.resp.status == 404:
+                    log.debug('Deployment {} was deleted while deployments were listed'.format(name))
+                    return
+                raise exception
+            zones[name] = get_instance_group_zones(response.get('resources', []))
+            if 'nextPageToken' in response:
+                incomplete.append(name)
+
+        batch = self.deployment_manager.new_batch_http_request(callback=add_zone)
+        for name in names:
+            batch.add(self.deployment_manager.resources().list(
+                project=self.project_id, deployment=name, fields=INSTANCE_GROUP_ZONE_FIELDS), request_id=name)
+        batch.execute()
+        # the resources did not fit on one page
+        for name in incomplete:
+            zones[name] = Deployment(self, name).get_instance_group_zones()
+
+        deployments = list()
+        for name in names:
+            if name not in zones:
+                continue
+            if not zones[name]:
+                deployments.append(Deployment(self, name))
+            else:
+                deployments.append(BareClusterDeployment(self, name, zones[name]))
+        return deployments
+
+
+def get_instance_group_zones(resources: list) -> list:
+    """ Returns the zones of the instance group managers amongst the given deployment resources
+    """
+    return [util.load_yaml(r.get('properties', '{}')).get('zone') for r in resources
+            if r['type'] == 'compute.v1.instanceGroupManager']
+
 
 class Deployment:
     def __init__(self, gcp_wrapper: GcpWrapper, name: str):
@@ -271,6 +365,23 @@ class Deployment:
                                                                             deployment=self.name).execute()
         log.debug('delete response: ' + str(response))
 
+    def get_delete_status(self) -> str:
+        """ A deployment is gone once its delete operation is done. An operation that is done with an error, or
+        one that is not a delete at all, means that the deployment failed to delete
+        """
+        try:
+            operation = self.gcp_wrapper.deployment_manager.deployments().get(
+                project=self.gcp_wrapper.project_id, deployment=self.name,
+                fields='operation(operationType,status,error)').execute()['operation']
+        except HttpError as e:
+            if e.resp.status == 404:
+                return util.DELETE_COMPLETE
+            raise
+        if operation['operationType'] != 'delete' or 'error' in operation:
+            log.error('Deployment {} failed to delete: {}'.format(self.name, operation))
+            return util.DELETE_FAILED
+        return util.DELETE_PENDING
+
     @catch_http_exceptions
     def get_info(self) -> dict:
         """ Returns the dictionary representation of a GCE deployment resource. For details on the contents of this
@@ -281,22 +392,73 @@ class Deployment:
         log.debug('get_info response: ' + str(response))
         return response
 
-    def _check_status(response: dict) -> bool:
-        """ Checks the status of the deployment until it is done or has failed
-        :param response : <dict> http response containing info about the deployment
-        :return: <boolean> whether to continue checking the status of the deployment (True) or not (False)
+    @catch_http_exceptions
+    def get_operation(self, operation_name: str) -> dict:
+        response = self.gcp_wrapper.deployment_manager.operations().get(project=self.gcp_wrapper.project_id,
+                                                                        operation=operation_name).execute()
+        log.debug('get_operation response: ' + str(response))
+        return response
+
+    @catch_http_exceptions
+    def get_instance_group_zones(self) -> list:
+        zones = list()
+        request = self.gcp_wrapper.deployment_manager.resources().list(
+            project=self.gcp_wrapper.project_id, deployment=self.name, fields=INSTANCE_GROUP_ZONE_FIELDS)
+        while request is not None:
+            response = request.execute()
+            zones.extend(get_instance_group_zones(response.get('resources', [])))
+            request = self.gcp_wrapper.deployment_manager.resources().list_next(previous_request=request,
+                                                                                previous_response=response)
+        return zones
+
+    @catch_http_exceptions
+    def get_resource_states(self) -> dict:
+        """ Returns the state of every resource of the deployment by name. Resources without a pending update are
+        reported as COMPLETED
         """
-        status = response['operation']['status']
-        if status == 'DONE':
-            return False
-        elif status == 'RUNNING' or status == 'PENDING':
-            log.debug('Waiting for deployment')
-            return True
-        else:
-            raise Exception('Deployment failed with response: ' + str(response))
-
-    @retry(wait_fixed=60 * 1000, retry_on_result=_check_status, retry_on_exception=lambda _: False)
-    def wait_for_completion(self) -> dict:
+        states = dict()
+        request = self.gcp_wrapper.deployment_manager.resources().list(
+            project=self.gcp_wrapper.project_id, deployment=self.name,
+            fields='resources(name,update(state)),nextPageToken')
+        while request is not None:
+            response = request.execute()
+            for resource in response.get('resources', []):
+                states[resource['name']] = resource.get('update', {}).get('state', 'COMPLETED')
+            request = self.gcp_wrapper.deployment_manager.resources().list_next(previous_request=request,
+                                                                                previous_response=response)
+        return states
+
+    def wait_for_completion(self, timeout: int=DEPLOYMENT_TIMEOUT) -> dict:
+        """ Waits for the last operation on the deployment to finish, polling it in growing intervals from
+        DEPLOYMENT_WAIT_MIN_INTERVAL to DEPLOYMENT_WAIT_MAX_INTERVAL seconds. The states of the deployment's
+        resources are logged whenever they change. Returns the deployment info once the operation is done
+        """
+        info = self.get_info()
+        operation = info['operation']
+        deadline = time.time() + timeout
+        interval = DEPLOYMENT_WAIT_MIN_INTERVAL
+        last_states = None
+        while operation['status'] != 'DONE':
+            if operation['status'] not in ('RUNNING', 'PENDING'):
+                raise util.DeploymentError('Deployment failed with response: ' + str(operation))
+            now = time.time()
+            if now >= deadline:
+                raise util.DeploymentError('Deployment {} was not done after {} seconds: {}'.format(
+                    self.name, timeout, operation))
+            # the last poll happens right at the deadline
+            time.sleep(min(interval, deadline - now))
+            interval = min(interval * 2, DEPLOYMENT_WAIT_MAX_INTERVAL)
+            operation = self.get_operation(operation['name'])
+            states = self.get_resource_states()
+            if states != last_states:
+                done = sum(1 for state in states.values() if state == 'COMPLETED')
+                pending = ', '.join('{} ({})'.format(name, state) for name, state in sorted(states.items())
+                                    if state != 'COMPLETED')
+                log.info('Deployment {}: {}/{} resources completed. Waiting for: {}'.format(
+                    self.name, done, len(states), pending or 'nothing'))
+                last_states = states
+        if operation is info['operation']:
+            return info
         return self.get_info()
 
     def get_resources(self):
@@ -306,18 +468,15 @@ class Deployment:
         while request is not None:
             response = request.execute()
             for resource in response.get('resources', []):
-                resource_copy = copy.deepcopy(resource)
-                for key in resource_copy:
-                    # The only fields we need as you can see in the templates at the top of this file. Other fields
-                    # are present that would cause an error when the API is called for updating a deployment
-                    if key not in ('type', 'name', 'metadata', 'properties'):
-                        del resource[key]
-                    # the yaml strings in these fields are not properly formatted for the API (error thrown when
-                    # updating a deployment) so we load it and then dump the whole resource data structure correctly in
-                    # update_tags afterwards -> default_flow_style=False
-                    if key in ['properties', 'metadata']:
-                        resource[key] = yaml.load(resource[key])
-
+                # The only fields we need as you can see in the resource builders at the top of this file. Other
+                # fields are present that would cause an error when the API is called for updating a deployment
+                resource = {k: v for k, v in resource.items() if k in ('type', 'name', 'metadata', 'properties')}
+                # the yaml strings in these fields are not properly formatted for the API (error thrown when
+                # updating a deployment) so we load it and then dump the whole resource data structure correctly in
+                # update_tags afterwards -> default_flow_style=False
+                for key in ('properties', 'metadata'):
+                    if key in resource:
+                        resource[key] = util.load_yaml(resource[key])
                 resources.append(resource)
             request = self.gcp_wrapper.deployment_manager.resources().list_next(previous_request=request,
                                                                                 previous_response=response)
@@ -328,7 +487,7 @@ class Deployment:
                                                                      deployment=self.name).execute()
         # we need to get the resources because they're not provided in the info and they're necessary for update
         info['target'] = {
-            'config': {'content': yaml.dump(self.get_resources(), default_flow_style=False)}
+            'config': {'content': util.dump_yaml(self.get_resources(), default_flow_style=False)}
         }
         info['labels'] = tag_dict_to_gce_format(tags)
         response = self.gcp_wrapper.deployment_manager.deployments().update(project=self.gcp_wrapper.project_id,
@@ -347,11 +506,12 @@ class Deployment:
 
 class BareClusterDeployment(Deployment):
     """ A specialized deployment that contains a basic, network-connected,
-    cluster of identical, minimally configured machines for installing DC/OS
+    cluster of identical, minimally configured machines for installing DC/OS.
+    The machines are spread over one managed instance group per zone
     """
     @property
-    def instance_group_name(self):
-        return self.name + '-group'
+    def instance_group_names(self) -> dict:
+        return get_instance_group_names(self.name, self.zones)
 
     @property
     def template_name(self):
@@ -365,19 +525,20 @@ class BareClusterDeployment(Deployment):
     def firewall_name(self):
         return self.name + '-firewall'
 
-    def __init__(self, gcp_wrapper, name, zone):
-        """ zone argument dictates where the single managed
-        instance group will be deployed to
+    def __init__(self, gcp_wrapper, name, zones: list):
+        """ zones argument dictates where the managed instance
+        groups will be deployed to
         """
         super().__init__(gcp_wrapper, name)
-        self.zone = zone
+        # duplicates are dropped, but the order is kept as the first zones get the extra nodes
+        self.zones = list(collections.OrderedDict.fromkeys(zones))
 
     @classmethod
     def create(
             cls,
             gcp_wrapper: GcpWrapper,
             name: str,
-            zone: str,
+            zones: list,
             node_count: int,
             disk_size: int,
             disk_type: str,
@@ -390,44 +551,34 @@ class BareClusterDeployment(Deployment):
             use_preemptible_vms: bool,
             tags: dict=None):
 
-        deployment = cls(gcp_wrapper, name, zone)
-
-        network_resource = NETWORK_TEMPLATE.format(name=deployment.network_name)
-        instance_template_resource = INSTANCE_TEMPLATE.format(
-            project=gcp_wrapper.project_id,
-            sourceImage=source_image,
-            name=deployment.template_name,
-            machineType=machine_type,
-            imageProject=image_project,
-            zone=zone,
-            ssh_user=ssh_user,
-            ssh_public_key=ssh_public_key,
-            network=deployment.network_name,
-            diskSizeGb=disk_size,
-            diskType=disk_type,
-            usePreemptibleVMs=use_preemptible_vms,
-            deploymentName=deployment.name)
-        instance_group_resource = MANAGED_INSTANCE_GROUP_TEMPLATE.format(
-            name=deployment.instance_group_name,
-            instance_template_name=deployment.template_name,
-            size=node_count,
-            zone=zone,
-            network=deployment.network_name)
-        external_firewall_resource = EXTERNAL_FIREWALL_TEMPLATE.format(
-            name=deployment.firewall_name,
-            network=deployment.network_name)
-        internal_firewall_resource = INTERNAL_FIREWALL_TEMPLATE.format(
-            name=deployment.firewall_name,
-            network=deployment.network_name,
-            deploymentName=deployment.name)
+        deployment = cls(gcp_wrapper, name, zones)
 
         deployment_config = {
-            'resources': [yaml.load(network_resource),
-                          yaml.load(instance_template_resource),
-                          yaml.load(instance_group_resource),
-                          yaml.load(external_firewall_resource),
-                          yaml.load(internal_firewall_resource)]
+            'resources': [
+                network_resource(deployment.network_name),
+                instance_template_resource(
+                    name=deployment.template_name,
+                    project=gcp_wrapper.project_id,
+                    network=deployment.network_name,
+                    machine_type=machine_type,
+                    disk_size=disk_size,
+                    disk_type=disk_type,
+                    image_project=image_project,
+                    source_image=source_image,
+                    ssh_user=ssh_user,
+                    ssh_public_key=ssh_public_key,
+                    use_preemptible_vms=use_preemptible_vms,
+                    deployment_name=deployment.name),
+                external_firewall_resource(deployment.firewall_name, deployment.network_name),
+                internal_firewall_resource(deployment.firewall_name, deployment.network_name, deployment.name)]
         }
+        # the groups only depend on the instance template, so the deployment manager creates them in parallel
+        for zone, size in zip(deployment.zones, get_zone_sizes(node_count, len(deployment.zones))):
+            deployment_config['resources'].append(managed_instance_group_resource(
+                name=deployment.instance_group_names[zone],
+                instance_template_name=deployment.template_name,
+                zone=zone,
+                size=size))
 
         if disable_updates and image_project == 'coreos-cloud':
             user_data = {
@@ -439,18 +590,47 @@ class BareClusterDeployment(Deployment):
         gcp_wrapper.create_deployment(name, deployment_config, tags=tags)
         return deployment
 
-    @property
-    def instance_names(self):
-        # only returns the names of the
-        for instance in self.gcp_wrapper.list_group_instances(self.instance_group_name, self.zone):
+    def get_instance_names(self, zone: str) -> typing.Iterator[str]:
+        for instance in self.gcp_wrapper.list_group_instances(self.instance_group_names[zone], zone):
             yield instance['instance'].split('/')[-1]
 
+    @property
+    def hosts_by_zone(self) -> dict:
+        """ The sorted hosts of every zone
+        """
+        hosts = dict()
+        for zone in self.zones:
+            network_properties = self.gcp_wrapper.get_instances_network_properties(
+                list(self.get_instance_names(zone)), zone)
+            hosts[zone] = sorted(Host(private_ip=info['networkIP'], public_ip=info['accessConfigs'][0]['natIP'])
+                                 for info in network_properties.values())
+        return hosts
+
     @property
     def hosts(self):
-        """ order of return here determines cluster composition, so make sure its consistent
+        """ order of return here determines cluster composition, so make sure its consistent. The hosts
+        of the zones are interleaved so that consecutive hosts, e.g. the masters, are spread over the zones
         """
-        output_list = list()
-        for name in self.instance_names:
-            info = self.gcp_wrapper.get_instance_network_properties(name, self.zone)
-            output_list.append(Host(private_ip=info['networkIP'], public_ip=info['accessConfigs'][0]['natIP']))
-        return sorted(output_list)
+        hosts_by_zone = self.hosts_by_zone
+        hosts = list()
+        for i in range(max(len(zone_hosts) for zone_hosts in hosts_by_zone.values())):
+            for zone in self.zones:
+                if i < len(hosts_by_zone[zone]):
+                    hosts.append(hosts_by_zone[zone][i])
+        return hosts
+
+
+def get_instance_group_names(deployment_name: str, zones: list) -> dict:
+    """ The name of the instance group in each zone. Single zone deployments keep the
+    name that deployments had before they could span zones
+    """
+    if len(zones) == 1:
+        return {zones[0]: deployment_name + '-group'}
+    return {zone: '{}-group-{}'.format(deployment_name, zone) for zone in zones}
+
+
+def get_zone_sizes(node_count: int, num_zones: int) -> list:
+    """ Spreads node_count nodes as evenly as possible over num_zones zones, with the
+    remainder going to the first zones
+    """
+    return [node_count // num_zones + (1 if i < node_count % num_zones else 0) for i in range(num_zones)]
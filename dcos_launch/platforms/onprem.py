@@ -1,18 +1,53 @@
 """ Tools for facilitating onprem deployments
 """
 import asyncio
+import json
 import logging
 import os
+import re
 import sys
+import tempfile
+import time
 
 import retrying
 
+from dcos_launch import util
 from dcos_test_utils import onprem, ssh_client
 from typing import Union
 
 log = logging.getLogger(__name__)
 
 NGINX_DOCKER_IMAGE_VERSION = 'nginx:1.15.2'
+ZOOKEEPER_DOCKER_IMAGE = 'jplock/zookeeper'
+PREREQS_BUNDLE_DOCKER_IMAGE = 'centos:7'
+
+# The phases of an onprem install in the order they are run. The first three are
+# run on the bootstrap host and the remaining ones on every cluster host
+INSTALL_PHASES = (
+    'installer', 'genconf', 'prereqs_bundle', 'ssh', 'selinux', 'prereqs', 'preflight', 'deploy', 'postflight')
+
+# Packages installed by scripts/install_prereqs.sh; keep these in sync with the script
+PREREQS_BUNDLE_PACKAGES = [
+    'wget', 'curl', 'git', 'unzip', 'xz', 'ipset', 'bind-utils',
+    'docker-engine-17.05.0.ce', 'docker-engine-selinux-17.05.0.ce']
+
+# Resolves the full dependency closure of the prereqs against an empty install root
+# so that nothing is assumed to be present on the cluster hosts
+PREREQS_BUNDLE_SCRIPT = """
+set -o errexit -o nounset -o pipefail
+cat > /etc/yum.repos.d/docker.repo <<'EOF'
+[dockerrepo]
+name=Docker Repository
+baseurl=https://yum.dockerproject.org/repo/main/centos/7
+enabled=1
+gpgcheck=1
+gpgkey=https://yum.dockerproject.org/gpg
+EOF
+yum install -y createrepo
+mkdir -p /tmp/installroot
+yum install -y --downloadonly --installroot=/tmp/installroot --releasever=7 --downloaddir=/bundle {packages}
+createrepo /bundle
+"""
 
 
 def get_client(
@@ -22,7 +57,16 @@ def get_client(
         parallelism: int=None) -> ssh_client.AsyncSshClient:
     """ Returns an async client for a given Host generator property of cluster
     """
-    targets = [host.public_ip for host in getattr(cluster, node_type)]
+    return get_host_client(getattr(cluster, node_type), ssh, parallelism=parallelism)
+
+
+def get_host_client(
+        hosts: list,
+        ssh: ssh_client.SshClient,
+        parallelism: int=None) -> ssh_client.AsyncSshClient:
+    """ Returns an async client targeting an explicit list of Hosts
+    """
+    targets = [host.public_ip for host in hosts]
     if parallelism is None:
         parallelism = len(targets)
     return ssh_client.AsyncSshClient(
@@ -65,6 +109,74 @@ def generate_log_filename(target_name: str):
         i += 1
 
 
+def get_retry_policy(retry_policies: dict, phase: str) -> dict:
+    """ The policy of a phase is its own entry in retry_policies laid over the
+    'default' entry, which itself is laid over no retries at all
+    """
+    policy = {'retries': 0, 'backoff': 10, 'retryable_exit_codes': []}
+    policy.update(retry_policies.get('default', {}))
+    policy.update(retry_policies.get(phase, {}))
+    return policy
+
+
+def run_phase(
+        journal: util.PhaseJournal,
+        phase: str,
+        hosts: list,
+        node_client: ssh_client.SshClient,
+        action,
+        retry_policy: dict=None):
+    """ Runs action on every host that has not yet completed phase according to
+    journal. Failed hosts are re-dispatched on their own according to retry_policy
+    and the phase only fails once a host has exhausted its retries. The hosts
+    that succeed are recorded in the journal before any failures are raised, so
+    that a re-run only has to retry the failed hosts
+    Args:
+        journal: record of the per-host phase completion
+        phase: name of the phase in journal
+        hosts: all the Hosts that must complete phase
+        node_client: SshClient that can access all of hosts
+        action: callable that takes the list of pending Hosts and returns a
+            list of result dicts (see check_results)
+        retry_policy: dict with the number of retries per host, the backoff in
+            seconds (doubled after every attempt) and the retryable exit codes
+            (any non-zero code if empty)
+    """
+    if retry_policy is None:
+        retry_policy = get_retry_policy(dict(), phase)
+    pending = [h for h in hosts if not journal.is_complete(phase, h.public_ip)]
+    if len(pending) < len(hosts):
+        log.info('Skipping {} on {} host(s) that already completed it'.format(phase, len(hosts) - len(pending)))
+    if not pending:
+        return
+    start = time.time()
+    attempts = {h.public_ip: 0 for h in pending}
+    failures = list()
+    dispatch = pending
+    while dispatch:
+        for host in dispatch:
+            attempts[host.public_ip] += 1
+        results = action(dispatch)
+        journal.mark_complete(phase, [r['host'] for r in results if r['returncode'] == 0])
+        retry_hosts = set()
+        for result in results:
+            if result['returncode'] == 0:
+                continue
+            retryable_codes = retry_policy['retryable_exit_codes']
+            if attempts[result['host']] <= retry_policy['retries'] and \
+                    (not retryable_codes or result['returncode'] in retryable_codes):
+                retry_hosts.add(result['host'])
+            else:
+                failures.append(result)
+        dispatch = [h for h in pending if h.public_ip in retry_hosts]
+        if dispatch:
+            backoff = retry_policy['backoff'] * 2 ** (max(attempts[h] for h in retry_hosts) - 1)
+            log.warning('{} failed on {}; retrying in {}s'.format(phase, ', '.join(sorted(retry_hosts)), backoff))
+            time.sleep(backoff)
+    journal.record_attempts(phase, attempts, time.time() - start)
+    check_results(failures, node_client, phase)
+
+
 def install_dcos(
         cluster: onprem.OnpremCluster,
         node_client: ssh_client.SshClient,
@@ -72,7 +184,9 @@ def install_dcos(
         install_prereqs: bool,
         bootstrap_script_url: str,
         parallelism: int,
-        enable_selinux: Union[bool, None]):
+        enable_selinux: Union[bool, None],
+        journal: util.PhaseJournal=None,
+        retry_policies: dict=None):
     """
     Args:
         cluster: cluster abstraction for handling network addresses
@@ -81,42 +195,61 @@ def install_dcos(
         bootstrap_script_url: where the installation script will be pulled from (see do_genconf)
         parallelism: how many concurrent SSH tunnels to run
         enable_selinux: attempt to enable selinux on every node
+        journal: if given, phases already completed by a host are skipped for it
+        retry_policies: per-phase retry policies, keyed by phase name or 'default'
+            (see get_retry_policy)
     """
+    if journal is None:
+        journal = util.PhaseJournal(INSTALL_PHASES)
+    if retry_policies is None:
+        retry_policies = dict()
+    cluster_hosts = list(cluster.cluster_hosts)
+
+    def on_hosts(do_command):
+        return lambda hosts: do_command(get_host_client(hosts, node_client, parallelism=parallelism))
+
+    def run(phase, action):
+        run_phase(journal, phase, cluster_hosts, node_client, action,
+                  retry_policy=get_retry_policy(retry_policies, phase))
+
     # Check to make sure we can talk to the cluster
-    for host in cluster.cluster_hosts:
+    for host in cluster_hosts:
+        if journal.is_complete('ssh', host.public_ip):
+            continue
         node_client.wait_for_ssh_connection(host.public_ip)
-    # do genconf and configure bootstrap if necessary
-    all_client = get_client(cluster, 'cluster_hosts', node_client, parallelism=parallelism)
+        journal.mark_complete('ssh', [host.public_ip])
 
     # enable or disable selinux depending on the config
     if enable_selinux is not None:
         setenforce = '1' if enable_selinux else '0'
-        check_results(all_client.run_command('run', ['sudo setenforce ' + setenforce]), node_client, 'Set SELinux mode')
+        run('selinux', on_hosts(
+            lambda client: client.run_command('run', ['sudo setenforce ' + setenforce])))
 
     # install prereqs if enabled
     if install_prereqs:
-        log.info('Copying prereqs installation script on cluster hosts')
-        check_results(
-            all_client.run_command('copy', prereqs_script_path, '~/install_prereqs.sh', False), node_client,
-            'copy install_prereqs script')
         log.info('Installing prerequisites on cluster hosts')
-        check_results(
-            all_client.run_command('run', ['chmod +x ~/install_prereqs.sh', '&&', '~/install_prereqs.sh']), node_client,
-            'install DC/OS prerequisites')
+        run('prereqs', lambda hosts: do_install_prereqs(hosts, node_client, prereqs_script_path, parallelism))
         log.info('Prerequisites installed.')
 
     # download install script from boostrap host and run it
     remote_script_path = '/tmp/install_dcos.sh'
     log.info('Starting preflight')
-    check_results(
-        do_preflight(all_client, remote_script_path, bootstrap_script_url), node_client, 'preflight')
+    run('preflight', on_hosts(
+        lambda client: do_preflight(client, remote_script_path, bootstrap_script_url)))
     log.info('Preflight check succeeded; moving onto deploy')
-    check_results(
-        do_deploy(cluster, node_client, parallelism, remote_script_path), node_client, 'deploy')
+    run('deploy', lambda hosts: do_deploy(
+        {role: [h for h in getattr(cluster, role) if h in hosts]
+         for role in ('masters', 'private_agents', 'public_agents')},
+        node_client, parallelism, remote_script_path))
     log.info('Deploy succeeded; moving onto postflight')
-    check_results(
-        do_postflight(all_client), node_client, 'postflight')
+    run('postflight', on_hosts(do_postflight))
     log.info('Postflight succeeded')
+    log.info('Install phase report: {}'.format(util.json_prettyprint(journal.report)))
+
+
+def get_installer_path(ssh_tunnel: ssh_client.Tunnelled) -> str:
+    bootstrap_home = ssh_tunnel.command(['pwd']).decode().strip()
+    return os.path.join(bootstrap_home, 'dcos_generate_config.sh')
 
 
 def prepare_bootstrap(
@@ -129,8 +262,7 @@ def prepare_bootstrap(
     """
     log.info('Setting up installer on bootstrap host')
     ssh_tunnel.command(['mkdir', '-p', 'genconf'])
-    bootstrap_home = ssh_tunnel.command(['pwd']).decode().strip()
-    installer_path = os.path.join(bootstrap_home, 'dcos_generate_config.sh')
+    installer_path = get_installer_path(ssh_tunnel)
     download_dcos_installer(ssh_tunnel, installer_path, download_url)
     return installer_path
 
@@ -140,7 +272,6 @@ def do_genconf(
         genconf_dir: str,
         installer_path: str):
     """ runs --genconf with the installer
-    if an nginx is running, kill it and restart the nginx to host the files
     Args:
         ssh_tunnel: tunnel to the host running the installer
         genconf_dir: path on localhost of genconf directory to transfer
@@ -153,7 +284,13 @@ def do_genconf(
     # try --genconf
     log.info('Running --genconf command...')
     ssh_tunnel.command(['sudo', 'bash', installer_path, '--genconf'], stdout=sys.stdout.buffer)
-    # if OK we just need to restart nginx
+
+
+def start_bootstrap_nginx(ssh_tunnel: ssh_client.Tunnelled, installer_path: str):
+    """ (Re)starts the nginx hosting genconf/serve. Must be run after do_genconf, which
+    recreates genconf/serve
+    """
+    installer_dir = os.path.dirname(installer_path)
     host_share_path = os.path.join(installer_dir, 'genconf/serve')
     volume_mount = host_share_path + ':/usr/share/nginx/html'
     nginx_service_name = 'dcos-bootstrap-nginx'
@@ -166,6 +303,130 @@ def do_genconf(
         ['--publish=80:80', '--volume=' + volume_mount, NGINX_DOCKER_IMAGE_VERSION])
 
 
+def do_build_prereqs_bundle(ssh_tunnel: ssh_client.Tunnelled, installer_path: str) -> str:
+    """ Downloads the RPMs installed by the prereqs script once on the bootstrap host
+    and turns them into a yum repository inside genconf/serve, so that it is served by
+    the bootstrap nginx. Must be run after start_bootstrap_nginx
+
+    Returns:
+        path of the repository relative to the bootstrap URL
+    """
+    log.info('Building prereqs bundle on the bootstrap host')
+    installer_dir = os.path.dirname(installer_path)
+    bundle_dir = os.path.join(installer_dir, 'genconf/serve/prereqs')
+    remote_script_path = os.path.join(installer_dir, 'build_prereqs_bundle.sh')
+    with tempfile.NamedTemporaryFile('w', suffix='.sh') as f:
+        f.write(PREREQS_BUNDLE_SCRIPT.format(packages=' '.join(PREREQS_BUNDLE_PACKAGES)))
+        f.flush()
+        ssh_tunnel.copy_file(f.name, remote_script_path)
+    ssh_tunnel.command(
+        ['sudo', 'docker', 'run', '--rm', '--volume=' + bundle_dir + ':/bundle',
+         '--volume=' + remote_script_path + ':/build_prereqs_bundle.sh', PREREQS_BUNDLE_DOCKER_IMAGE,
+         'bash', '/build_prereqs_bundle.sh'], stdout=sys.stdout.buffer)
+    return 'prereqs'
+
+
+def get_bundled_prereqs_script(prereqs_script: str, bundle_url: str) -> str:
+    """ Points the prereqs script at the bundle served from bundle_url instead of the
+    public package mirrors
+    """
+    shebang, _, body = prereqs_script.partition('\n')
+    if not shebang.startswith('#!'):
+        shebang, body = '#!/usr/bin/env bash', prereqs_script
+    return "{}\nexport PREREQS_REPO_URL='{}'\n{}".format(shebang, bundle_url, body)
+
+
+def get_installed_version(node_client: ssh_client.SshClient, host: str) -> str:
+    """ Reads the DC/OS version currently installed on host
+    """
+    version_json = node_client.command(host, ['cat', '/opt/mesosphere/etc/dcos-version.json'])
+    return json.loads(version_json.decode())['version']
+
+
+def do_generate_node_upgrade_script(
+        ssh_tunnel: ssh_client.Tunnelled,
+        genconf_dir: str,
+        installer_path: str,
+        installed_version: str) -> str:
+    """ runs --generate-node-upgrade-script with the (new) installer. The script
+    is written into genconf/serve, so it will be hosted by the already running nginx
+    Args:
+        ssh_tunnel: tunnel to the host running the installer
+        genconf_dir: path on localhost of genconf directory to transfer
+        installer_path: path of the new installer on the remote host
+        installed_version: DC/OS version currently running on the cluster
+
+    Returns:
+        URL of the node upgrade script
+    """
+    log.debug('Copying config to host bootstrap host')
+    ssh_tunnel.copy_file(genconf_dir, os.path.dirname(installer_path))
+    log.info('Generating node upgrade script from version {}...'.format(installed_version))
+    output = ssh_tunnel.command(
+        ['sudo', 'bash', installer_path, '--generate-node-upgrade-script', installed_version]).decode()
+    log.debug('Node upgrade script generation output: ' + output)
+    m = re.search(r'(http\S+/dcos_node_upgrade\.sh)', output)
+    if m is None:
+        raise Exception('Could not find the node upgrade script URL in the installer output: ' + output)
+    return m.group(1)
+
+
+def get_upgrade_waves(cluster: onprem.OnpremCluster, wave_size: int) -> list:
+    """ Splits the cluster into the ordered waves of an upgrade: masters must
+    be upgraded strictly one at a time, while agents can be upgraded in groups
+    of up to wave_size
+
+    Returns:
+        list of (role, [Host]) tuples
+    """
+    waves = [('master', [host]) for host in cluster.masters]
+    for role, hosts in (('private_agent', list(cluster.private_agents)),
+                        ('public_agent', list(cluster.public_agents))):
+        waves.extend((role, hosts[i:i + wave_size]) for i in range(0, len(hosts), wave_size))
+    return waves
+
+
+def upgrade_dcos(
+        cluster: onprem.OnpremCluster,
+        node_client: ssh_client.SshClient,
+        upgrade_script_url: str,
+        wave_size: int) -> list:
+    """ Rolls the node upgrade script out over the cluster. Each wave must pass
+    the node health checks before the next wave is started
+    Args:
+        cluster: cluster abstraction for handling network addresses
+        node_client: SshClient that can access all non-bootstrap nodes in `cluster`
+        upgrade_script_url: where the node upgrade script will be pulled from
+            (see do_generate_node_upgrade_script)
+        wave_size: how many agents to upgrade concurrently
+
+    Returns:
+        list of dicts with the role, hosts and timings of each wave
+    """
+    remote_script_path = '/tmp/dcos_node_upgrade.sh'
+    upgrade_script = '{download_cmd} && sudo bash {remote_script_path}'.format(
+        download_cmd=' '.join(curl(upgrade_script_url, remote_script_path)),
+        remote_script_path=remote_script_path)
+    waves = get_upgrade_waves(cluster, wave_size)
+    timings = list()
+    for i, (role, hosts) in enumerate(waves):
+        tag = 'upgrade wave {} ({})'.format(i, role)
+        log.info('Starting {} on: {}'.format(tag, ', '.join(h.public_ip for h in hosts)))
+        wave_client = get_host_client(hosts, node_client)
+        start = time.time()
+        check_results(wave_client.run_command('run', [upgrade_script]), node_client, tag)
+        upgraded = time.time()
+        check_results(do_postflight(wave_client), node_client, tag + ' health check')
+        finished = time.time()
+        log.info('Finished {} in {:.1f}s'.format(tag, finished - start))
+        timings.append({
+            'role': role,
+            'hosts': [h.public_ip for h in hosts],
+            'upgrade_seconds': round(upgraded - start, 1),
+            'health_check_seconds': round(finished - upgraded, 1)})
+    return timings
+
+
 def curl(download_url: str, out_path: str) -> list:
     """ returns a robust curl command in list form
     """
@@ -198,6 +459,55 @@ def start_docker_service(ssh_tunnel: ssh_client.Tunnelled, docker_name: str, doc
         ['sudo', 'docker', 'run', '--name', docker_name, '--detach=true'] + docker_args)
 
 
+def has_docker_image(ssh_tunnel: ssh_client.Tunnelled, image: str) -> bool:
+    return bool(ssh_tunnel.command(['sudo', 'docker', 'images', '-q', image]).decode().strip())
+
+
+def load_docker_images(ssh_tunnel: ssh_client.Tunnelled, images: list, image_tarball: str):
+    """ Uploads image_tarball (as written by `docker save`) over the tunnel and loads
+    it, unless all of images are already present on the host
+    """
+    if all(has_docker_image(ssh_tunnel, image) for image in images):
+        log.info('Docker images are already present on the bootstrap host')
+        return
+    log.info('Loading docker images from {}'.format(image_tarball))
+    remote_path = 'bootstrap_docker_images.tar'
+    ssh_tunnel.copy_file(image_tarball, remote_path)
+    ssh_tunnel.command(['sudo', 'docker', 'load', '--input', remote_path])
+    ssh_tunnel.command(['rm', '-f', remote_path])
+
+
+def pull_docker_image(ssh_tunnel: ssh_client.Tunnelled, image: str, registry_mirror: str=None):
+    """ Makes sure image is present on the host. If registry_mirror is given, the image is
+    pulled from there and tagged with its original name so that `docker run image` uses it
+    """
+    if has_docker_image(ssh_tunnel, image):
+        return
+    if registry_mirror is None:
+        ssh_tunnel.command(['sudo', 'docker', 'pull', image])
+        return
+    mirrored_image = registry_mirror.rstrip('/') + '/' + image
+    log.info('Pulling {} from {}'.format(image, registry_mirror))
+    ssh_tunnel.command(['sudo', 'docker', 'pull', mirrored_image])
+    ssh_tunnel.command(['sudo', 'docker', 'tag', mirrored_image, image])
+
+
+def do_install_prereqs(hosts: list, ssh: ssh_client.SshClient, prereqs_script_path: str, parallelism: int=None):
+    """ Copies the prereqs script to hosts and runs it on the ones that the copy
+    succeeded on. Hosts that failed the copy are reported with their copy result,
+    so that only hosts that ran the script can succeed
+    """
+    copy_results = get_host_client(hosts, ssh, parallelism=parallelism).run_command(
+        'copy', prereqs_script_path, '~/install_prereqs.sh', False)
+    copy_failures = [result for result in copy_results if result['returncode'] != 0]
+    failed_hosts = {result['host'] for result in copy_failures}
+    copied_hosts = [host for host in hosts if host.public_ip not in failed_hosts]
+    if not copied_hosts:
+        return copy_failures
+    return copy_failures + get_host_client(copied_hosts, ssh, parallelism=parallelism).run_command(
+        'run', ['chmod +x ~/install_prereqs.sh', '&&', '~/install_prereqs.sh'])
+
+
 def do_preflight(client: ssh_client.AsyncSshClient, remote_script_path: str, bootstrap_script_url: str):
     """ Runs preflight instructions against client
     remote_script_path: where the install script should be downloaded to on the remote host
@@ -215,17 +525,20 @@ sudo bash {remote_script_path} --preflight-only master"""
 
 
 def do_deploy(
-        cluster: onprem.OnpremCluster,
+        hosts_by_role: dict,
         node_client: ssh_client.SshClient,
         parallelism: int,
         remote_script_path: str):
     """ Creates a separate client for each agent command and runs them asynchronously
     based on the chosen parallelism
+    Args:
+        hosts_by_role: lists of Hosts to deploy, keyed by masters, private_agents
+            and public_agents
     """
     # make distinct clients
-    master_client = get_client(cluster, 'masters', node_client)
-    private_agent_client = get_client(cluster, 'private_agents', node_client)
-    public_agent_client = get_client(cluster, 'public_agents', node_client)
+    master_client = get_host_client(hosts_by_role['masters'], node_client)
+    private_agent_client = get_host_client(hosts_by_role['private_agents'], node_client)
+    public_agent_client = get_host_client(hosts_by_role['public_agents'], node_client)
 
     async def await_tasks():
         # make shared semaphore for all
@@ -110,12 +110,27 @@ if [[ "${file_system}" != 'xfs' ]] || ! sudo xfs_info "${docker_data_root}" | gr
   exit 1
 fi
 
+# When set, all packages are installed from the prereqs bundle served by the bootstrap host
+PREREQS_REPO_URL="${PREREQS_REPO_URL:-}"
+yum_opts=''
+if [[ -n "${PREREQS_REPO_URL}" ]]; then
+  echo "Using prereqs bundle: ${PREREQS_REPO_URL}"
+  sudo tee /etc/yum.repos.d/dcos-prereqs.repo <<-EOF
+[dcos-prereqs]
+name=DC/OS Prerequisites Bundle
+baseurl=${PREREQS_REPO_URL}
+enabled=1
+gpgcheck=0
+EOF
+  yum_opts='--disablerepo=* --enablerepo=dcos-prereqs'
+fi
+
 function yum_install() {
   local cmd="$1"
   echo "Validating ${cmd}..."
   if ! hash "${cmd}" 2>/dev/null; then
     echo "Installing ${cmd}..."
-    sudo yum install -y ${cmd}
+    sudo yum install -y ${yum_opts} ${cmd}
   fi
   # print installed version
   rpm -q "${cmd}"
@@ -143,8 +158,9 @@ fi
 if [[ "${install_docker}" == 'true' ]]; then
   echo "Installing Docker..."
 
-  # Add Docker Yum Repo
-  sudo tee /etc/yum.repos.d/docker.repo <<-'EOF'
+  if [[ -z "${PREREQS_REPO_URL}" ]]; then
+    # Add Docker Yum Repo
+    sudo tee /etc/yum.repos.d/docker.repo <<-'EOF'
 [dockerrepo]
 name=Docker Repository
 baseurl=https://yum.dockerproject.org/repo/main/centos/7
@@ -152,6 +168,7 @@ enabled=1
 gpgcheck=1
 gpgkey=https://yum.dockerproject.org/gpg
 EOF
+  fi
 
   # Add Docker systemd service
   sudo mkdir -p /etc/systemd/system/docker.service.d
@@ -166,7 +183,7 @@ ExecStart=/usr/bin/dockerd --storage-driver=overlay --data-root=${docker_data_ro
 EOF
 
   # Install and enable Docker
-  sudo yum install -y docker-engine-17.05.0.ce docker-engine-selinux-17.05.0.ce
+  sudo yum install -y ${yum_opts} docker-engine-17.05.0.ce docker-engine-selinux-17.05.0.ce
   sudo systemctl start docker
   sudo systemctl enable docker
 fi
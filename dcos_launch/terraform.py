@@ -1,47 +1,378 @@
+import concurrent.futures
+import hashlib
 import json
 import logging
 import os
 import re
 import shutil
 import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
 import uuid
 import zipfile
 
+import filelock
 import requests
 from cryptography.hazmat.primitives import serialization
 
 import dcos_launch.config
-import yaml
 from dcos_launch import gcp, util
 from dcos_launch.platforms import aws
 
 log = logging.getLogger(__name__)
-IP_REGEX = '(\d{1,3}.){3}\d{1,3}'
-IP_LIST_REGEX = '\[[^\]]+\]'
-
-
-def _get_ips(prefix: str, info: str) -> list:
-    ips = []
-    prefix += ' = '
-    m = re.search('{}{}'.format(prefix, IP_REGEX), info)
-    if m:
-        ips = [m.group(0)[len(prefix):]]
+# attributes holding the public and private IPs of the instance resources created by terraform-dcos,
+# in order of preference. Azure is handled separately because its IPs live on other resources
+INSTANCE_IP_ATTRIBUTES = {
+    'aws_instance': (('public_ip',), ('private_ip',)),
+    'google_compute_instance': (
+        ('network_interface.0.access_config.0.nat_ip', 'network_interface.0.access_config.0.assigned_nat_ip'),
+        ('network_interface.0.network_ip', 'network_interface.0.address'))}
+
+# refs of remote modules that do not move: commit SHAs and version tags such as v0.1.0
+PINNED_REF_REGEX = re.compile(r'[0-9a-f]{7,40}|v?[0-9]+\.[0-9]+\.[0-9]+([-+.][0-9A-Za-z.-]+)?')
+
+# Total number of resource operations a fleet keeps in flight across all of its applies
+FLEET_TERRAFORM_PARALLELISM = 40
+
+# written to the init dir by delete --no-wait
+DESTROY_LOG_NAME = 'terraform-destroy.log'
+DESTROY_EXIT_CODE_NAME = 'terraform-destroy.exitcode'
+
+# state file path -> ((size, mtime), parsed state)
+_state_cache = dict()
+
+
+def _first_attribute(attributes: dict, keys: tuple):
+    for key in keys:
+        if attributes.get(key):
+            return attributes[key]
+    return None
+
+
+def _get_private_ips(resources: list) -> dict:
+    """ Maps the public IPs of the instances in resources, a list of (type, attributes) tuples
+    from the terraform state, to their private IPs
+    """
+    private_ips = dict()
+    azure_public_ips = dict()
+    for resource_type, attributes in resources:
+        if resource_type in INSTANCE_IP_ATTRIBUTES:
+            public_keys, private_keys = INSTANCE_IP_ATTRIBUTES[resource_type]
+            public_ip = _first_attribute(attributes, public_keys)
+            if public_ip:
+                private_ips[public_ip] = _first_attribute(attributes, private_keys)
+        elif resource_type == 'azurerm_public_ip':
+            azure_public_ips[attributes.get('id')] = attributes.get('ip_address')
+    for resource_type, attributes in resources:
+        if resource_type == 'azurerm_network_interface':
+            public_ip = azure_public_ips.get(attributes.get('ip_configuration.0.public_ip_address_id'))
+            if public_ip:
+                private_ips[public_ip] = attributes.get('ip_configuration.0.private_ip_address')
+    return private_ips
+
+
+def _flatten_attributes(attributes, prefix: str='') -> dict:
+    """ Flattens the nested attributes of a terraform 0.12+ state into the dotted keys of
+    the older state format, e.g. network_interface.0.network_ip
+    """
+    if isinstance(attributes, dict):
+        items = attributes.items()
+    elif isinstance(attributes, list):
+        items = enumerate(attributes)
     else:
-        m = re.search('{}{}'.format(prefix, IP_LIST_REGEX), info)
+        return {prefix[:-1]: attributes}
+    flat = dict()
+    for key, value in items:
+        flat.update(_flatten_attributes(value, '{}{}.'.format(prefix, key)))
+    return flat
+
+
+def read_state(state_path: str) -> tuple:
+    """ Parses the outputs and the public to private IP map out of a terraform state file.
+    The result is cached until the state file changes
+
+    Returns:
+        (outputs dict, private IPs dict)
+    """
+    stat = os.stat(state_path)
+    key = (stat.st_size, stat.st_mtime_ns)
+    cached = _state_cache.get(state_path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    state = util.load_json(state_path)
+    outputs = dict()
+    resources = list()
+    if state.get('version') == 3:
+        # terraform 0.11 and older: per-module outputs and resources with flat attributes
+        for module in state.get('modules', list()):
+            if module.get('path') == ['root']:
+                outputs = {name: output['value'] for name, output in module.get('outputs', dict()).items()}
+            for resource in module.get('resources', dict()).values():
+                resources.append((resource['type'], resource.get('primary', dict()).get('attributes', dict())))
+    elif state.get('version') == 4:
+        # terraform 0.12 and newer: root outputs at the top level and resources with nested attributes
+        outputs = {name: output['value'] for name, output in state.get('outputs', dict()).items()}
+        for resource in state.get('resources', list()):
+            for instance in resource.get('instances', list()):
+                resources.append((resource['type'], _flatten_attributes(instance.get('attributes', dict()))))
+    else:
+        raise util.LauncherError('UnsupportedTerraformState', 'Terraform state version {} in {} is not '
+                                 'supported'.format(state.get('version'), state_path))
+    result = (outputs, _get_private_ips(resources))
+    _state_cache[state_path] = (key, result)
+    return result
+
+
+def _convert_to_describe_format(ips, private_ips: dict) -> list:
+    if not ips:
+        return list()
+    if isinstance(ips, str):
+        ips = [ips]
+    return [{'private_ip': private_ips.get(ip), 'public_ip': ip} for ip in ips]
+
+
+def is_hashicorp_release(tarball_url: str) -> bool:
+    return urllib.parse.urlparse(tarball_url).netloc == 'releases.hashicorp.com'
+
+
+def get_terraform_sha256(tarball_url: str) -> str:
+    """ Looks up the checksum of a terraform release zip in the SHA256SUMS file that
+    releases.hashicorp.com publishes next to it
+    """
+    release_url, filename = tarball_url.rsplit('/', 1)
+    version = release_url.rsplit('/', 1)[-1]
+    r = requests.get('{}/terraform_{}_SHA256SUMS'.format(release_url, version), timeout=60)
+    r.raise_for_status()
+    for line in r.text.splitlines():
+        checksum, _, name = line.partition('  ')
+        if name == filename:
+            return checksum
+    raise util.LauncherError('ChecksumMismatch', 'No checksum published for {}'.format(tarball_url))
+
+
+def get_terraform_env() -> dict:
+    """ Returns the environment to run terraform with. Provider plugins go to a cache shared by
+    all init dirs on this machine, unless the user has set up their own plugin cache
+    """
+    env = os.environ.copy()
+    env.setdefault('TF_PLUGIN_CACHE_DIR', util.get_cache_dir('terraform', 'plugins'))
+    return env
+
+
+def _is_cacheable_module(module: str) -> bool:
+    """ Local modules and remote ones whose ref is a commit SHA or a version tag can be cached.
+    Any other ref, such as a branch, can move and is downloaded every time
+    """
+    if os.path.isdir(module):
+        return True
+    match = re.search('[?&]ref=([^&/]+)', module)
+    return match is not None and PINNED_REF_REGEX.fullmatch(match.group(1)) is not None
+
+
+def _get_module_cache_key(module: str) -> str:
+    key = module
+    if os.path.isdir(module):
+        # local modules can change in place, so their content is part of the key
+        mtimes = [os.path.getmtime(os.path.join(root, f)) for root, _, files in os.walk(module) for f in files]
+        key += str(max(mtimes, default=0))
+    slug = re.sub('[^A-Za-z0-9.=-]+', '_', module).strip('_')[-80:]
+    return '{}-{}'.format(slug, hashlib.sha256(key.encode()).hexdigest()[:12])
+
+
+def _terraform_init(terraform_cmd: str, args: list, cwd: str, env: dict, plugins_marker: str=None):
+    """ Runs terraform init. The plugin cache is not safe for concurrent writers, so an init that may add
+    plugins to it holds the plugin cache lock. plugins_marker is created once an init of a module has
+    succeeded, as every plugin that the module needs is in the cache from then on and later inits of it
+    only link them, without the lock
+    """
+    cmd = [terraform_cmd, 'init'] + args
+    if plugins_marker is None or not os.path.exists(plugins_marker):
+        with filelock.FileLock(os.path.join(util.get_cache_dir('terraform'), 'plugins.lock')):
+            if plugins_marker is None or not os.path.exists(plugins_marker):
+                subprocess.run(cmd, cwd=cwd, check=True, stderr=subprocess.STDOUT, env=env)
+                if plugins_marker is not None:
+                    open(plugins_marker, 'w').close()
+                return
+    subprocess.run(cmd, cwd=cwd, check=True, stderr=subprocess.STDOUT, env=env)
+
+
+def init_from_module(terraform_cmd: str, module: str, init_dir: str, use_cache: bool=True):
+    """ Initializes init_dir with the terraform module at module (any terraform module source).
+    With use_cache, the module and its nested modules are only downloaded the first time
+    a source is used on this machine and are copied from the module cache after that.
+    Sources with a ref that can move (e.g. a branch) are never cached
+    """
+    env = get_terraform_env()
+    if use_cache and not _is_cacheable_module(module):
+        log.info('Not caching {} as its ref is neither a commit SHA nor a version tag'.format(module))
+        use_cache = False
+    if not use_cache:
+        _terraform_init(terraform_cmd, ['-from-module', module], init_dir, env)
+        return
+    modules_dir = util.get_cache_dir('terraform', 'modules')
+    module_dir = os.path.join(modules_dir, _get_module_cache_key(module))
+    with filelock.FileLock(module_dir + '.lock'):
+        if not os.path.exists(module_dir):
+            log.info('Adding {} to the module cache'.format(module))
+            download_dir = tempfile.mkdtemp(dir=modules_dir)
+            try:
+                _terraform_init(terraform_cmd, ['-from-module', module], download_dir, env)
+                os.rename(download_dir, module_dir)
+            except Exception:
+                shutil.rmtree(download_dir, ignore_errors=True)
+                raise
+        else:
+            log.info('Using cached module {}'.format(module))
+    for name in os.listdir(module_dir):
+        src = os.path.join(module_dir, name)
+        dst = os.path.join(init_dir, name)
+        if os.path.isdir(src):
+            shutil.copytree(src, dst, symlinks=True)
+        else:
+            shutil.copy2(src, dst)
+    # links the provider plugins from the plugin cache into init_dir
+    _terraform_init(terraform_cmd, [], init_dir, env, plugins_marker=module_dir + '.plugins')
+
+
+class TerraformProgress:
+    """ Follows the (-no-color) output of terraform apply or destroy line by line, emitting a
+    progress event whenever a resource starts or finishes and timing every resource
+    """
+    START_REGEX = re.compile(r'^(?P<address>\S+): (?P<action>Creating|Destroying|Modifying|Reading)\.\.\.')
+    COMPLETE_REGEX = re.compile(
+        r'^(?P<address>\S+): (Creation|Destruction|Modifications|Read) complete after (?P<elapsed>[0-9hms]+)')
+    ERROR_REGEX = re.compile(r'^(\* |Error)')
+
+    def __init__(self, command: str, on_event=None):
+        self.command = command
+        self.on_event = on_event or (lambda event: log.debug('Terraform progress: {}'.format(json.dumps(event))))
+        self.start = time.time()
+        self.started = dict()
+        self.durations = dict()
+        self.errors = list()
+
+    def feed(self, line: str):
+        line = line.strip()
+        m = self.START_REGEX.match(line)
         if m:
-            # remove prefix
-            s = m.group(0)[len(prefix):]
-            # remove whitespace
-            s = "".join(s.split())
-            # remove brackets
-            s = s[1:-1]
-            ips = s.split(',')
-    return ips
-
+            self.started[m.group('address')] = (m.group('action').lower(), time.time())
+            self._emit(m.group('address'), 'started')
+            return
+        m = self.COMPLETE_REGEX.match(line)
+        if m:
+            address = m.group('address')
+            action, started = self.started.pop(address, (None, None))
+            self.durations[address] = {
+                'action': action,
+                # prefer terraform's own timing, which does not depend on when we read the line
+                'seconds': _parse_elapsed(m.group('elapsed'))}
+            self._emit(address, 'completed', seconds=self.durations[address]['seconds'])
+            return
+        if self.ERROR_REGEX.match(line):
+            self.errors.append(line)
+
+    def _emit(self, address: str, status: str, **kwargs):
+        event = {'command': self.command, 'resource': address, 'status': status,
+                 'elapsed': round(time.time() - self.start, 1)}
+        event.update(kwargs)
+        self.on_event(event)
+
+    def get_summary(self, slowest: int=20) -> dict:
+        resources = sorted(
+            ({'resource': address, **duration} for address, duration in self.durations.items()),
+            key=lambda r: r['seconds'], reverse=True)
+        return {
+            'command': self.command,
+            'seconds': round(time.time() - self.start, 1),
+            'num_resources': len(resources),
+            'slowest_resources': resources[:slowest],
+            # resources that were still being worked on when terraform exited
+            'unfinished_resources': sorted(self.started),
+            'errors': self.errors}
+
+
+def _parse_elapsed(elapsed: str) -> int:
+    """ Converts terraform durations like 1h2m3s to seconds
+    """
+    seconds = 0
+    for value, unit in re.findall('([0-9]+)([hms])', elapsed):
+        seconds += int(value) * {'h': 3600, 'm': 60, 's': 1}[unit]
+    return seconds
+
+
+def run_with_progress(cmd: list, cwd: str, progress: TerraformProgress, output_prefix: str=''):
+    """ Runs a terraform command, echoing its output while feeding it to progress
+
+    Raises:
+        subprocess.CalledProcessError if the command fails
+    """
+    proc = subprocess.Popen(cmd, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=os.environ,
+                            universal_newlines=True)
+    for line in proc.stdout:
+        sys.stdout.write(output_prefix + line)
+        progress.feed(line)
+    if proc.wait() != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, output='\n'.join(progress.errors))
+
+
+def _get_process_start_time(pid: int):
+    """ Returns the start time of a process in clock ticks after boot, which tells it apart from a later process
+    that got the same PID, or None where /proc is not available
+    """
+    try:
+        stat = util.read_file('/proc/{}/stat'.format(pid))
+    except OSError:
+        return None
+    # the command name in the second field may contain spaces and parentheses
+    return stat.rsplit(')', 1)[1].split()[19]
+
+
+def _is_process_running(pid: int, start_time) -> bool:
+    try:
+        os.kill(pid, 0)
+    except (ProcessLookupError, PermissionError):
+        # no process has the PID anymore, or one of another user does
+        return False
+    return start_time is None or _get_process_start_time(pid) == start_time
+
+
+def create_fleet(configs: list, max_concurrent: int) -> list:
+    """ Runs the create pipeline of many terraform clusters, at most max_concurrent at a time.
+    Clusters that do not set terraform_parallelism get an equal share of FLEET_TERRAFORM_PARALLELISM
+    so that the fleet as a whole does not trip provider rate limits
+
+    Args:
+        configs: validated terraform configs
+        max_concurrent: number of clusters created at the same time
+
+    Returns:
+        list of (cluster info, create exception or None, seconds) in the order of configs. The info of
+        a cluster whose launcher could not be set up is its config
+    """
+    parallelism = max(1, FLEET_TERRAFORM_PARALLELISM // max_concurrent)
+    for config in configs:
+        if config['provider'] != 'terraform':
+            raise util.LauncherError('OptionError', 'Only configs with the terraform provider can be launched '
+                                                    'as a fleet, not {}'.format(config['provider']))
+        config.setdefault('terraform_parallelism', parallelism)
+
+    def create(config):
+        start = time.time()
+        try:
+            launcher = dcos_launch.get_launcher(config)
+            # tells the interleaved terraform output of the clusters apart
+            launcher.output_prefix = '[{}] '.format(os.path.basename(launcher.init_dir))
+            info = launcher.create()
+        except Exception as e:
+            # a cluster that fails before terraform runs must not abort the rest of the fleet
+            log.exception('Creating the cluster in {} failed'.format(config['init_dir']))
+            return config, e, time.time() - start
+        return info, launcher.create_exception, time.time() - start
 
-def _convert_to_describe_format(ips: list) -> list:
-    # TODO private ips not currently outputted in terraform-dcos
-    return [{'private_ip': None, 'public_ip': ip} for ip in ips]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrent) as executor:
+        return list(executor.map(create, configs))
 
 
 class TerraformLauncher(util.AbstractLauncher):
@@ -52,18 +383,30 @@ class TerraformLauncher(util.AbstractLauncher):
         self.init_dir = dcos_launch.config.expand_path('', self.config['init_dir'])
         self.cluster_profile_path = os.path.join(self.init_dir, 'desired_cluster_profile.tfvars')
         self.dcos_launch_root_dir = os.path.abspath(os.path.join(self.init_dir, '..'))
-        self.terraform_binary = os.path.join(self.dcos_launch_root_dir, 'terraform')
+        # binary installed next to the init dir by older versions of dcos-launch
+        self.legacy_terraform_binary = os.path.join(self.dcos_launch_root_dir, 'terraform')
         self.default_priv_key_path = os.path.join(self.init_dir, 'key.pem')
         self.create_exception = None
+        self.output_prefix = ''
+
+    @property
+    def terraform_binary(self):
+        """ dcos-launch installs each Terraform version once per machine and tarball URL, in the cache
+        """
+        url = self.config.get('terraform_tarball_url')
+        name = self.config['terraform_version']
+        if url is not None and not is_hashicorp_release(url):
+            name += '-' + hashlib.sha256(url.encode()).hexdigest()[:12]
+        return os.path.join(util.get_cache_dir('terraform', name), 'terraform')
 
     def terraform_cmd(self):
         """ Returns the right Terraform invocation command depending on whether it was installed by the user or by
         dcos-launch.
         """
-        binary = self.terraform_binary
-        if not os.path.exists(binary):
-            binary = 'terraform'
-        return binary
+        for binary in (self.legacy_terraform_binary, self.terraform_binary):
+            if os.path.exists(binary):
+                return binary
+        return 'terraform'
 
     def _init_dir_gpu_setup(self):
         """ terraform-dcos has its gpu config disabled by default (has ".disabled" appended to the file name) as seen
@@ -77,7 +420,26 @@ class TerraformLauncher(util.AbstractLauncher):
         gpu_count = self.config['terraform_config'].get('num_of_gpu_agents', 0)
         if os.path.exists(gpu_config_path) and gpu_count > 0:
             os.rename(gpu_config_path, new_gpu_config_path)
-            subprocess.run([self.terraform_cmd(), 'get'], cwd=self.init_dir, check=True, stderr=subprocess.STDOUT)
+            subprocess.run([self.terraform_cmd(), 'get'], cwd=self.init_dir, check=True, stderr=subprocess.STDOUT,
+                           env=get_terraform_env())
+
+    def _terraform_args(self, command: str, args: list) -> list:
+        return [self.terraform_cmd(), command, '-no-color', '-var-file', self.cluster_profile_path,
+                '-parallelism', str(self.config.get('terraform_parallelism', 10))] + args
+
+    def _run_with_progress(self, command: str, args: list):
+        """ Runs terraform apply or destroy and writes a summary of the slowest resources to
+        terraform-<command>-summary.json in the init dir
+        """
+        progress = TerraformProgress(command)
+        cmd = self._terraform_args(command, args)
+        try:
+            run_with_progress(cmd, self.init_dir, progress, self.output_prefix)
+        finally:
+            summary = progress.get_summary()
+            log.info('Slowest resources of terraform {}: {}'.format(command, ', '.join(
+                '{} ({}s)'.format(r['resource'], r['seconds']) for r in summary['slowest_resources'][:5])))
+            util.write_json(os.path.join(self.init_dir, 'terraform-{}-summary.json'.format(command)), summary)
 
     def create(self):
         try:
@@ -102,10 +464,12 @@ class TerraformLauncher(util.AbstractLauncher):
                             'to it i.e. "ssh-add /path/to/key.pem". ssh-agent usage is specific to terraform, not '
                             'dcos-launch.')
 
-            repo = 'terraform-dcos-enterprise' if self.config['dcos-enterprise'] else 'terraform-dcos'
-            version = self.config['terraform_dcos_enterprise_version'] if self.config['dcos-enterprise'] else \
-                self.config['terraform_dcos_version']
-            module = 'github.com/dcos/{}?ref={}/{}'.format(repo, version, self.config['platform'])
+            module = self.config.get('terraform_module_source')
+            if module is None:
+                repo = 'terraform-dcos-enterprise' if self.config['dcos-enterprise'] else 'terraform-dcos'
+                version = self.config['terraform_dcos_enterprise_version'] if self.config['dcos-enterprise'] else \
+                    self.config['terraform_dcos_version']
+                module = 'github.com/dcos/{}?ref={}/{}'.format(repo, version, self.config['platform'])
 
             # Converting our YAML config to the required format. You can find an example of that format in the
             # Advance YAML Configuration" section here:
@@ -114,32 +478,39 @@ class TerraformLauncher(util.AbstractLauncher):
                 for k, v in self.config['terraform_config'].items():
                     file.write(k + ' = ')
                     if type(k) is dict:
-                        file.write('<<EOF\n{}\nEOF\n'.format(yaml.dump(v)))
+                        file.write('<<EOF\n{}\nEOF\n'.format(util.dump_yaml(v)))
                     else:
                         file.write('"{}"\n'.format(v))
-            subprocess.run([self.terraform_cmd(), 'init', '-from-module', module], cwd=self.init_dir,
-                           check=True, stderr=subprocess.STDOUT)
+            init_from_module(self.terraform_cmd(), module, self.init_dir, self.config['terraform_module_cache'])
             self._init_dir_gpu_setup()
-            subprocess.run([self.terraform_cmd(), 'apply', '-auto-approve', '-var-file', self.cluster_profile_path],
-                           cwd=self.init_dir, check=True, stderr=subprocess.STDOUT, env=os.environ)
+            self._run_with_progress('apply', ['-auto-approve'])
         except Exception as e:
             self.create_exception = e
         return self.config
 
     def _install_terraform(self):
-        download_path = os.path.join(self.dcos_launch_root_dir, 'terraform.zip')
-        try:
-            with open(download_path, 'wb') as f:
+        binary = self.terraform_binary
+        # parallel launches may install the same version at the same time
+        with filelock.FileLock(binary + '.lock'):
+            if os.path.exists(binary):
+                log.info('Terraform was installed by another launch.')
+                return
+            url = self.config['terraform_tarball_url']
+            sha256 = self.config.get('terraform_tarball_sha256')
+            if sha256 is None:
+                if is_hashicorp_release(url):
+                    sha256 = get_terraform_sha256(url)
+                else:
+                    log.warning('Not verifying {} as terraform_tarball_sha256 is not set'.format(url))
+            with tempfile.TemporaryDirectory(dir=os.path.dirname(binary)) as download_dir:
+                download_path = os.path.join(download_dir, 'terraform.zip')
                 log.info('Downloading...')
-                r = requests.get(self.config['terraform_tarball_url'])
-                for chunk in r.iter_content(1024):
-                    f.write(chunk)
-            with zipfile.ZipFile(download_path, 'r') as tfm_zip:
-                tfm_zip.extractall(self.dcos_launch_root_dir)
-            # setting terraform binary permissions to: execute only, by file owner only
-            os.chmod(self.terraform_binary, 0o100)
-        finally:
-            os.remove(download_path)
+                util.download_file(url, download_path, sha256=sha256)
+                with zipfile.ZipFile(download_path, 'r') as tfm_zip:
+                    tfm_zip.extract('terraform', download_dir)
+                # setting terraform binary permissions to: execute only, by file owner only
+                os.chmod(os.path.join(download_dir, 'terraform'), 0o100)
+                os.replace(os.path.join(download_dir, 'terraform'), binary)
         log.info('Terraform installation complete.')
 
     def wait(self):
@@ -150,13 +521,65 @@ class TerraformLauncher(util.AbstractLauncher):
 
     def delete(self):
         # delete the cluster
-        subprocess.run([self.terraform_cmd(), 'destroy', '-force', '-var-file', self.cluster_profile_path],
-                       cwd=self.init_dir, check=True, stderr=subprocess.STDOUT, env=os.environ)
+        self._run_with_progress('destroy', ['-force'])
         # remove the init dir
         shutil.rmtree(self.init_dir, ignore_errors=True)
 
+    def start_delete(self) -> dict:
+        """ Runs terraform destroy in the background, detached from dcos-launch. Its output goes to DESTROY_LOG_NAME
+        in the init dir, and its exit code to DESTROY_EXIT_CODE_NAME once it is done
+        """
+        exit_code_path = os.path.join(self.init_dir, DESTROY_EXIT_CODE_NAME)
+        if os.path.exists(exit_code_path):
+            os.remove(exit_code_path)
+        # the exit code is moved into place so that it is never read half written
+        script = '"$@" > {log} 2>&1; echo $? > {exit_code}.tmp; mv {exit_code}.tmp {exit_code}'.format(
+            log=DESTROY_LOG_NAME, exit_code=DESTROY_EXIT_CODE_NAME)
+        proc = subprocess.Popen(['sh', '-c', script, 'sh'] + self._terraform_args('destroy', ['-force']),
+                                cwd=self.init_dir, env=os.environ, stdin=subprocess.DEVNULL,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+        log.info('terraform destroy is running in the background as process {}. Its output goes to {}'.format(
+            proc.pid, os.path.join(self.init_dir, DESTROY_LOG_NAME)))
+        # the start time is recorded as the PID alone may be reused by an unrelated process once destroy is gone
+        return {'pid': proc.pid, 'process_start_time': _get_process_start_time(proc.pid)}
+
+    def get_delete_status(self, pending_delete: dict) -> str:
+        exit_code_path = os.path.join(self.init_dir, DESTROY_EXIT_CODE_NAME)
+        if not os.path.exists(exit_code_path):
+            if _is_process_running(pending_delete['pid'], pending_delete.get('process_start_time')):
+                return util.DELETE_PENDING
+            # destroy may have written its exit code and exited since the first look
+            if not os.path.exists(exit_code_path):
+                log.error('terraform destroy was killed before it was done. See {}'.format(
+                    os.path.join(self.init_dir, DESTROY_LOG_NAME)))
+                return util.DELETE_FAILED
+        exit_code = util.read_file(exit_code_path)
+        if exit_code == '0':
+            return util.DELETE_COMPLETE
+        log.error('terraform destroy exited with {}. See {}'.format(
+            exit_code, os.path.join(self.init_dir, DESTROY_LOG_NAME)))
+        return util.DELETE_FAILED
+
+    def finish_delete(self, pending_delete: dict):
+        shutil.rmtree(self.init_dir, ignore_errors=True)
+
+    def get_outputs(self) -> tuple:
+        """ Reads the outputs straight from the local state file. With a remote state, falls back to
+        'terraform output -json', which cannot provide private IPs
+
+        Returns:
+            (outputs dict, private IPs dict)
+        """
+        state_path = os.path.join(self.init_dir, 'terraform.tfstate')
+        if os.path.exists(state_path):
+            return read_state(state_path)
+        result = subprocess.run([self.terraform_cmd(), 'output', '-json'], cwd=self.init_dir, check=True,
+                                stdout=subprocess.PIPE)
+        outputs = json.loads(result.stdout.decode('utf-8'))
+        return {name: output['value'] for name, output in outputs.items()}, dict()
+
     def describe(self) -> dict:
-        """ Sample output from 'terraform output' command:
+        """ Sample outputs of terraform-dcos:
         Bootstrap Host Public IP = 35.227.147.39
         Master ELB Public IP = 35.230.64.74
         Master Public IPs = [
@@ -172,28 +595,25 @@ class TerraformLauncher(util.AbstractLauncher):
         ]
         ssh_user = core
         """
-        result = subprocess.run([self.terraform_cmd(), 'output'], cwd=self.init_dir, check=True, stdout=subprocess.PIPE)
-        info = result.stdout.decode('utf-8')
-        self.config['ssh_user'] = re.search('ssh_user = \w+', info).group(0)[len('ssh_user = '):]
+        outputs, private_ips = self.get_outputs()
+        self.config['ssh_user'] = outputs['ssh_user']
 
-        private_agents_ips = _convert_to_describe_format(_get_ips('Private Agent Public IPs', info))
-        private_agents_gpu_addresses = _get_ips('GPU Public IPs', info)
+        private_agents_ips = _convert_to_describe_format(outputs.get('Private Agent Public IPs'), private_ips)
+        private_agents_gpu_addresses = outputs.get('GPU Public IPs') or list()
+        if isinstance(private_agents_gpu_addresses, str):
+            private_agents_gpu_addresses = [private_agents_gpu_addresses]
         for i in range(len(private_agents_gpu_addresses)):
             private_agents_ips[i]['GPU Public IPs'] = private_agents_gpu_addresses[i]
 
         description = {
-            'bootstrap_host': _convert_to_describe_format(_get_ips('Bootstrap Host Public IP', info=info)),
-            'masters': _convert_to_describe_format(_get_ips('Master Public IPs', info=info)),
+            'bootstrap_host': _convert_to_describe_format(outputs.get('Bootstrap Host Public IP'), private_ips),
+            'masters': _convert_to_describe_format(outputs.get('Master Public IPs'), private_ips),
             'private_agents': private_agents_ips,
-            'public_agents': _convert_to_describe_format(_get_ips('Public Agent Public IPs', info))}
+            'public_agents': _convert_to_describe_format(outputs.get('Public Agent Public IPs'), private_ips)}
 
-        master_elb_address = _get_ips('Master ELB Public IP', info=info)
-        public_agent_elb_address = _get_ips('Public Agent ELB Public IP', info=info)
-
-        if master_elb_address:
-            description.update({'Master ELB Public IP': master_elb_address[0]})
-        if public_agent_elb_address:
-            description.update({'Public Agent ELB Public IP': public_agent_elb_address[0]})
+        for elb in ('Master ELB Public IP', 'Public Agent ELB Public IP'):
+            if outputs.get(elb):
+                description[elb] = outputs[elb]
 
         return description
 
@@ -209,20 +629,22 @@ class TerraformLauncher(util.AbstractLauncher):
         self.config['terraform_config']['ssh_private_key_filename'] = self.default_priv_key_path
 
     def test(self, args: list, env_dict: dict, test_host: str=None, test_port: int=22, details: dict=None) -> int:
-        # TODO only reason this exists is because private IPs are not yet returned from describe(), which are required
-        # by the parent test() function
         """ Connects to master host with SSH and then run the internal integration test
 
         Args:
             args: a list of args that will follow the py.test command
             env_dict: the env to use during the test
         """
+        if details is None:
+            details = self.describe()
+        hosts = details['masters'] + details['private_agents'] + details['public_agents']
+        if all(h['private_ip'] for h in hosts):
+            return super().test(args, env_dict, test_host=test_host, test_port=test_port, details=details)
+        # the private IPs required by the parent test() are only known with a local state file
         if args is None:
             args = list()
         if self.config['ssh_private_key'] == util.NO_TEST_FLAG or 'ssh_user' not in self.config:
             raise util.LauncherError('MissingInput', 'DC/OS Launch is missing sufficient SSH info to run tests!')
-        if details is None:
-            details = self.describe()
         # check for any environment variables that contain spaces
         env_dict = {e: "'{}'".format(env_dict[e]) if ' ' in env_dict[e] else env_dict[e] for e in env_dict}
         env_string = ' '.join(['{}={}'.format(e, env_dict[e]) for e in env_dict])
@@ -249,8 +671,12 @@ class GcpLauncher(TerraformLauncher):
             creds_string, creds_path = gcp.get_credentials(os.environ)
             if not creds_path:
                 creds_path = os.path.join(os.getcwd(), '.gcp_creds.json')
-                with open(creds_path, 'w') as f:
+                # the clusters of a fleet are created concurrently and share this file, so it must never be
+                # read while partially written
+                fd, tmp_path = tempfile.mkstemp(dir=os.getcwd(), prefix='.gcp_creds.')
+                with os.fdopen(fd, 'w') as f:
                     f.write(creds_string)
+                os.replace(tmp_path, creds_path)
             self.config['terraform_config']['gcp_credentials_key_file'] = creds_path
         if 'gcp_project' not in self.config['terraform_config']:
             with open(self.config['terraform_config']['gcp_credentials_key_file']) as f:
@@ -1,4 +1,5 @@
 import abc
+import hashlib
 import json
 import logging
 import os
@@ -7,6 +8,7 @@ import sys
 
 import cryptography.hazmat.backends
 import pkg_resources
+import requests
 from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.primitives.asymmetric import rsa
 
@@ -23,6 +25,18 @@ MOCK_SUBNET_ID = 'subnet-foo-bar'
 MOCK_GATEWAY_ID = 'gateway-foo-bar'
 MOCK_STACK_ID = 'this-is-a-important-test-stack::deadbeefdeadbeef'
 NO_TEST_FLAG = 'NO PRIVATE SSH KEY PROVIDED - CANNOT TEST'
+# states of a deletion started with delete --no-wait
+DELETE_PENDING = 'pending'
+DELETE_COMPLETE = 'complete'
+DELETE_FAILED = 'failed'
+
+
+# the libyaml bindings are many times faster than the pure Python loader and dumper, but
+# are only present if PyYAML was built against libyaml
+try:
+    from yaml import CSafeDumper as YamlDumper, CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeDumper as YamlDumper, SafeLoader as YamlLoader
 
 
 json_prettyprint_args = {
@@ -49,6 +63,65 @@ def load_json(filename):
         raise ValueError("Invalid JSON in {0}: {1}".format(filename, ex)) from ex
 
 
+def load_yaml(stream):
+    """ Safely loads YAML from a string or file, using libyaml when available
+    """
+    return yaml.load(stream, Loader=YamlLoader)
+
+
+def dump_yaml(data, stream=None, **kwargs):
+    """ Safely dumps data as YAML, using libyaml when available. Returns a string unless
+    a stream is given
+    """
+    return yaml.dump(data, stream, Dumper=YamlDumper, **kwargs)
+
+
+def get_journal_path(info_path: str) -> str:
+    """ The install journal lives next to the info JSON it belongs to
+    """
+    return os.path.splitext(info_path)[0] + '.journal.json'
+
+
+def get_cache_dir(*parts) -> str:
+    """ Returns (and creates) a directory under the dcos-launch cache, which is shared by
+    every cluster launched from this machine. The cache lives in ~/.cache/dcos-launch
+    unless DCOS_LAUNCH_CACHE_DIR is set
+    """
+    root = os.environ.get('DCOS_LAUNCH_CACHE_DIR') or os.path.join(os.path.expanduser('~'), '.cache', 'dcos-launch')
+    path = os.path.join(root, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def is_offline() -> bool:
+    """ With DCOS_LAUNCH_OFFLINE set, dcos-launch only uses cached or pinned values where it
+    would otherwise look something up on the internet
+    """
+    return os.environ.get('DCOS_LAUNCH_OFFLINE', '').lower() in ('1', 'true', 'yes')
+
+
+def download_file(url: str, path: str, sha256: str=None):
+    """ Streams url to path. If sha256 is given, the download is verified against it and
+    path is only written if it matches
+    """
+    tmp_path = path + '.part'
+    digest = hashlib.sha256()
+    try:
+        with requests.get(url, stream=True, timeout=60) as r:
+            r.raise_for_status()
+            with open(tmp_path, 'wb') as f:
+                for chunk in r.iter_content(1024 * 1024):
+                    digest.update(chunk)
+                    f.write(chunk)
+        if sha256 is not None and digest.hexdigest() != sha256.lower():
+            raise LauncherError('ChecksumMismatch', 'SHA256 of {} is {} but {} was expected'.format(
+                url, digest.hexdigest(), sha256))
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
 def set_from_env(key):
     """ If key is set in env, return its value, else raise an error
     """
@@ -70,12 +143,12 @@ def stub(output):
 
 
 def get_temp_config_path(tmpdir, name, update: dict = None):
-    config = yaml.load(
+    config = load_yaml(
         pkg_resources.resource_string(dcos_launch.__name__, 'sample_configs/{}'.format(name)).decode('utf-8'))
     if update is not None:
         config.update(update)
     new_config_path = tmpdir.join('my_config.yaml')
-    new_config_path.write(yaml.dump(config))
+    new_config_path.write(dump_yaml(config))
     return str(new_config_path)
 
 
@@ -83,6 +156,52 @@ class DeploymentError(Exception):
     pass
 
 
+class PhaseJournal:
+    """ Records which hosts have completed each phase of a multi-step operation so
+    that an interrupted run can be resumed where it left off. If a path is given,
+    the journal is loaded from it and persisted to it after every change
+    """
+    def __init__(self, phases: tuple, path: str=None):
+        self.phases = phases
+        self.path = path
+        self.completed = {phase: list() for phase in phases}
+        self.report = dict()
+        if path is not None and os.path.exists(path):
+            journal = load_json(path)
+            self.completed.update(journal['completed'])
+            self.report.update(journal.get('report', {}))
+
+    def is_complete(self, phase: str, host: str) -> bool:
+        return host in self.completed[phase]
+
+    def mark_complete(self, phase: str, hosts: list):
+        new_hosts = [h for h in hosts if h not in self.completed[phase]]
+        if not new_hosts:
+            return
+        self.completed[phase].extend(new_hosts)
+        self.save()
+
+    def restart(self, phase: str):
+        """ Forgets the progress of phase and of every phase following it
+        """
+        if phase not in self.phases:
+            raise LauncherError('OptionError', 'Unknown phase {}, must be one of: {}'.format(
+                phase, ', '.join(self.phases)))
+        for p in self.phases[self.phases.index(phase):]:
+            self.completed[p] = list()
+        self.save()
+
+    def record_attempts(self, phase: str, attempts: dict, seconds: float):
+        """ Adds the number of attempts every host needed in a run of phase to the report
+        """
+        self.report[phase] = {'attempts': attempts, 'seconds': round(seconds, 1)}
+        self.save()
+
+    def save(self):
+        if self.path is not None:
+            write_json(self.path, {'completed': self.completed, 'report': self.report})
+
+
 class LauncherError(Exception):
     def __init__(self, error, msg):
         self.error = error
@@ -111,10 +230,31 @@ class AbstractLauncher(metaclass=abc.ABCMeta):
     def delete(self):
         raise NotImplementedError()
 
-    def install_dcos(self):
+    def start_delete(self) -> dict:
+        """ Starts deleting the cluster without waiting for it to be gone
+
+        Returns:
+            whatever get_delete_status needs to track the deletion, which is recorded in the info JSON
+        """
+        raise LauncherError('UnsupportedAction', 'delete --no-wait is not supported for this provider')
+
+    def get_delete_status(self, pending_delete: dict) -> str:
+        """ Returns DELETE_PENDING, DELETE_COMPLETE or DELETE_FAILED for a deletion begun with start_delete
+        """
+        raise LauncherError('UnsupportedAction', 'delete --no-wait is not supported for this provider')
+
+    def finish_delete(self, pending_delete: dict):
+        # Cleans up what delete would have after the cluster was gone, e.g. temporary AWS resources
+        pass
+
+    def install_dcos(self, journal: PhaseJournal=None):
         # Only implemented in onprem. For other deployment methods, dcos installation occurs in the wait() step.
         pass
 
+    def upgrade(self, installer_url: str) -> list:
+        # Only implemented in onprem, where dcos-launch drives the installer itself
+        raise LauncherError('UnsupportedAction', 'upgrade is only supported for the onprem provider')
+
     def test(self, args: list, env_dict: dict, test_host: str=None, test_port: int=22, details: dict=None) -> int:
         """ Connects to master host with SSH and then run the internal integration test
 
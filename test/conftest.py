@@ -48,6 +48,10 @@ def mock_ssh_client(monkeypatch):
     # need to nullify platforms.onprem
     monkeypatch.setattr(dcos_launch.platforms.onprem, 'prepare_bootstrap', stub('foo'))
     monkeypatch.setattr(dcos_launch.platforms.onprem, 'install_dcos', stub(None))
+    monkeypatch.setattr(dcos_launch.platforms.onprem, 'get_installed_version', stub('1.12.0'))
+    monkeypatch.setattr(dcos_launch.platforms.onprem, 'do_generate_node_upgrade_script',
+                        stub('http://127.0.0.1/upgrade/foo/dcos_node_upgrade.sh'))
+    monkeypatch.setattr(dcos_launch.platforms.onprem, 'upgrade_dcos', stub([]))
 
 
 @pytest.fixture
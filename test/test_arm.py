@@ -1,6 +1,273 @@
+import logging
+from types import SimpleNamespace
+
+import dcos_launch.platforms.arm
+import pytest
+from azure.common.exceptions import CloudError
+from dcos_launch.util import DeploymentError, stub
+from dcos_test_utils.helpers import Host
+
+
 def test_azure_template(check_cli_success, azure_config_path):
     info, desc = check_cli_success(azure_config_path)
 
 
 def test_azure_template_with_helper(check_cli_success, azure_with_helper_config_path):
     info, desc = check_cli_success(azure_with_helper_config_path)
+
+
+def make_nic(name, private_ip):
+    ip_config = SimpleNamespace(private_ip_address=private_ip, public_ip_address=None)
+    return SimpleNamespace(name=name, ip_configurations=[ip_config])
+
+
+def make_public_ip(name, fqdn):
+    return SimpleNamespace(name=name, dns_settings=SimpleNamespace(fqdn=fqdn))
+
+
+class MockNetworkApi:
+    """ Serves the resource and network listings of a single resource group and
+    records every call made
+    """
+    def __init__(self, nics, scale_set_nics, public_ips):
+        self.calls = []
+        self.nics = nics
+        self.scale_set_nics = scale_set_nics
+        self.public_ips = public_ips
+        self.resource_groups = SimpleNamespace(list_resources=self.list_resources)
+        self.network_interfaces = SimpleNamespace(
+            list=self.list_nics,
+            list_virtual_machine_scale_set_network_interfaces=self.list_scale_set_nics)
+        self.public_ip_addresses = SimpleNamespace(list=self.list_public_ips)
+
+    def list_resources(self, group_name, filter):
+        self.calls.append(('list_resources', filter))
+        assert filter == "resourceType eq 'Microsoft.Compute/virtualMachineScaleSets'"
+        return iter([SimpleNamespace(name=name) for name in self.scale_set_nics])
+
+    def list_nics(self, group_name):
+        self.calls.append(('list_nics',))
+        return iter(self.nics)
+
+    def list_scale_set_nics(self, group_name, scale_set_name):
+        self.calls.append(('list_scale_set_nics', scale_set_name))
+        return iter(self.scale_set_nics[scale_set_name])
+
+    def list_public_ips(self, group_name):
+        self.calls.append(('list_public_ips',))
+        return iter(self.public_ips)
+
+
+def make_resource_group(cls, api):
+    return cls('foo', SimpleNamespace(rmc=api, nmc=api))
+
+
+def test_describe_resource_group():
+    api = MockNetworkApi(
+        nics=[make_nic('master-nic-0', '10.0.0.4'), make_nic('master-nic-1', '10.0.0.5')],
+        scale_set_nics={
+            'dcos-private-vmss': [make_nic('private', '10.32.0.4')],
+            'dcos-public-vmss': [make_nic('public', '10.64.0.4')]},
+        public_ips=[make_public_ip('master-ip', 'master.azure'), make_public_ip('agent-ip', 'agent.azure')])
+    group = make_resource_group(dcos_launch.platforms.arm.DcosAzureResourceGroup, api)
+    assert group.get_master_ips() == [Host('10.0.0.4', 'master.azure:2200'), Host('10.0.0.5', 'master.azure:2201')]
+    assert group.get_private_agent_ips() == [Host('10.32.0.4', None)]
+    assert group.get_public_agent_ips() == [Host('10.64.0.4', 'agent.azure')]
+    assert group.public_master_lb_fqdn == 'master.azure'
+    assert group.public_agent_lb_fqdn == 'agent.azure'
+    # one listing of scale sets, NICs and public IPs, plus the NICs of each scale set
+    assert len(api.calls) == 5
+
+    group.invalidate_network_resources()
+    group.get_master_ips()
+    assert len(api.calls) == 10
+
+
+def test_describe_hybrid_resource_group():
+    scale_set_nics = {
+        'dcos-linpri-vmss': [make_nic('linpri', '10.0.1.4')],
+        'dcos-linpub-vmss': [make_nic('linpub', '10.0.2.4')],
+        'dcos-900-vmss': [make_nic('wpub', '10.0.3.4')],
+        'dcos-901-vmss': [make_nic('wpri', '10.0.4.4')]}
+    api = MockNetworkApi(
+        nics=[make_nic('dcos-master-nic-0', '10.0.0.4'), make_nic('dcos-jumpbox-nic', '10.0.0.10')],
+        scale_set_nics=scale_set_nics,
+        public_ips=[make_public_ip('dcos-master-ip', 'master.azure'),
+                    make_public_ip('dcos-agent-ip-linpub', 'linpub.azure'),
+                    make_public_ip('dcos-agent-ip-wpub', 'wpub.azure')])
+    group = make_resource_group(dcos_launch.platforms.arm.HybridDcosAzureResourceGroup, api)
+    assert group.get_master_ips() == [Host('10.0.0.4', 'master.azure')]
+    assert group.get_linux_private_agent_ips() == [Host('10.0.1.4', None)]
+    assert group.get_linux_public_agent_ips() == [Host('10.0.2.4', 'linpub.azure')]
+    assert group.get_windows_public_agent_ips() == [Host('10.0.3.4', 'wpub.azure')]
+    assert group.get_windows_private_agent_ips() == [Host('10.0.4.4', None)]
+    assert group.public_master_lb_fqdn == 'master.azure'
+    assert group.linux_public_agent_lb_fqdn == 'linpub.azure'
+    assert len(api.calls) == 7
+    assert sorted(call[1] for call in api.calls if call[0] == 'list_scale_set_nics') == sorted(scale_set_nics)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """ Records sleeps instead of sleeping and advances the clock by them
+    """
+    sleeps = list()
+    monkeypatch.setattr(dcos_launch.platforms.arm.time, 'sleep', sleeps.append)
+    monkeypatch.setattr(dcos_launch.platforms.arm.time, 'time', lambda: sum(sleeps))
+    return sleeps
+
+
+def make_operation(operation_id, state, status_message=None):
+    return SimpleNamespace(operation_id=operation_id, properties=SimpleNamespace(
+        provisioning_state=state, status_code='Conflict' if state == 'Failed' else 'OK',
+        status_message=status_message,
+        target_resource=SimpleNamespace(resource_type='Microsoft.Network/virtualNetworks', resource_name=operation_id)))
+
+
+class MockDeploymentApi:
+    """ Plays back one deployment state and operation listing per poll. The deployment is not
+    registered yet on polls whose state is None
+    """
+    def __init__(self, polls):
+        self.polls = polls
+        self.poll = -1
+        self.deployments = SimpleNamespace(get=self.get_deployment)
+        self.deployment_operations = SimpleNamespace(list=self.list_operations)
+
+    def get_deployment(self, group_name, deployment_name):
+        self.poll += 1
+        state = self.polls[self.poll][0]
+        if state is None:
+            raise CloudError(SimpleNamespace(status_code=404), error='DeploymentNotFound')
+        return SimpleNamespace(properties=SimpleNamespace(provisioning_state=state))
+
+    def list_operations(self, group_name, deployment_name):
+        return iter(self.polls[self.poll][1])
+
+
+def test_wait_for_deployment(sleeps, caplog):
+    caplog.set_level(logging.INFO)
+    api = MockDeploymentApi([
+        (None, []),
+        ('Running', [make_operation('vnet', 'Running')]),
+        ('Running', [make_operation('vnet', 'Succeeded'), make_operation('nic', 'Running')]),
+        ('Running', [make_operation('vnet', 'Succeeded'), make_operation('nic', 'Running')]),
+        ('Succeeded', [make_operation('vnet', 'Succeeded'), make_operation('nic', 'Succeeded')])])
+    make_resource_group(dcos_launch.platforms.arm.DcosAzureResourceGroup, api).wait_for_deployment()
+    assert sleeps == [5, 10, 20, 40]
+    finished = [r.getMessage() for r in caplog.records if r.getMessage().startswith('Deployment operation')]
+    assert finished == [
+        'Deployment operation succeeded: Microsoft.Network/virtualNetworks vnet',
+        'Deployment operation succeeded: Microsoft.Network/virtualNetworks nic']
+
+
+def test_wait_for_deployment_fail_fast(sleeps):
+    failed = [make_operation('vnet', 'Succeeded'), make_operation('nic', 'Failed', 'quota exceeded')]
+    api = MockDeploymentApi([('Running', [make_operation('vnet', 'Running')]), ('Running', failed)])
+    with pytest.raises(DeploymentError) as exinfo:
+        make_resource_group(dcos_launch.platforms.arm.DcosAzureResourceGroup, api).wait_for_deployment()
+    assert 'nic: Conflict: quota exceeded' in str(exinfo.value)
+    assert sleeps == [5]
+
+
+def test_wait_for_deployment_rolled_up_failure(sleeps):
+    failed = [make_operation('vnet', 'Failed', 'bad'), make_operation('nic', 'Failed', 'worse')]
+    api = MockDeploymentApi([('Running', []), ('Failed', failed)])
+    with pytest.raises(DeploymentError) as exinfo:
+        make_resource_group(dcos_launch.platforms.arm.DcosAzureResourceGroup, api).wait_for_deployment(
+            fail_fast=False)
+    assert 'vnet: Conflict: bad' in str(exinfo.value)
+    assert 'nic: Conflict: worse' in str(exinfo.value)
+
+
+def test_wait_for_deployment_deadline(sleeps):
+    api = MockDeploymentApi([('Running', [])] * 100)
+    with pytest.raises(DeploymentError):
+        make_resource_group(dcos_launch.platforms.arm.DcosAzureResourceGroup, api).wait_for_deployment(timeout=100)
+    # the deployment is polled until the deadline, not only until the next interval would pass it
+    assert sleeps == [5, 10, 20, 40, 25]
+    assert api.poll == 5
+
+
+class MockTemplateServer:
+    """ Serves a template with an ETag and answers requests that carry the current ETag with 304
+    """
+    def __init__(self, template):
+        self.template = template
+        self.version = 1
+        self.requests = []
+
+    def get(self, url, headers, timeout):
+        self.requests.append(headers)
+        etag = '"v{}"'.format(self.version)
+        if headers.get('If-None-Match') == etag:
+            return SimpleNamespace(status_code=304, headers={}, raise_for_status=lambda: None)
+        return SimpleNamespace(status_code=200, headers={'ETag': etag}, json=lambda: self.template,
+                               raise_for_status=lambda: None)
+
+
+def test_get_template_cached(monkeypatch, tmpdir):
+    monkeypatch.setenv('DCOS_LAUNCH_CACHE_DIR', str(tmpdir))
+    server = MockTemplateServer({'parameters': {'foo': {'type': 'string'}}})
+    monkeypatch.setattr(dcos_launch.platforms.arm.requests, 'get', server.get)
+    url = 'https://example.com/template.json'
+    assert dcos_launch.platforms.arm.get_template(url) == server.template
+    assert dcos_launch.platforms.arm.get_template(url) == server.template
+    assert server.requests == [{}, {'If-None-Match': '"v1"'}]
+
+    server.template = {'parameters': {'bar': {'type': 'int'}}}
+    server.version = 2
+    assert dcos_launch.platforms.arm.get_template(url) == server.template
+
+    monkeypatch.setenv('DCOS_LAUNCH_OFFLINE', '1')
+    assert dcos_launch.platforms.arm.get_template(url) == server.template
+    assert len(server.requests) == 3
+
+
+class MockTemplateDeployer:
+    """ Accepts resource group creation and deployments and counts template validations
+    """
+    def __init__(self):
+        self.validations = 0
+        self.resource_groups = SimpleNamespace(
+            check_existence=lambda name: False, create_or_update=stub(None), delete=stub(None))
+        self.deployments = SimpleNamespace(validate=self.validate, create_or_update=stub(None))
+
+    def validate(self, group_name, deployment_name, properties):
+        self.validations += 1
+        return SimpleNamespace(error=None)
+
+
+def test_skip_validation(monkeypatch, tmpdir):
+    monkeypatch.setenv('DCOS_LAUNCH_CACHE_DIR', str(tmpdir))
+    template = {'parameters': {'name': {'type': 'string'}, 'count': {'type': 'int'}}}
+    wrapper = dcos_launch.platforms.arm.AzureWrapper.__new__(dcos_launch.platforms.arm.AzureWrapper)
+    wrapper.location = 'westus'
+    wrapper.rmc = MockTemplateDeployer()
+
+    def deploy(parameters, skip_validation=True):
+        wrapper.deploy_template_to_new_resource_group(
+            None, 'foo', parameters, template=template, skip_validation=skip_validation)
+
+    deploy({'name': 'a'}, skip_validation=False)
+    assert wrapper.rmc.validations == 1
+    # values do not matter, only parameter names and types
+    deploy({'name': 'b'})
+    assert wrapper.rmc.validations == 1
+    # parameters that have not been validated together before
+    deploy({'name': 'c', 'count': '2'})
+    assert wrapper.rmc.validations == 2
+    template['variables'] = {'changed': True}
+    deploy({'name': 'd'})
+    assert wrapper.rmc.validations == 3
+
+
+def test_get_delete_status():
+    groups = {'deleting': 'Deleting', 'failed': 'Succeeded'}
+    api = SimpleNamespace(resource_groups=SimpleNamespace(
+        check_existence=lambda name: name in groups,
+        get=lambda name: SimpleNamespace(properties=SimpleNamespace(provisioning_state=groups[name]))))
+    wrapper = SimpleNamespace(rmc=api)
+    statuses = [dcos_launch.platforms.arm.DcosAzureResourceGroup(name, wrapper).get_delete_status()
+                for name in ('deleting', 'failed', 'gone')]
+    assert statuses == ['pending', 'failed', 'complete']
@@ -1,6 +1,9 @@
+import json
 import re
 import shutil
 
+import dcos_launch
+import dcos_launch.util
 import pytest
 from dcos_launch.cli import main
 from docopt import DocoptExit
@@ -52,3 +55,70 @@ def test_version(capsys):
         main(['--version'])
     out, err = capsys.readouterr()
     assert re.compile("^dcos-launch \d+\.\d+\.\d+$").match(out) is not None
+
+
+def test_validate(tmpdir, capsys, monkeypatch):
+    monkeypatch.setenv('DCOS_LAUNCH_CACHE_DIR', str(tmpdir))
+    tmpdir.join('configs', 'gcp.yaml').write(
+        'launch_config_version: 1\nprovider: terraform\nplatform: gcp\nkey_helper: true\n', ensure=True)
+    tmpdir.join('configs', 'bad.yaml').write(
+        'launch_config_version: 1\nprovider: terraform\nplatform: foobar\n')
+    report_path = str(tmpdir.join('report.json'))
+    with tmpdir.as_cwd():
+        assert main(['validate', '-j', '2', '-o', report_path, 'configs/*.yaml', 'missing.yaml']) == 1
+    out, err = capsys.readouterr()
+    report = json.loads(out)
+    assert report == dcos_launch.util.load_json(report_path)
+    assert [c['config_path'] for c in report['configs']] == ['configs/bad.yaml', 'configs/gcp.yaml', 'missing.yaml']
+    assert [c['valid'] for c in report['configs']] == [False, True, False]
+    assert report['configs'][0]['error']['type'] == 'ValidationError'
+    assert report['configs'][2]['error']['type'] == 'MissingConfig'
+    assert (report['valid'], report['invalid']) == (1, 2)
+
+
+class MockDeletingLauncher:
+    """ Reports the delete status that its config asks for and records the deletions it finishes
+    """
+    finished = list()
+
+    def __init__(self, config):
+        self.config = config
+
+    def start_delete(self):
+        return {'deployment_name': self.config['deployment_name']}
+
+    def get_delete_status(self, pending_delete):
+        return self.config['delete_status']
+
+    def finish_delete(self, pending_delete):
+        self.finished.append(pending_delete['deployment_name'])
+
+
+def test_delete_no_wait_and_reap(tmpdir, capsys, monkeypatch):
+    monkeypatch.setattr(dcos_launch, 'get_launcher', MockDeletingLauncher)
+    info_dir = tmpdir.mkdir('infos')
+    for name, status in (('foo', 'complete'), ('bar', 'pending'), ('baz', 'failed')):
+        info_path = str(info_dir.join(name + '.info.json'))
+        dcos_launch.util.write_json(info_path, {'deployment_name': name, 'delete_status': status})
+        assert main(['delete', '--no-wait', '-i', info_path]) == 0
+        assert dcos_launch.util.load_json(info_path)['pending_delete']['status'] == 'pending'
+    dcos_launch.util.write_json(str(info_dir.join('qux.info.json')), {'deployment_name': 'qux'})
+    capsys.readouterr()
+
+    report_path = str(tmpdir.join('report.json'))
+    assert main(['reap', '-j', '2', '-o', report_path, str(info_dir.join('*.info.json'))]) == 1
+    report = json.loads(capsys.readouterr()[0])
+    assert report == dcos_launch.util.load_json(report_path)
+    assert [c['status'] for c in report['clusters']] == ['pending', 'failed', 'complete', None]
+    assert 'InputConflict' in report['clusters'][3]['error']
+    assert (report['pending'], report['complete'], report['failed'], report['errors']) == (1, 1, 1, 1)
+    assert MockDeletingLauncher.finished == ['foo']
+
+    # finished deletions are not checked again
+    foo_info_path = str(info_dir.join('foo.info.json'))
+    info = dcos_launch.util.load_json(foo_info_path)
+    info['delete_status'] = 'failed'
+    dcos_launch.util.write_json(foo_info_path, info)
+    assert main(['delete', '--status', '-i', foo_info_path]) == 0
+    assert json.loads(capsys.readouterr()[0])['clusters'][0]['status'] == 'complete'
+    assert MockDeletingLauncher.finished == ['foo']
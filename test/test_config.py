@@ -2,6 +2,7 @@ import os
 
 import pytest
 import yaml
+import dcos_launch.config
 from dcos_launch.config import LaunchValidator, get_validated_config_from_path, get_validated_config
 from dcos_launch.util import LauncherError, get_temp_config_path
 
@@ -172,3 +173,103 @@ class TestGcpOnprem:
         assert config['num_private_agents'] == 9
         assert config['num_public_agents'] == 5
         assert set(config['fault_domain_helper'].keys()) == {'Europe', 'USA', 'Asia'}
+
+    def test_with_zones(self, tmpdir, monkeypatch):
+        monkeypatch.delenv('GCE_ZONE', raising=False)
+        config_path = get_temp_config_path(
+            tmpdir, 'gcp-onprem-with-helper.yaml', update={'gce_zones': ['us-west1-b', 'us-west1-a']})
+        user_config = dcos_launch.config.load_config(config_path)
+        del user_config['gce_zone']
+        config = get_validated_config(user_config, str(tmpdir))
+        assert config['gce_zone'] == 'us-west1-b'
+        with pytest.raises(LauncherError) as exinfo:
+            get_validated_config_from_path(get_temp_config_path(
+                tmpdir, 'gcp-onprem-with-fd-helper.yaml', update={'gce_zones': ['us-west1-a']}))
+        assert 'fault_domain_helper' in exinfo.value.msg
+        # the instance group names must fit the GCE name limit
+        user_config['deployment_name'] = 'a' * 50
+        with pytest.raises(LauncherError) as exinfo:
+            get_validated_config(user_config, str(tmpdir))
+        assert 'gce_zones' in exinfo.value.msg
+
+
+class MockRelease:
+    def __init__(self, tag):
+        self.tag = tag
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {'tag_name': self.tag}
+
+
+def test_latest_github_release_cache(tmpdir, monkeypatch):
+    monkeypatch.setenv('DCOS_LAUNCH_CACHE_DIR', str(tmpdir))
+    lookups = list()
+
+    def mock_get(url, timeout=None):
+        assert timeout is not None
+        lookups.append(url)
+        return MockRelease('v0.11.11')
+    monkeypatch.setattr(dcos_launch.config.requests, 'get', mock_get)
+    get_release = dcos_launch.config.get_latest_github_release
+    assert get_release('hashicorp', 'terraform', '0.11.6') == '0.11.11'
+    assert get_release('hashicorp', 'terraform', '0.11.6') == '0.11.11'
+    assert len(lookups) == 1
+    # expired lookups are repeated
+    monkeypatch.setattr(dcos_launch.config, 'GITHUB_RELEASE_CACHE_TTL', 0)
+    assert get_release('hashicorp', 'terraform', '0.11.6') == '0.11.11'
+    assert len(lookups) == 2
+
+
+def test_latest_github_release_offline(tmpdir, monkeypatch):
+    monkeypatch.setenv('DCOS_LAUNCH_CACHE_DIR', str(tmpdir))
+    monkeypatch.setenv('DCOS_LAUNCH_OFFLINE', 'true')
+    monkeypatch.setattr(dcos_launch.config, 'GITHUB_RELEASE_CACHE_TTL', 0)
+
+    def mock_get(*args, **kwargs):
+        raise AssertionError('no network access in offline mode')
+    monkeypatch.setattr(dcos_launch.config.requests, 'get', mock_get)
+    get_release = dcos_launch.config.get_latest_github_release
+    assert get_release('Azure', 'dcos-engine', '0.2.0') == '0.2.0'
+    # a stale cache entry is still preferred over the default
+    tmpdir.join('github-releases', 'Azure-dcos-engine.json').write('{"version": "0.3.0", "time": 0}')
+    assert get_release('Azure', 'dcos-engine', '0.2.0') == '0.3.0'
+
+
+def test_resolved_versions(tmpdir, monkeypatch):
+    monkeypatch.setenv('DCOS_LAUNCH_CACHE_DIR', str(tmpdir))
+    monkeypatch.setenv('DCOS_LAUNCH_OFFLINE', 'true')
+    config = get_validated_config({
+        'launch_config_version': 1,
+        'platform': 'gcp',
+        'provider': 'terraform',
+        'key_helper': True}, str(tmpdir))
+    assert config['terraform_version'] == '0.11.6'
+    assert config['resolved_versions'] == {'terraform_version': {'version': '0.11.6', 'source': 'default'}}
+
+
+def test_single_validation_pass(tmpdir, monkeypatch):
+    lookups = list()
+
+    def mock_get_release(owner, repo, default):
+        lookups.append(repo)
+        return default
+    monkeypatch.setattr(dcos_launch.config, 'get_latest_github_release', mock_get_release)
+    user_config = {
+        'launch_config_version': 1,
+        'platform': 'gcp',
+        'provider': 'terraform',
+        'key_helper': True}
+    get_validated_config(dict(user_config), str(tmpdir))
+    assert lookups == ['terraform']
+    misses = dcos_launch.config._get_schema.cache_info().misses
+    get_validated_config(dict(user_config), str(tmpdir))
+    assert dcos_launch.config._get_schema.cache_info().misses == misses
+
+    # changes to a returned schema do not leak into the cached one
+    schema = dcos_launch.config.get_schema('terraform', 'gcp')
+    schema['key_helper']['nullable'] = True
+    schema.clear()
+    assert 'nullable' not in dcos_launch.config.get_schema('terraform', 'gcp')['key_helper']
@@ -0,0 +1,76 @@
+import io
+import json
+import os
+import stat
+import tarfile
+
+from dcos_launch import dcos_engine, util
+
+FAKE_DCOS_ENGINE = """#!/usr/bin/env python3
+import json
+import os
+import sys
+with open(sys.argv[2]) as f:
+    template = json.load(f)
+with open({calls!r}, 'a') as f:
+    f.write('generate\\n')
+output_dir = os.path.join('_output', template['properties']['masterProfile']['dnsPrefix'])
+os.makedirs(output_dir)
+with open(os.path.join(output_dir, 'azuredeploy.json'), 'w') as f:
+    json.dump({{'resources': []}}, f)
+with open(os.path.join(output_dir, 'azuredeploy.parameters.json'), 'w') as f:
+    json.dump({{'parameters': {{
+        'masterCount': {{'value': 1}},
+        'masterEndpointDNSNamePrefix': {{'value': template['properties']['masterProfile']['dnsPrefix']}}}}}}, f)
+"""
+
+
+def test_run_dcos_engine_cached(tmpdir, monkeypatch):
+    monkeypatch.setenv('DCOS_LAUNCH_CACHE_DIR', str(tmpdir.join('cache')))
+    calls = tmpdir.join('calls')
+    calls.write('')
+    tarball = io.BytesIO()
+    with tarfile.open(fileobj=tarball, mode='w:gz') as tar:
+        script = FAKE_DCOS_ENGINE.format(calls=str(calls)).encode()
+        info = tarfile.TarInfo('dcos-engine-v0.2.0-linux-amd64/dcos-engine')
+        info.size = len(script)
+        info.mode = stat.S_IRWXU
+        tar.addfile(info, io.BytesIO(script))
+    downloads = list()
+
+    def mock_download(url, path, sha256=None):
+        downloads.append(url)
+        with open(path, 'wb') as f:
+            f.write(tarball.getvalue())
+    monkeypatch.setattr(util, 'download_file', mock_download)
+
+    url = 'https://github.com/Azure/dcos-engine/releases/download/v0.2.0/dcos-engine-v0.2.0-linux-amd64.tar.gz'
+    template_args = ['ssh-rsa foo', 1, 'Standard_D2s_v3', 0, 'Standard_D2s_v3', 0, 'Standard_D2s_v3', 2,
+                     'Standard_D2s_v3', 1, 'Standard_D2s_v3', 'admin', 'password', 'dcos', '1.11']
+    template = dcos_engine.generate_dcos_engine_template(*template_args)
+    master_prefix = template['properties']['masterProfile']['dnsPrefix']
+    arm_template, parameters = dcos_engine.run_dcos_engine(url, template)
+    assert parameters == {'masterCount': 1, 'masterEndpointDNSNamePrefix': master_prefix}
+    assert calls.read().splitlines() == ['generate']
+
+    # every template gets its own DNS prefixes, which the cached output is given
+    other_template = dcos_engine.generate_dcos_engine_template(*template_args)
+    other_prefix = other_template['properties']['masterProfile']['dnsPrefix']
+    assert other_prefix != master_prefix
+    assert dcos_engine.run_dcos_engine(url, other_template) == (
+        arm_template, {'masterCount': 1, 'masterEndpointDNSNamePrefix': other_prefix})
+    assert calls.read().splitlines() == ['generate']
+
+    # a different template runs generate again, but reuses the binary
+    template_args[0] = 'ssh-rsa bar'
+    dcos_engine.run_dcos_engine(url, dcos_engine.generate_dcos_engine_template(*template_args))
+    assert calls.read().splitlines() == ['generate', 'generate']
+    assert downloads == [url]
+
+    # a corrupted binary is downloaded again
+    bin_path = dcos_engine.get_dcos_engine_binary(url)
+    with open(bin_path, 'a') as f:
+        f.write('corrupted')
+    assert dcos_engine.get_dcos_engine_binary(url) == bin_path
+    assert downloads == [url, url]
+    assert json.loads(open(os.path.join(os.path.dirname(bin_path), 'manifest.json')).read())['url'] == url
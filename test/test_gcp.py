@@ -0,0 +1,404 @@
+import json
+import re
+from unittest import mock
+
+import pytest
+
+import dcos_launch.gcp
+import dcos_launch.platforms.gcp
+import dcos_launch.util
+from dcos_launch.util import DeploymentError
+from dcos_test_utils.helpers import Host
+from googleapiclient.errors import HttpError
+
+
+class MockRequest:
+    def __init__(self, response):
+        self.response = response
+
+    def execute(self):
+        return self.response
+
+
+class MockGcpApi:
+    """ Serves both the compute and the deployment manager API for a deployment with a managed instance group. The
+    natIPs of the instances in pending_nat_ips are only assigned after they have been listed that many times
+    """
+    def __init__(self, vms: dict, pending_nat_ips: dict=None):
+        self.vms = vms
+        self.pending_nat_ips = pending_nat_ips or dict()
+        self.calls = list()
+
+    def deployments(self):
+        return self
+
+    def get(self, **kwargs):
+        self.calls.append(('get', kwargs))
+        return MockRequest({'name': kwargs['deployment'], 'operation': {'status': 'DONE'}})
+
+    def delete(self, **kwargs):
+        self.calls.append(('delete', kwargs))
+        return MockRequest({})
+
+    def instanceGroupManagers(self):
+        return self
+
+    def listManagedInstances(self, **kwargs):
+        self.calls.append(('listManagedInstances', kwargs))
+        return MockRequest({'managedInstances': [
+            {'instance': 'https://www.googleapis.com/compute/v1/projects/foo/zones/bar/instances/' + name}
+            for name in self.vms if self.get_zone(name) == kwargs['zone']]})
+
+    def get_zone(self, name: str) -> str:
+        """ vms are in us-west1-a unless their name is prefixed by another zone
+        """
+        return name.rsplit('-vm-', 1)[0] if '-vm-' in name else 'us-west1-a'
+
+    def instances(self):
+        return self
+
+    def list(self, **kwargs):
+        self.calls.append(('list', kwargs))
+        items = list()
+        for name, (private_ip, public_ip) in self.vms.items():
+            # filters have the form 'name eq <regex>'
+            if not re.fullmatch(kwargs['filter'].split(' ', 2)[2], name) or self.get_zone(name) != kwargs['zone']:
+                continue
+            access_config = dict()
+            if self.pending_nat_ips.get(name, 0) > 0:
+                self.pending_nat_ips[name] -= 1
+            else:
+                access_config['natIP'] = public_ip
+            items.append({'name': name, 'networkInterfaces': [
+                {'networkIP': private_ip, 'accessConfigs': [access_config]}]})
+        return MockRequest({'items': items})
+
+    def list_next(self, previous_request, previous_response):
+        return None
+
+
+@pytest.fixture
+def mock_gcp_api(monkeypatch):
+    compute = MockGcpApi({
+        'vm-b': ('10.0.0.2', '35.0.0.2'),
+        'vm-a': ('10.0.0.3', '35.0.0.3'),
+        'vm-c': ('10.0.0.1', '35.0.0.1')})
+
+    def mock_init(self, credentials_dict):
+        self.compute = compute
+        self.deployment_manager = compute
+        self.project_id = 'foo'
+    monkeypatch.setattr(dcos_launch.platforms.gcp.GcpWrapper, '__init__', mock_init)
+    monkeypatch.setattr(dcos_launch.platforms.gcp.time, 'sleep', lambda _: None)
+    return compute
+
+
+def get_deployment():
+    return dcos_launch.platforms.gcp.BareClusterDeployment(
+        dcos_launch.platforms.gcp.GcpWrapper(None), 'foo', ['us-west1-a'])
+
+
+def test_hosts_listed_in_one_call(mock_gcp_api):
+    assert get_deployment().hosts == [
+        Host('10.0.0.1', '35.0.0.1'), Host('10.0.0.2', '35.0.0.2'), Host('10.0.0.3', '35.0.0.3')]
+    assert [call for call, _ in mock_gcp_api.calls] == ['listManagedInstances', 'list']
+    assert mock_gcp_api.calls[1][1]['filter'] == 'name eq (vm\\-b|vm\\-a|vm\\-c)'
+
+
+def test_hosts_only_relist_pending_instances(mock_gcp_api):
+    mock_gcp_api.pending_nat_ips['vm-a'] = 2
+    assert len(get_deployment().hosts) == 3
+    assert [kwargs['filter'] for call, kwargs in mock_gcp_api.calls if call == 'list'] == [
+        'name eq (vm\\-b|vm\\-a|vm\\-c)', 'name eq (vm\\-a)', 'name eq (vm\\-a)']
+
+
+def test_hosts_timeout(mock_gcp_api, monkeypatch):
+    monkeypatch.setattr(dcos_launch.platforms.gcp, 'INSTANCE_NETWORK_TIMEOUT', -1)
+    mock_gcp_api.pending_nat_ips['vm-c'] = 1
+    with pytest.raises(DeploymentError):
+        get_deployment().hosts
+
+
+def test_hosts_spread_over_zones(mock_gcp_api):
+    mock_gcp_api.vms = {
+        'us-west1-b-vm-1': ('10.0.1.2', '35.0.1.2'),
+        'us-west1-b-vm-2': ('10.0.1.1', '35.0.1.1'),
+        'us-east1-c-vm-1': ('10.0.2.1', '35.0.2.1'),
+        'us-west1-a-vm-1': ('10.0.0.1', '35.0.0.1'),
+        'us-west1-a-vm-2': ('10.0.0.2', '35.0.0.2')}
+    deployment = dcos_launch.platforms.gcp.BareClusterDeployment(
+        dcos_launch.platforms.gcp.GcpWrapper(None), 'foo', ['us-west1-b', 'us-west1-a', 'us-east1-c'])
+    assert deployment.instance_group_names == {
+        'us-east1-c': 'foo-group-us-east1-c',
+        'us-west1-a': 'foo-group-us-west1-a',
+        'us-west1-b': 'foo-group-us-west1-b'}
+    # consecutive hosts are in different zones, which keep their configured order, and hosts within them are sorted
+    assert deployment.hosts == [
+        Host('10.0.1.1', '35.0.1.1'), Host('10.0.0.1', '35.0.0.1'), Host('10.0.2.1', '35.0.2.1'),
+        Host('10.0.1.2', '35.0.1.2'), Host('10.0.0.2', '35.0.0.2')]
+
+
+def test_create_multiple_zones(mock_gcp_api, monkeypatch):
+    created = list()
+    monkeypatch.setattr(dcos_launch.platforms.gcp.GcpWrapper, 'create_deployment',
+                        lambda self, name, deployment_config, tags: created.append(deployment_config))
+    dcos_launch.platforms.gcp.BareClusterDeployment.create(
+        dcos_launch.platforms.gcp.GcpWrapper(None), 'foo', ['us-west1-c', 'us-west1-a', 'us-west1-c', 'us-west1-b'],
+        10, 42, 'pd-ssd', 'family/centos-7', 'n1-standard-4', 'centos-cloud', 'centos', 'ssh-rsa foo', False, False)
+    groups = [r for r in created[0]['resources'] if r['type'] == 'compute.v1.instanceGroupManager']
+    # duplicate zones are dropped and the zones listed first get the extra nodes
+    assert [(g['name'], g['properties']['zone'], g['properties']['targetSize']) for g in groups] == [
+        ('foo-group-us-west1-c', 'us-west1-c', 4),
+        ('foo-group-us-west1-a', 'us-west1-a', 3),
+        ('foo-group-us-west1-b', 'us-west1-b', 3)]
+    # the groups can be created in parallel
+    assert all(g['metadata']['dependsOn'] == ['foo-template'] for g in groups)
+
+
+@pytest.fixture
+def launcher(mock_gcp_api, monkeypatch):
+    monkeypatch.setenv('GCE_CREDENTIALS', '{"project_id": "foo"}')
+    return dcos_launch.gcp.OnPremLauncher({
+        'deployment_name': 'foo',
+        'gce_zone': 'us-west1-a',
+        'num_masters': 1,
+        'num_private_agents': 1,
+        'num_public_agents': 0})
+
+
+def test_launcher_hosts_looked_up_once(launcher, mock_gcp_api):
+    assert launcher.get_bootstrap_host() == Host('10.0.0.1', '35.0.0.1')
+    assert launcher.get_cluster_hosts() == [Host('10.0.0.2', '35.0.0.2'), Host('10.0.0.3', '35.0.0.3')]
+    assert [call for call, _ in mock_gcp_api.calls] == ['get', 'listManagedInstances', 'list']
+
+
+def test_describe_api_calls(launcher, mock_gcp_api, monkeypatch):
+    launcher.describe()
+    launcher.describe()
+    assert [call for call, _ in mock_gcp_api.calls] == ['get', 'listManagedInstances', 'list']
+    # the checked deployment is kept and not looked up again
+    deployment = launcher.deployment
+    assert deployment.name == 'foo'
+    assert launcher.deployment is deployment
+    assert [call for call, _ in mock_gcp_api.calls].count('get') == 1
+    # hosts are looked up again after an invalidation, and the deployment once its info has expired
+    launcher.invalidate_deployment()
+    monkeypatch.setattr(dcos_launch.gcp, 'DEPLOYMENT_INFO_TTL', -1)
+    launcher.describe()
+    assert [call for call, _ in mock_gcp_api.calls].count('get') == 2
+    assert len(mock_gcp_api.calls) == 6
+    assert launcher.deployment is not deployment
+
+
+class MockDeploymentManager:
+    """ Reports the operation of a deployment as RUNNING for the given number of polls and another resource as
+    completed for every poll
+    """
+    def __init__(self, polls: int, resource_names: list):
+        self.polls = polls
+        self.resource_names = resource_names
+        self.calls = list()
+
+    def deployments(self):
+        return self
+
+    def operations(self):
+        return self
+
+    def resources(self):
+        return self
+
+    def get(self, **kwargs):
+        self.calls.append(('get', kwargs))
+        if 'operation' in kwargs:
+            self.polls -= 1
+        operation = {'name': 'op-1', 'status': 'RUNNING' if self.polls > 0 else 'DONE'}
+        if 'operation' in kwargs:
+            return MockRequest(operation)
+        return MockRequest({'name': kwargs['deployment'], 'operation': operation})
+
+    def list(self, **kwargs):
+        self.calls.append(('list', kwargs))
+        done = len([c for c in self.calls if c[0] == 'list'])
+        return MockRequest({'resources': [
+            {'name': name} if i < done else {'name': name, 'update': {'state': 'IN_PROGRESS'}}
+            for i, name in enumerate(self.resource_names)]})
+
+    def list_next(self, previous_request, previous_response):
+        return None
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """ Records sleeps instead of sleeping and advances the clock by them
+    """
+    sleeps = list()
+    monkeypatch.setattr(dcos_launch.platforms.gcp.time, 'sleep', sleeps.append)
+    monkeypatch.setattr(dcos_launch.platforms.gcp.time, 'time', lambda: sum(sleeps))
+    return sleeps
+
+
+def get_waiting_deployment(deployment_manager):
+    wrapper = dcos_launch.platforms.gcp.GcpWrapper.__new__(dcos_launch.platforms.gcp.GcpWrapper)
+    wrapper.project_id = 'foo'
+    wrapper.deployment_manager = deployment_manager
+    return dcos_launch.platforms.gcp.Deployment(wrapper, 'foo')
+
+
+def test_wait_for_completion_backoff(sleeps):
+    deployment_manager = MockDeploymentManager(7, ['network', 'template', 'group'])
+    info = get_waiting_deployment(deployment_manager).wait_for_completion()
+    assert info['operation']['status'] == 'DONE'
+    assert sleeps == [2, 4, 8, 16, 32, 60, 60]
+    assert [c[1]['operation'] for c in deployment_manager.calls if 'operation' in c[1]] == ['op-1'] * 7
+
+
+def test_wait_for_completion_already_done(sleeps):
+    deployment_manager = MockDeploymentManager(0, ['network'])
+    get_waiting_deployment(deployment_manager).wait_for_completion()
+    assert sleeps == []
+    assert len(deployment_manager.calls) == 1
+
+
+def test_wait_for_completion_deadline(sleeps):
+    with pytest.raises(DeploymentError):
+        get_waiting_deployment(MockDeploymentManager(100, ['network'])).wait_for_completion(timeout=35)
+    # the deployment is polled until the deadline, not only until the next interval would pass it
+    assert sleeps == [2, 4, 8, 16, 5]
+
+
+def test_wait_for_completion_failed(sleeps):
+    deployment = get_waiting_deployment(MockDeploymentManager(100, ['network']))
+    deployment.get_operation = lambda name: {'name': name, 'status': 'FAILED'}
+    with pytest.raises(DeploymentError):
+        deployment.wait_for_completion()
+    assert sleeps == [2]
+
+
+class MockBatchDeploymentManager:
+    """ Lists deployments whose names say whether they have an instance group and answers resource listings only
+    through batch requests
+    """
+    def __init__(self, names: list):
+        self.names = names
+        self.batches = list()
+
+    def deployments(self):
+        return self
+
+    def resources(self):
+        return self
+
+    def list(self, **kwargs):
+        if 'deployment' not in kwargs:
+            return MockRequest({'deployments': [
+                {'name': name, 'operation': {'operationType': 'deleted' if 'deleted' in name else 'insert'}}
+                for name in self.names]})
+        name = kwargs['deployment']
+        if 'gone' in name:
+            return HttpError(mock.Mock(status=404), b'')
+        resources = [{'type': 'compute.v1.network', 'properties': 'autoCreateSubnetworks: true\n'}]
+        if 'bare' in name:
+            resources.append({'type': 'compute.v1.instanceGroupManager', 'properties': 'zone: us-west1-a\n'})
+        return MockRequest({'resources': resources})
+
+    def list_next(self, previous_request, previous_response):
+        return None
+
+    def new_batch_http_request(self, callback):
+        manager = self
+
+        class MockBatch:
+            def __init__(self):
+                self.requests = list()
+
+            def add(self, request, request_id):
+                self.requests.append((request_id, request))
+
+            def execute(self):
+                manager.batches.append([request_id for request_id, _ in self.requests])
+                for request_id, request in self.requests:
+                    if isinstance(request, HttpError):
+                        callback(request_id, None, request)
+                    else:
+                        callback(request_id, request.execute(), None)
+        return MockBatch()
+
+
+def test_get_deployments_batched(monkeypatch):
+    monkeypatch.setattr(dcos_launch.platforms.gcp, 'GET_DEPLOYMENTS_BATCH_SIZE', 2)
+    names = ['bare-1', 'deleted-1', 'other-1', 'gone-1', 'bare-2', 'other-2']
+    deployment_manager = MockBatchDeploymentManager(names)
+    deployments = get_waiting_deployment(deployment_manager).gcp_wrapper.get_deployments()
+    first = next(deployments)
+    # deployments are yielded as soon as their batch is done
+    assert deployment_manager.batches == [['bare-1', 'other-1']]
+    deployments = [first] + list(deployments)
+    assert deployment_manager.batches == [['bare-1', 'other-1'], ['gone-1', 'bare-2'], ['other-2']]
+    assert [(d.name, type(d).__name__) for d in deployments] == [
+        ('bare-1', 'BareClusterDeployment'), ('other-1', 'Deployment'),
+        ('bare-2', 'BareClusterDeployment'), ('other-2', 'Deployment')]
+    assert deployments[0].zones == ['us-west1-a']
+
+
+def mock_discovery_document(name: str, version: str, resources: dict) -> dict:
+    return {
+        'kind': 'discovery#restDescription',
+        'name': name,
+        'version': version,
+        'rootUrl': 'https://www.googleapis.com/',
+        'servicePath': '{}/{}/projects/'.format(name, version),
+        'auth': {'oauth2': {'scopes': {'https://www.googleapis.com/auth/cloud-platform': {}}}},
+        'resources': {resource: {'methods': {method: {
+            'id': '{}.{}.{}'.format(name, resource, method),
+            'path': path,
+            'httpMethod': 'GET',
+            'parameters': {p: {'type': 'string', 'location': 'path', 'required': True}
+                           for p in re.findall('{(\\w+)}', path)},
+            'parameterOrder': re.findall('{(\\w+)}', path)} for method, path in methods.items()}}
+            for resource, methods in resources.items()}}
+
+
+def test_gcp_wrapper_built_offline(tmpdir, monkeypatch):
+    """ With cached discovery documents, the clients are built without any network access
+    """
+    monkeypatch.setenv('DCOS_LAUNCH_CACHE_DIR', str(tmpdir))
+    monkeypatch.setenv('DCOS_LAUNCH_OFFLINE', 'true')
+    monkeypatch.setattr(dcos_launch.platforms.gcp, 'DISCOVERY_DOCUMENT_TTL', -1)
+    monkeypatch.setattr(dcos_launch.util, 'download_file', mock.Mock(side_effect=Exception('no network access')))
+    tmpdir.join('gcp-discovery', 'compute-v1.json').write(json.dumps(mock_discovery_document(
+        'compute', 'v1', {'instances': {'list': '{project}/zones/{zone}/instances'}})), ensure=True)
+    tmpdir.join('gcp-discovery', 'deploymentmanager-v2.json').write(json.dumps(mock_discovery_document(
+        'deploymentmanager', 'v2', {'deployments': {'get': '{project}/global/deployments/{deployment}'}})))
+    private_key, _ = dcos_launch.util.generate_rsa_keypair()
+    wrapper = dcos_launch.platforms.gcp.GcpWrapper({
+        'type': 'service_account',
+        'project_id': 'foo',
+        'client_email': 'launch@foo.iam.gserviceaccount.com',
+        'client_id': '1',
+        'private_key_id': '1',
+        'private_key': private_key.decode()})
+    assert wrapper.compute.instances().list(project='foo', zone='us-west1-a').uri.split('?')[0] == \
+        'https://www.googleapis.com/compute/v1/projects/foo/zones/us-west1-a/instances'
+    assert wrapper.deployment_manager.deployments().get(project='foo', deployment='bar').uri.split('?')[0] == \
+        'https://www.googleapis.com/deploymentmanager/v2/projects/foo/global/deployments/bar'
+
+
+def test_discovery_document_cache(tmpdir, monkeypatch):
+    monkeypatch.setenv('DCOS_LAUNCH_CACHE_DIR', str(tmpdir))
+    downloads = list()
+
+    def mock_download(url, path):
+        downloads.append(url)
+        with open(path, 'w') as f:
+            f.write('{"version": "%d"}' % len(downloads))
+    monkeypatch.setattr(dcos_launch.util, 'download_file', mock_download)
+    get_document = dcos_launch.platforms.gcp.get_discovery_document
+    assert get_document('compute', 'v1') == '{"version": "1"}'
+    assert get_document('compute', 'v1') == '{"version": "1"}'
+    assert downloads == ['https://www.googleapis.com/discovery/v1/apis/compute/v1/rest']
+    # expired documents are downloaded again, unless that fails
+    monkeypatch.setattr(dcos_launch.platforms.gcp, 'DISCOVERY_DOCUMENT_TTL', -1)
+    assert get_document('compute', 'v1') == '{"version": "2"}'
+    monkeypatch.setattr(dcos_launch.util, 'download_file', mock.Mock(side_effect=Exception('unreachable')))
+    assert get_document('compute', 'v1') == '{"version": "2"}'
@@ -2,8 +2,13 @@ import collections
 import json
 import subprocess
 
+import pytest
+
 import dcos_launch
+import dcos_launch.platforms.onprem
 import dcos_test_utils
+from dcos_launch import util
+from dcos_launch.cli import main
 from dcos_test_utils import helpers
 
 
@@ -49,6 +54,258 @@ def test_gcp_onprem_with_helper(check_cli_success, gcp_onprem_with_helper_config
     assert 'bootstrap_host' in desc
 
 
+def test_aws_onprem_upgrade(aws_onprem_config_path, tmpdir):
+    new_installer_url = 'https://downloads.dcos.io/dcos/stable/dcos_generate_config.sh'
+    info_path = str(tmpdir.join('upgrade_info.json'))
+    assert main(['create', '--config-path={}'.format(aws_onprem_config_path), '--info-path={}'.format(info_path)]) == 0
+    assert main(['wait', '--info-path={}'.format(info_path)]) == 0
+    assert main(['upgrade', '--info-path={}'.format(info_path), new_installer_url]) == 0
+    with open(info_path) as f:
+        info = json.load(f)
+    assert info['installer_url'] == new_installer_url
+    assert info['upgrade_waves'] == []
+
+
+def test_upgrade_not_supported(aws_cf_config_path, tmpdir):
+    info_path = str(tmpdir.join('upgrade_info.json'))
+    assert main(['create', '--config-path={}'.format(aws_cf_config_path), '--info-path={}'.format(info_path)]) == 0
+    assert main(['upgrade', '--info-path={}'.format(info_path), 'https://foo/dcos_generate_config.sh']) == 1
+
+
+def test_upgrade_waves():
+    masters = [helpers.Host('10.0.0.' + str(i), None) for i in range(3)]
+    private_agents = [helpers.Host('10.0.1.' + str(i), None) for i in range(5)]
+    public_agents = [helpers.Host('10.0.2.' + str(i), None) for i in range(1)]
+    cluster = collections.namedtuple('Cluster', 'masters private_agents public_agents')(
+        masters, private_agents, public_agents)
+    waves = dcos_launch.platforms.onprem.get_upgrade_waves(cluster, 2)
+    assert [role for role, _ in waves] == ['master'] * 3 + ['private_agent'] * 3 + ['public_agent']
+    assert all(len(hosts) == 1 for role, hosts in waves if role == 'master')
+    assert [len(hosts) for role, hosts in waves if role == 'private_agent'] == [2, 2, 1]
+    assert [h for _, hosts in waves for h in hosts] == masters + private_agents + public_agents
+
+
+class MockWaveClient:
+    """ Stands in for the AsyncSshClient of an upgrade wave and records which command ran on
+    which hosts. The health check fails on the hosts in failing_hosts
+    """
+    def __init__(self, runs: list, failing_hosts: set):
+        self.runs = runs
+        self.failing_hosts = failing_hosts
+
+    def __call__(self, user, key, targets, parallelism, process_timeout):
+        self.targets = targets
+        return self
+
+    def run_command(self, action, cmd):
+        command = 'upgrade' if 'dcos_node_upgrade.sh' in cmd[0] else 'health_check'
+        self.runs.append((command, list(self.targets)))
+        return [{'host': host, 'cmd': cmd, 'stdout': b'', 'stderr': b'',
+                 'returncode': 1 if command == 'health_check' and host in self.failing_hosts else 0}
+                for host in self.targets]
+
+
+class MockNodeClient(dcos_test_utils.ssh_client.SshClient):
+    def __init__(self):
+        super().__init__('core', 'key')
+
+    def command(self, host, cmd, **kwargs):
+        return b'journal of ' + host.encode()
+
+
+def get_upgrade_cluster():
+    return collections.namedtuple('Cluster', 'masters private_agents public_agents')(
+        [helpers.Host('10.0.0.' + str(i), '34.0.0.' + str(i)) for i in range(3)],
+        [helpers.Host('10.0.1.' + str(i), '34.0.1.' + str(i)) for i in range(5)],
+        [helpers.Host('10.0.2.' + str(i), '34.0.2.' + str(i)) for i in range(1)])
+
+
+def test_upgrade_dcos(monkeypatch):
+    runs = list()
+    monkeypatch.setattr(dcos_launch.platforms.onprem.ssh_client, 'AsyncSshClient', MockWaveClient(runs, set()))
+    timings = dcos_launch.platforms.onprem.upgrade_dcos(
+        get_upgrade_cluster(), MockNodeClient(), 'http://10.0.0.9/dcos_node_upgrade.sh', 2)
+    # every wave is upgraded and then health checked before the next one starts
+    assert [command for command, _ in runs] == ['upgrade', 'health_check'] * 7
+    assert [hosts for command, hosts in runs if command == 'upgrade'] == [
+        ['34.0.0.0'], ['34.0.0.1'], ['34.0.0.2'],
+        ['34.0.1.0', '34.0.1.1'], ['34.0.1.2', '34.0.1.3'], ['34.0.1.4'],
+        ['34.0.2.0']]
+    assert [t['role'] for t in timings] == ['master'] * 3 + ['private_agent'] * 3 + ['public_agent']
+    assert timings[3]['hosts'] == ['34.0.1.0', '34.0.1.1']
+
+
+def test_upgrade_dcos_failing_health_check(tmpdir, monkeypatch):
+    runs = list()
+    monkeypatch.setattr(dcos_launch.platforms.onprem.ssh_client, 'AsyncSshClient',
+                        MockWaveClient(runs, {'34.0.1.1'}))
+    with tmpdir.as_cwd():
+        with pytest.raises(Exception) as exinfo:
+            dcos_launch.platforms.onprem.upgrade_dcos(
+                get_upgrade_cluster(), MockNodeClient(), 'http://10.0.0.9/dcos_node_upgrade.sh', 2)
+    assert 'upgrade wave 3 (private_agent) health check' in str(exinfo.value)
+    # the later waves were never started
+    assert runs[-1] == ('health_check', ['34.0.1.0', '34.0.1.1'])
+    assert len(runs) == 8
+    assert tmpdir.join('upgrade wave 3 (private_agent) health check-34.0.1.1-journald.log').read() == \
+        'journal of 34.0.1.1'
+
+
+class RecordingTunnel:
+    def __init__(self, images: list):
+        self.images = images
+        self.commands = list()
+        self.copies = list()
+
+    def command(self, cmd, **kwargs):
+        self.commands.append(cmd)
+        if cmd[:3] == ['sudo', 'docker', 'images']:
+            return b'abc123' if cmd[-1] in self.images else b''
+        return b''
+
+    def copy_file(self, src, dst):
+        self.copies.append((src, dst))
+
+
+def test_pull_docker_image_from_mirror():
+    t = RecordingTunnel(images=[])
+    dcos_launch.platforms.onprem.pull_docker_image(t, 'nginx:1.15.2', 'mirror.local:5000/')
+    assert t.commands[1:] == [
+        ['sudo', 'docker', 'pull', 'mirror.local:5000/nginx:1.15.2'],
+        ['sudo', 'docker', 'tag', 'mirror.local:5000/nginx:1.15.2', 'nginx:1.15.2']]
+    # nothing is pulled if the image is already there
+    t = RecordingTunnel(images=['nginx:1.15.2'])
+    dcos_launch.platforms.onprem.pull_docker_image(t, 'nginx:1.15.2', 'mirror.local:5000')
+    assert len(t.commands) == 1
+
+
+def test_load_docker_images():
+    t = RecordingTunnel(images=['nginx:1.15.2'])
+    dcos_launch.platforms.onprem.load_docker_images(t, ['nginx:1.15.2', 'jplock/zookeeper'], '/tmp/images.tar')
+    assert t.copies == [('/tmp/images.tar', 'bootstrap_docker_images.tar')]
+    assert ['sudo', 'docker', 'load', '--input', 'bootstrap_docker_images.tar'] in t.commands
+    t = RecordingTunnel(images=['nginx:1.15.2', 'jplock/zookeeper'])
+    dcos_launch.platforms.onprem.load_docker_images(t, ['nginx:1.15.2', 'jplock/zookeeper'], '/tmp/images.tar')
+    assert t.copies == []
+
+
+def test_bundled_prereqs_script():
+    script = dcos_launch.platforms.onprem.get_bundled_prereqs_script(
+        '#!/usr/bin/env bash\necho prereqs', 'http://10.0.0.1/prereqs')
+    assert script.split('\n') == [
+        '#!/usr/bin/env bash', "export PREREQS_REPO_URL='http://10.0.0.1/prereqs'", 'echo prereqs']
+
+
+def test_prereqs_bundle_wiring(tmpdir, ssh_key_path, mocked_aws_cfstack_bare_cluster, monkeypatch):
+    config_path = util.get_temp_config_path(tmpdir, 'aws-onprem.yaml', update={
+        'ssh_private_key_filename': ssh_key_path,
+        'install_prereqs': True,
+        'prereqs_bundle': True})
+    config = dcos_launch.config.get_validated_config_from_path(config_path)
+    built = list()
+    monkeypatch.setattr(dcos_launch.platforms.onprem, 'do_build_prereqs_bundle', lambda *args: built.append(args))
+    install_args = list()
+    monkeypatch.setattr(dcos_launch.platforms.onprem, 'install_dcos', lambda *args, **kwargs: install_args.extend(args))
+    launcher = dcos_launch.get_launcher(config)
+    launcher = dcos_launch.get_launcher(launcher.create())
+    launcher.install_dcos()
+    assert len(built) == 1
+    prereqs_script_path = install_args[2]
+    assert prereqs_script_path.startswith(config['genconf_dir'])
+    with open(prereqs_script_path) as f:
+        # the mocked bootstrap host has a private IP of 127.0.0.1
+        assert "export PREREQS_REPO_URL='http://127.0.0.1/prereqs'" in f.read()
+
+
+def test_install_journal_resume(tmpdir):
+    journal_path = str(tmpdir.join('cluster_info.journal.json'))
+    hosts = [helpers.Host('10.0.0.1', '1.1.1.1'), helpers.Host('10.0.0.2', '2.2.2.2')]
+    node_client = collections.namedtuple('NodeClient', 'command')(lambda *args, **kwargs: b'')
+    dispatched = list()
+
+    def preflight(fail_host):
+        def action(pending):
+            dispatched.append([h.public_ip for h in pending])
+            return [{'host': h.public_ip, 'returncode': 1 if h.public_ip == fail_host else 0, 'cmd': ['preflight'],
+                     'stdout': b'', 'stderr': b''} for h in pending]
+        return action
+
+    journal = util.PhaseJournal(dcos_launch.platforms.onprem.INSTALL_PHASES, journal_path)
+    with tmpdir.as_cwd():
+        with pytest.raises(Exception):
+            dcos_launch.platforms.onprem.run_phase(journal, 'preflight', hosts, node_client, preflight('2.2.2.2'))
+    # a new journal from the same path only re-runs the failed host
+    journal = util.PhaseJournal(dcos_launch.platforms.onprem.INSTALL_PHASES, journal_path)
+    dcos_launch.platforms.onprem.run_phase(journal, 'preflight', hosts, node_client, preflight(None))
+    dcos_launch.platforms.onprem.run_phase(journal, 'preflight', hosts, node_client, preflight(None))
+    assert dispatched == [['1.1.1.1', '2.2.2.2'], ['2.2.2.2']]
+
+    journal.mark_complete('postflight', ['1.1.1.1'])
+    journal.restart('deploy')
+    journal = util.PhaseJournal(dcos_launch.platforms.onprem.INSTALL_PHASES, journal_path)
+    assert journal.is_complete('preflight', '1.1.1.1')
+    assert not journal.is_complete('postflight', '1.1.1.1')
+    with pytest.raises(util.LauncherError):
+        journal.restart('foobar')
+
+
+def test_install_phase_retry(tmpdir):
+    hosts = [helpers.Host('10.0.0.1', '1.1.1.1'), helpers.Host('10.0.0.2', '2.2.2.2')]
+    node_client = collections.namedtuple('NodeClient', 'command')(lambda *args, **kwargs: b'')
+    dispatched = list()
+    # 2.2.2.2 fails its first two attempts
+    returncodes = {'1.1.1.1': [0], '2.2.2.2': [7, 7, 0]}
+
+    def action(pending):
+        dispatched.append([h.public_ip for h in pending])
+        return [{'host': h.public_ip, 'returncode': returncodes[h.public_ip].pop(0), 'cmd': ['prereqs'],
+                 'stdout': b'', 'stderr': b''} for h in pending]
+
+    journal = util.PhaseJournal(dcos_launch.platforms.onprem.INSTALL_PHASES)
+    policy = dcos_launch.platforms.onprem.get_retry_policy(
+        {'default': {'backoff': 0}, 'prereqs': {'retries': 2, 'retryable_exit_codes': [7]}}, 'prereqs')
+    dcos_launch.platforms.onprem.run_phase(journal, 'prereqs', hosts, node_client, action, retry_policy=policy)
+    assert dispatched == [['1.1.1.1', '2.2.2.2'], ['2.2.2.2'], ['2.2.2.2']]
+    assert journal.report['prereqs']['attempts'] == {'1.1.1.1': 1, '2.2.2.2': 3}
+
+    # exit codes that are not retryable fail the phase right away
+    returncodes = {'1.1.1.1': [0], '2.2.2.2': [1, 0]}
+    dispatched.clear()
+    journal = util.PhaseJournal(dcos_launch.platforms.onprem.INSTALL_PHASES)
+    with tmpdir.as_cwd():
+        with pytest.raises(Exception):
+            dcos_launch.platforms.onprem.run_phase(journal, 'prereqs', hosts, node_client, action, retry_policy=policy)
+    assert dispatched == [['1.1.1.1', '2.2.2.2']]
+    assert journal.is_complete('prereqs', '1.1.1.1')
+
+
+def test_install_prereqs_partial_copy(tmpdir, monkeypatch):
+    hosts = [helpers.Host('10.0.0.1', '1.1.1.1'), helpers.Host('10.0.0.2', '2.2.2.2')]
+    commands = list()
+
+    class MockAsyncSshClient:
+        def __init__(self, user, key, targets, **kwargs):
+            self.targets = targets
+
+        def run_command(self, method, *args):
+            commands.append((method, self.targets))
+            # the copy to 2.2.2.2 fails
+            return [{'host': t, 'returncode': 1 if method == 'copy' and t == '2.2.2.2' else 0, 'cmd': [method],
+                     'stdout': b'', 'stderr': b''} for t in self.targets]
+    monkeypatch.setattr(dcos_launch.platforms.onprem.ssh_client, 'AsyncSshClient', MockAsyncSshClient)
+    node_client = collections.namedtuple('NodeClient', 'user key command')('centos', 'key', lambda *a, **k: b'')
+    journal = util.PhaseJournal(dcos_launch.platforms.onprem.INSTALL_PHASES)
+    with tmpdir.as_cwd():
+        with pytest.raises(Exception):
+            dcos_launch.platforms.onprem.run_phase(
+                journal, 'prereqs', hosts, node_client,
+                lambda pending: dcos_launch.platforms.onprem.do_install_prereqs(pending, node_client, 'prereqs.sh'))
+    # the script only runs where the copy succeeded, and only that host is journaled
+    assert commands == [('copy', ['1.1.1.1', '2.2.2.2']), ('run', ['1.1.1.1'])]
+    assert journal.is_complete('prereqs', '1.1.1.1')
+    assert not journal.is_complete('prereqs', '2.2.2.2')
+
+
 def test_fault_domain_helper(check_cli_success, gcp_onprem_with_fd_helper_config_path, monkeypatch, tmpdir):
 
     config = dcos_launch.config.get_validated_config_from_path(gcp_onprem_with_fd_helper_config_path)
@@ -0,0 +1,424 @@
+import hashlib
+import io
+import json
+import os
+import stat
+import subprocess
+import time
+import zipfile
+
+import pytest
+import yaml
+
+from dcos_launch import terraform, util
+from dcos_launch.cli import main
+
+FAKE_TERRAFORM = """#!/bin/sh
+echo "$@ $TF_PLUGIN_CACHE_DIR" >> {calls}
+if [ "$2" = "-from-module" ]; then
+    [ -d "$3" ] && cp -r "$3"/. .
+    mkdir -p .terraform/modules
+fi
+"""
+
+
+@pytest.fixture
+def fake_terraform(tmpdir, monkeypatch):
+    monkeypatch.setenv('DCOS_LAUNCH_CACHE_DIR', str(tmpdir.join('cache')))
+    monkeypatch.delenv('TF_PLUGIN_CACHE_DIR', raising=False)
+    calls = tmpdir.join('calls')
+    binary = tmpdir.join('terraform')
+    binary.write(FAKE_TERRAFORM.format(calls=str(calls)))
+    os.chmod(str(binary), stat.S_IRWXU)
+    return str(binary), calls
+
+
+def test_init_from_module_cache(tmpdir, fake_terraform):
+    binary, calls = fake_terraform
+    module = tmpdir.mkdir('module')
+    module.join('main.tf').write('resource "null_resource" "foo" {}')
+    for name in ('init-1', 'init-2'):
+        terraform.init_from_module(binary, str(module), str(tmpdir.mkdir(name)))
+        assert tmpdir.join(name, 'main.tf').check()
+        assert tmpdir.join(name, '.terraform', 'modules').check(dir=True)
+    plugin_cache = str(tmpdir.join('cache', 'terraform', 'plugins'))
+    # the module was only fetched once and every init used the shared plugin cache
+    assert calls.read().splitlines() == [
+        'init -from-module {} {}'.format(module, plugin_cache),
+        'init {}'.format(plugin_cache),
+        'init {}'.format(plugin_cache)]
+
+    # a changed local module is fetched again
+    module.join('variables.tf').write('variable "foo" {}')
+    os.utime(str(module.join('variables.tf')), (0, os.path.getmtime(str(module.join('main.tf'))) + 10))
+    terraform.init_from_module(binary, str(module), str(tmpdir.mkdir('init-3')))
+    assert tmpdir.join('init-3', 'variables.tf').check()
+
+
+def test_init_from_module_plugin_lock(tmpdir, fake_terraform, monkeypatch):
+    binary, calls = fake_terraform
+    module = tmpdir.mkdir('module')
+    module.join('main.tf').write('resource "null_resource" "foo" {}')
+    locks = list()
+    file_lock = terraform.filelock.FileLock
+
+    def recording_lock(path):
+        locks.append(os.path.basename(path))
+        return file_lock(path)
+    monkeypatch.setattr(terraform.filelock, 'FileLock', recording_lock)
+    for name in ('init-1', 'init-2', 'init-3'):
+        terraform.init_from_module(binary, str(module), str(tmpdir.mkdir(name)))
+    # only the first inits of the module can add plugins to the cache
+    assert locks.count('plugins.lock') == 2
+    assert len(calls.read().splitlines()) == 4
+
+
+def test_init_from_module_moving_ref(tmpdir, fake_terraform):
+    binary, calls = fake_terraform
+    branch = 'github.com/dcos/terraform-dcos?ref=master/aws'
+    tag = 'github.com/dcos/terraform-dcos?ref=v0.1.0/aws'
+    for name, module in (('init-1', branch), ('init-2', branch), ('init-3', tag), ('init-4', tag)):
+        terraform.init_from_module(binary, module, str(tmpdir.mkdir(name)))
+    plugin_cache = str(tmpdir.join('cache', 'terraform', 'plugins'))
+    # a branch is downloaded every time, a tag only once
+    assert calls.read().splitlines() == [
+        'init -from-module {} {}'.format(branch, plugin_cache),
+        'init -from-module {} {}'.format(branch, plugin_cache),
+        'init -from-module {} {}'.format(tag, plugin_cache),
+        'init {}'.format(plugin_cache),
+        'init {}'.format(plugin_cache)]
+
+
+def test_init_from_module_no_cache(tmpdir, fake_terraform):
+    binary, calls = fake_terraform
+    module = tmpdir.mkdir('module')
+    module.join('main.tf').write('resource "null_resource" "foo" {}')
+    terraform.init_from_module(binary, str(module), str(tmpdir.mkdir('init')), use_cache=False)
+    assert tmpdir.join('init', 'main.tf').check()
+    assert len(calls.read().splitlines()) == 1
+    assert not tmpdir.join('cache', 'terraform', 'modules').check()
+
+
+class MockDownload:
+    def __init__(self, content: bytes):
+        self.content = content
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+
+def test_download_file_checksum(tmpdir, monkeypatch):
+    content = b'terraform' * 1000
+    monkeypatch.setattr(util.requests, 'get', lambda *args, **kwargs: MockDownload(content))
+    path = str(tmpdir.join('download'))
+    util.download_file('https://example.com/foo.zip', path, sha256=hashlib.sha256(content).hexdigest())
+    assert tmpdir.join('download').read_binary() == content
+    with pytest.raises(util.LauncherError):
+        util.download_file('https://example.com/foo.zip', str(tmpdir.join('bad')), sha256='0' * 64)
+    assert not tmpdir.join('bad').check()
+    assert not tmpdir.join('bad.part').check()
+
+
+def test_install_terraform_cached(tmpdir, monkeypatch):
+    monkeypatch.setenv('DCOS_LAUNCH_CACHE_DIR', str(tmpdir.join('cache')))
+    zip_bytes = io.BytesIO()
+    with zipfile.ZipFile(zip_bytes, 'w') as z:
+        z.writestr('terraform', '#!/bin/sh')
+    downloads = list()
+
+    def mock_get(url, **kwargs):
+        downloads.append(url)
+        return MockDownload(zip_bytes.getvalue())
+    monkeypatch.setattr(util.requests, 'get', mock_get)
+    monkeypatch.setattr(terraform, 'get_terraform_sha256', lambda url: hashlib.sha256(zip_bytes.getvalue()).hexdigest())
+    config = {
+        'init_dir': str(tmpdir.join('terraform-init-1')),
+        'terraform_version': '0.11.8',
+        'terraform_tarball_url': 'https://releases.hashicorp.com/terraform/0.11.8/terraform_0.11.8_linux_amd64.zip'}
+    launcher = terraform.AwsLauncher(config)
+    launcher._install_terraform()
+    binary = str(tmpdir.join('cache', 'terraform', '0.11.8', 'terraform'))
+    assert launcher.terraform_cmd() == binary
+    # a second cluster with the same version reuses the binary
+    config['init_dir'] = str(tmpdir.join('terraform-init-2'))
+    launcher = terraform.AwsLauncher(config)
+    assert launcher.terraform_cmd() == binary
+    launcher._install_terraform()
+    assert len(downloads) == 1
+
+    # a mirror gets its own binary and is verified with the configured checksum only
+    config.update({
+        'terraform_tarball_url': 'https://mirror.example.com/terraform_0.11.8_linux_amd64.zip',
+        'terraform_tarball_sha256': hashlib.sha256(zip_bytes.getvalue()).hexdigest()})
+    monkeypatch.setattr(terraform, 'get_terraform_sha256', stub_fail)
+    launcher = terraform.AwsLauncher(config)
+    assert launcher.terraform_binary != binary
+    launcher._install_terraform()
+    assert launcher.terraform_cmd() == launcher.terraform_binary
+    assert downloads[1] == config['terraform_tarball_url']
+
+    config['terraform_tarball_sha256'] = '0' * 64
+    config['terraform_tarball_url'] += '?corrupt'
+    with pytest.raises(util.LauncherError):
+        terraform.AwsLauncher(config)._install_terraform()
+
+
+def _resource(resource_type: str, attributes: dict) -> dict:
+    return {'type': resource_type, 'primary': {'id': 'foo', 'attributes': attributes}}
+
+
+AWS_STATE = {
+    'version': 3,
+    'modules': [{
+        'path': ['root'],
+        'outputs': {
+            'Bootstrap Host Public IP': {'type': 'string', 'value': '34.0.0.1'},
+            'Master ELB Public IP': {'type': 'string', 'value': 'master-elb.amazonaws.com'},
+            'Master Public IPs': {'type': 'list', 'value': ['34.0.0.2']},
+            'Private Agent Public IPs': {'type': 'list', 'value': ['34.0.0.3', '34.0.0.4']},
+            'Public Agent Public IPs': {'type': 'list', 'value': ['34.0.0.5']},
+            'ssh_user': {'type': 'string', 'value': 'centos'}},
+        'resources': {
+            'aws_instance.bootstrap': _resource('aws_instance', {'public_ip': '34.0.0.1', 'private_ip': '10.0.0.1'}),
+            'aws_instance.master': _resource('aws_instance', {'public_ip': '34.0.0.2', 'private_ip': '10.0.0.2'}),
+            'aws_instance.agent.0': _resource('aws_instance', {'public_ip': '34.0.0.3', 'private_ip': '10.0.0.3'}),
+            'aws_instance.agent.1': _resource('aws_instance', {'public_ip': '34.0.0.4', 'private_ip': '10.0.0.4'}),
+            'aws_instance.public-agent': _resource(
+                'aws_instance', {'public_ip': '34.0.0.5', 'private_ip': '10.0.0.5'})}}]}
+
+
+def stub_fail(*args, **kwargs):
+    raise AssertionError('state should have been cached')
+
+
+def test_describe_from_state(tmpdir, monkeypatch):
+    init_dir = tmpdir.mkdir('terraform-init')
+    util.write_json(str(init_dir.join('terraform.tfstate')), AWS_STATE)
+    config = {'init_dir': str(init_dir), 'terraform_version': '0.11.8'}
+    launcher = terraform.AwsLauncher(config)
+    desc = launcher.describe()
+    assert config['ssh_user'] == 'centos'
+    assert desc['bootstrap_host'] == [{'private_ip': '10.0.0.1', 'public_ip': '34.0.0.1'}]
+    assert desc['masters'] == [{'private_ip': '10.0.0.2', 'public_ip': '34.0.0.2'}]
+    assert desc['private_agents'] == [
+        {'private_ip': '10.0.0.3', 'public_ip': '34.0.0.3'},
+        {'private_ip': '10.0.0.4', 'public_ip': '34.0.0.4'}]
+    assert desc['public_agents'] == [{'private_ip': '10.0.0.5', 'public_ip': '34.0.0.5'}]
+    assert desc['Master ELB Public IP'] == 'master-elb.amazonaws.com'
+    assert 'Public Agent ELB Public IP' not in desc
+
+    # the parsed state is reused until the state file changes
+    monkeypatch.setattr(util, 'load_json', stub_fail)
+    assert launcher.describe() == desc
+
+
+def test_describe_from_state_0_12(tmpdir):
+    init_dir = tmpdir.mkdir('terraform-init')
+    util.write_json(str(init_dir.join('terraform.tfstate')), {
+        'version': 4,
+        'terraform_version': '0.12.29',
+        'outputs': AWS_STATE['modules'][0]['outputs'],
+        'resources': [{
+            'mode': 'managed',
+            'type': 'google_compute_instance',
+            'name': 'master',
+            'instances': [{'index_key': 0, 'attributes': {'network_interface': [{
+                'network_ip': '10.0.0.2',
+                'access_config': [{'nat_ip': '34.0.0.2'}]}]}}]}]})
+    config = {'init_dir': str(init_dir), 'terraform_version': '0.12.29'}
+    desc = terraform.AwsLauncher(config).describe()
+    assert config['ssh_user'] == 'centos'
+    assert desc['masters'] == [{'private_ip': '10.0.0.2', 'public_ip': '34.0.0.2'}]
+    assert desc['public_agents'] == [{'private_ip': None, 'public_ip': '34.0.0.5'}]
+
+
+def test_read_state_unsupported_version(tmpdir):
+    state_path = str(tmpdir.join('terraform.tfstate'))
+    util.write_json(state_path, {'version': 5})
+    with pytest.raises(util.LauncherError) as exinfo:
+        terraform.read_state(state_path)
+    assert exinfo.value.error == 'UnsupportedTerraformState'
+    assert 'version 5' in exinfo.value.msg
+
+
+def test_private_ips_azure():
+    nic_id = '/subscriptions/foo/networkInterfaces/master-nic'
+    ip_id = '/subscriptions/foo/publicIPAddresses/master-ip'
+    private_ips = terraform._get_private_ips([
+        ('azurerm_public_ip', {'id': ip_id, 'ip_address': '40.0.0.1'}),
+        ('azurerm_network_interface', {
+            'id': nic_id,
+            'ip_configuration.0.public_ip_address_id': ip_id,
+            'ip_configuration.0.private_ip_address': '10.0.0.1'})])
+    assert private_ips == {'40.0.0.1': '10.0.0.1'}
+
+
+def test_describe_from_output_json(tmpdir, monkeypatch):
+    outputs = {name: {'sensitive': False, 'type': output['type'], 'value': output['value']}
+               for name, output in AWS_STATE['modules'][0]['outputs'].items()}
+
+    class MockResult:
+        stdout = json.dumps(outputs).encode()
+    monkeypatch.setattr(terraform.subprocess, 'run', lambda *args, **kwargs: MockResult)
+    config = {'init_dir': str(tmpdir.mkdir('terraform-init')), 'terraform_version': '0.11.8'}
+    desc = terraform.AwsLauncher(config).describe()
+    assert desc['masters'] == [{'private_ip': None, 'public_ip': '34.0.0.2'}]
+
+
+def test_fleet(tmpdir, monkeypatch, mocked_terraform):
+    created = list()
+
+    def mock_create(self):
+        created.append(self.config)
+        if self.config['terraform_config']['owner'] == 'broken':
+            self.create_exception = Exception('apply failed')
+        return self.config
+    monkeypatch.setattr(terraform.TerraformLauncher, 'create', mock_create)
+    config_paths = list()
+    for owner in ('foo', 'bar', 'broken'):
+        config_path = tmpdir.join(owner + '.yaml')
+        config_path.write(yaml.dump({
+            'launch_config_version': 1,
+            'platform': 'gcp',
+            'provider': 'terraform',
+            'terraform_version': '0.11.8',
+            'key_helper': True,
+            'terraform_config': {'owner': owner}}))
+        config_paths.append(str(config_path))
+    info_dir = tmpdir.join('infos')
+    with tmpdir.as_cwd():
+        assert main(['fleet', '-j', '2', '-d', str(info_dir)] + config_paths) == 1
+    assert len(created) == 3
+    assert all(c['terraform_parallelism'] == terraform.FLEET_TERRAFORM_PARALLELISM // 2 for c in created)
+    assert util.load_json(str(info_dir.join('foo.info.json')))['terraform_config']['owner'] == 'foo'
+    summary = util.load_json(str(info_dir.join('fleet_summary.json')))
+    assert [c['config_path'] for c in summary['clusters']] == config_paths
+    assert [c['error'] is None for c in summary['clusters']] == [True, True, False]
+    # info JSONs are never overwritten
+    assert main(['fleet', '-d', str(info_dir)] + config_paths) == 1
+    assert len(created) == 3
+
+
+def test_fleet_launcher_error(tmpdir, monkeypatch, mocked_terraform):
+    def mock_create(self):
+        if self.config['terraform_config']['owner'] == 'broken':
+            raise util.LauncherError('ClusterAlreadyExists', 'init dir is in use')
+        return self.config
+    monkeypatch.setattr(terraform.TerraformLauncher, 'create', mock_create)
+    configs = list()
+    for owner in ('broken', 'foo'):
+        configs.append({
+            'provider': 'terraform',
+            'platform': 'gcp',
+            'init_dir': str(tmpdir.join(owner)),
+            'terraform_config': {'owner': owner}})
+    results = terraform.create_fleet(configs, 2)
+    assert [info['terraform_config']['owner'] for info, _, _ in results] == ['broken', 'foo']
+    assert results[0][1].error == 'ClusterAlreadyExists'
+    assert results[1][1] is None
+
+
+APPLY_OUTPUT = """module.dcos-bootstrap.aws_instance.bootstrap: Creating...
+  ami: "" => "ami-123"
+module.masters.aws_instance.master[0]: Creating...
+module.dcos-bootstrap.aws_instance.bootstrap: Still creating... (10s elapsed)
+module.dcos-bootstrap.aws_instance.bootstrap: Creation complete after 45s (ID: i-1)
+module.masters.aws_instance.master[0]: Creation complete after 1m30s (ID: i-2)
+aws_elb.public-agent-elb: Creating...
+
+Error: Error applying plan:
+
+1 error(s) occurred:
+
+* aws_elb.public-agent-elb: timeout while waiting for state to become 'available'
+"""
+
+
+def test_terraform_progress():
+    events = list()
+    progress = terraform.TerraformProgress('apply', on_event=events.append)
+    for line in APPLY_OUTPUT.splitlines():
+        progress.feed(line)
+    assert [(e['resource'], e['status']) for e in events] == [
+        ('module.dcos-bootstrap.aws_instance.bootstrap', 'started'),
+        ('module.masters.aws_instance.master[0]', 'started'),
+        ('module.dcos-bootstrap.aws_instance.bootstrap', 'completed'),
+        ('module.masters.aws_instance.master[0]', 'completed'),
+        ('aws_elb.public-agent-elb', 'started')]
+    summary = progress.get_summary()
+    assert summary['slowest_resources'] == [
+        {'resource': 'module.masters.aws_instance.master[0]', 'action': 'creating', 'seconds': 90},
+        {'resource': 'module.dcos-bootstrap.aws_instance.bootstrap', 'action': 'creating', 'seconds': 45}]
+    assert summary['unfinished_resources'] == ['aws_elb.public-agent-elb']
+    assert len(summary['errors']) == 2
+
+
+def test_run_with_progress(tmpdir):
+    output = tmpdir.join('output')
+    output.write(APPLY_OUTPUT)
+    progress = terraform.TerraformProgress('apply')
+    with pytest.raises(terraform.subprocess.CalledProcessError) as exinfo:
+        terraform.run_with_progress(['sh', '-c', 'cat {}; exit 1'.format(output)], str(tmpdir), progress)
+    assert 'timeout while waiting' in exinfo.value.output
+    assert progress.get_summary()['num_resources'] == 2
+
+
+def test_delete_no_wait(tmpdir, fake_terraform):
+    binary, calls = fake_terraform
+    init_dir = tmpdir.mkdir('terraform-init')
+    launcher = terraform.AwsLauncher({'init_dir': str(init_dir), 'terraform_version': '0.11.8'})
+    pending_delete = launcher.start_delete()
+    for _ in range(100):
+        status = launcher.get_delete_status(pending_delete)
+        if status != util.DELETE_PENDING:
+            break
+        time.sleep(0.1)
+    assert status == util.DELETE_COMPLETE
+    assert calls.read().startswith('destroy -no-color -var-file {} -parallelism 10 -force'.format(
+        launcher.cluster_profile_path))
+    launcher.finish_delete(pending_delete)
+    assert not init_dir.check()
+
+
+def test_delete_no_wait_killed(tmpdir):
+    launcher = terraform.AwsLauncher({'init_dir': str(tmpdir.mkdir('terraform-init')), 'terraform_version': '0.11.8'})
+    proc = subprocess.Popen(['true'])
+    proc.wait()
+    assert launcher.get_delete_status({'pid': proc.pid}) == util.DELETE_FAILED
+    tmpdir.join('terraform-init', terraform.DESTROY_EXIT_CODE_NAME).write('1\n')
+    assert launcher.get_delete_status({'pid': proc.pid}) == util.DELETE_FAILED
+    tmpdir.join('terraform-init', terraform.DESTROY_EXIT_CODE_NAME).write('0\n')
+    assert launcher.get_delete_status({'pid': proc.pid}) == util.DELETE_COMPLETE
+
+
+@pytest.mark.skipif(not os.path.exists('/proc/self/stat'), reason='needs /proc')
+def test_delete_no_wait_pid_reused(tmpdir):
+    launcher = terraform.AwsLauncher({'init_dir': str(tmpdir.mkdir('terraform-init')), 'terraform_version': '0.11.8'})
+    start_time = terraform._get_process_start_time(os.getpid())
+    assert start_time is not None
+    assert launcher.get_delete_status({'pid': os.getpid(), 'process_start_time': start_time}) == util.DELETE_PENDING
+    # the PID now belongs to a process that is not terraform destroy
+    assert launcher.get_delete_status(
+        {'pid': os.getpid(), 'process_start_time': str(int(start_time) - 1)}) == util.DELETE_FAILED
+
+
+def test_delete_no_wait_exit_race(tmpdir, monkeypatch):
+    init_dir = tmpdir.mkdir('terraform-init')
+    launcher = terraform.AwsLauncher({'init_dir': str(init_dir), 'terraform_version': '0.11.8'})
+
+    def mock_is_process_running(pid, start_time):
+        # destroy finishes right after its exit code was first looked for
+        init_dir.join(terraform.DESTROY_EXIT_CODE_NAME).write('0\n')
+        return False
+    monkeypatch.setattr(terraform, '_is_process_running', mock_is_process_running)
+    assert launcher.get_delete_status({'pid': 1, 'process_start_time': None}) == util.DELETE_COMPLETE